@@ -0,0 +1,6 @@
+"""Run all benchmarks with `python -m benchmarks` from the src folder."""
+from benchmarks import bench_patiencediff, bench_matchers, bench_linetable, bench_merge, bench_diff, bench_ooxml
+
+
+for benchmark in (bench_patiencediff, bench_matchers, bench_linetable, bench_merge, bench_diff, bench_ooxml):
+    benchmark.main()
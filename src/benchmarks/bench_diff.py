@@ -0,0 +1,43 @@
+"""Benchmark the rendering of workbook diffs in diff.py.
+
+Workbooks are replaced by in-memory stand-ins, so only the diffing and
+rendering is measured. Run from the src folder with `python -m benchmarks.bench_diff`.
+"""
+import random
+
+from diff import diff_workbooks
+
+from benchmarks.common import (FakeCell, FakeVBAModule, FakeWorkbook, FakeWorksheet, generate_vba_module,
+                               generate_worksheet, edit, install_workbooks, report)
+
+
+def edit_worksheet(worksheet, seed, n_edits):
+    rnd = random.Random(seed)
+    cells = list(worksheet.cells)
+    for i in rnd.sample(range(len(cells)), n_edits):
+        cell = cells[i]
+        cells[i] = FakeCell(cell.address, cell.row, cell.column, -cell.value)
+    return FakeWorksheet(worksheet.name, cells)
+
+
+def generate_workbooks(seed, n_modules, n_lines, n_rows):
+    modules_old, modules_new = [], []
+    for i in range(n_modules):
+        lines = generate_vba_module(seed + i, n_lines)
+        modules_old.append(FakeVBAModule(f'Module{i}', 'Module', '\n'.join(lines)))
+        modules_new.append(FakeVBAModule(f'Module{i}', 'Module', '\n'.join(edit(lines, seed + i, n_lines // 100))))
+    sheet = generate_worksheet(seed, 'Sheet1', n_rows)
+    return (FakeWorkbook([sheet], modules_old),
+            FakeWorkbook([edit_worksheet(sheet, seed, n_rows // 10)], modules_new))
+
+
+def main():
+    for n_modules, n_lines, n_rows in ((10, 1000, 1000), (50, 5000, 10000)):
+        old, new = generate_workbooks(n_modules, n_modules, n_lines, n_rows)
+        with install_workbooks({'old.xlsb': old, 'new.xlsb': new}):
+            report(f'diff_workbooks {n_modules}x{n_lines} lines, {n_rows} rows',
+                   diff_workbooks, 'Book1.xlsb', 'old.xlsb', 'new.xlsb')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Benchmark the time and peak memory of matching and merging module text as split lines and as line tables.
+
+Run from the src folder with `python -m benchmarks.bench_linetable`.
+"""
+from linetable import LineTable
+from matchers import MyersSequenceMatcher
+from merge import Merge3
+
+from benchmarks.common import generate_vba_module, edit, report
+
+
+def diff_split(text_b, text_a):
+    matcher = MyersSequenceMatcher(None, text_b.split('\n'), text_a.split('\n'))
+    return list(matcher.get_grouped_opcodes(3))
+
+
+def diff_table(text_b, text_a):
+    matcher = MyersSequenceMatcher(None, LineTable(text_b), LineTable(text_a))
+    return list(matcher.get_grouped_opcodes(3))
+
+
+def merge_split(text_x, text_a, text_b):
+    m3 = Merge3(text_x.split('\n'), text_a.split('\n'), text_b.split('\n'))
+    return '\n'.join(m3.merge_lines(name_a='ours', name_b='theirs'))
+
+
+def merge_table(text_x, text_a, text_b):
+    m3 = Merge3(LineTable(text_x), LineTable(text_a), LineTable(text_b))
+    return m3.merge_text(name_a='ours', name_b='theirs')
+
+
+def main():
+    for n_lines in (10000, 100000):
+        base = generate_vba_module(n_lines, n_lines)
+        text_x = '\n'.join(base)
+        text_a = '\n'.join(edit(base, n_lines + 1, n_lines // 100))
+        text_b = '\n'.join(edit(base, n_lines + 2, n_lines // 100))
+        report(f'diff split lines {n_lines} lines', diff_split, text_x, text_a)
+        report(f'diff line tables {n_lines} lines', diff_table, text_x, text_a)
+        report(f'merge split lines {n_lines} lines', merge_split, text_x, text_a, text_b)
+        report(f'merge line tables {n_lines} lines', merge_table, text_x, text_a, text_b)
+
+
+if __name__ == '__main__':
+    main()
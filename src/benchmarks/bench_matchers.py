@@ -0,0 +1,50 @@
+"""Benchmark the diff algorithms on synthetic VBA modules of up to 100k lines.
+
+Run from the src folder with `python -m benchmarks.bench_matchers`.
+"""
+import random
+import difflib
+
+from matchers import DIFF_ALGORITHMS, MAX_OPERATIONS, TIMEOUT
+from merge import Merge3
+
+from benchmarks.common import generate_vba_module, edit, report
+
+
+def matching_blocks(matcher, a, b):
+    return matcher(None, a, b).get_matching_blocks()
+
+
+def budgeted_matching_blocks(matcher, a, b):
+    return matcher(None, a, b, timeout=TIMEOUT, max_operations=MAX_OPERATIONS).get_matching_blocks()
+
+
+def merge_lines(matcher, base, a, b):
+    return list(Merge3(base, a, b, sequencematcher=matcher).merge_lines())
+
+
+def main():
+    for n_lines in (10000, 100000):
+        a = generate_vba_module(n_lines, n_lines)
+        b = edit(a, n_lines, n_lines // 100)
+        report(f'difflib get_matching_blocks {n_lines} lines', matching_blocks, difflib.SequenceMatcher, a, b)
+        for name, matcher in sorted(DIFF_ALGORITHMS.items()):
+            report(f'{name} get_matching_blocks {n_lines} lines', matching_blocks, matcher, a, b)
+
+    n_lines = 100000
+    base = generate_vba_module(n_lines, n_lines)
+    a = edit(base, n_lines + 1, n_lines // 100)
+    b = edit(base, n_lines + 2, n_lines // 100)
+    for name, matcher in sorted(DIFF_ALGORITHMS.items()):
+        report(f'{name} Merge3.merge_lines {n_lines} lines', merge_lines, matcher, base, a, b)
+
+    # pathological input: the same lines in a different order; the budget bounds the time
+    shuffled = list(base)
+    random.Random(n_lines).shuffle(shuffled)
+    for name, matcher in sorted(DIFF_ALGORITHMS.items()):
+        report(f'{name} get_matching_blocks {n_lines} shuffled lines', budgeted_matching_blocks, matcher,
+               base, shuffled, repeat=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Benchmark Merge3 and merge3_lists on synthetic VBA modules and module names.
+
+Run from the src folder with `python -m benchmarks.bench_merge`.
+"""
+from merge import Merge3, merge3_lists
+
+from benchmarks.common import generate_vba_module, generate_module_names, edit, report
+
+
+def merge_lines(base, a, b):
+    return list(Merge3(base, a, b).merge_lines())
+
+
+def is_conflicted(base, a, b):
+    return Merge3(base, a, b).is_conflicted()
+
+
+def main():
+    for n_lines in (1000, 10000, 50000):
+        base = generate_vba_module(n_lines, n_lines)
+        a = edit(base, n_lines + 1, n_lines // 100)
+        b = edit(base, n_lines + 2, n_lines // 100)
+        report(f'Merge3.merge_lines {n_lines} lines', merge_lines, base, a, b)
+        report(f'Merge3.is_conflicted {n_lines} lines', is_conflicted, base, a, b)
+
+    for n_names in (1000, 10000, 50000):
+        x = generate_module_names(n_names, n_names)
+        a = x[n_names // 10:] + generate_module_names(n_names + 1, n_names // 10, prefix='Ours')
+        b = x[:-n_names // 10] + generate_module_names(n_names + 2, n_names // 10, prefix='Theirs')
+        report(f'merge3_lists {n_names} names', merge3_lists, a, b, x)
+
+
+if __name__ == '__main__':
+    main()
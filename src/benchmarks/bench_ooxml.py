@@ -0,0 +1,92 @@
+"""Benchmark reading .xlsx manifests with the pure Python reader and with xltrail-core.
+
+xltrail-core is skipped where it cannot be loaded. Run from the src folder
+with `python -m benchmarks.bench_ooxml`.
+"""
+import os
+import random
+import zipfile
+import tempfile
+
+import ooxml
+from cache import manifest_from_workbook
+from diff import diff_workbooks
+
+from benchmarks.common import report
+
+
+WORKBOOK = ('<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>')
+RELS = ('<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/></Relationships>')
+
+
+def write_workbook(path, seed, n_rows, n_columns=10, title=''):
+    """Write a package with one sheet of numbers, formulas and shared strings."""
+    rnd = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('docProps/core.xml', f'<coreProperties><title>{title}</title></coreProperties>')
+        z.writestr('xl/workbook.xml', WORKBOOK)
+        z.writestr('xl/_rels/workbook.xml.rels', RELS)
+        z.writestr('xl/sharedStrings.xml', '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">' +
+                   ''.join(f'<si><t>String {i}</t></si>' for i in range(1000)) + '</sst>')
+        with z.open('xl/worksheets/sheet1.xml', 'w') as f:
+            f.write(b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            for row in range(1, n_rows + 1):
+                cells = []
+                for column in range(n_columns):
+                    address = chr(ord('A') + column) + str(row)
+                    if column == 0:
+                        cells.append(f'<c r="{address}" t="s"><v>{rnd.randrange(1000)}</v></c>')
+                    elif column == 1:
+                        cells.append(f'<c r="{address}"><f>B{row}*2</f><v>{rnd.random()}</v></c>')
+                    else:
+                        cells.append(f'<c r="{address}"><v>{rnd.randint(0, 10000)}</v></c>')
+                f.write(f'<row r="{row}">{"".join(cells)}</row>'.encode())
+            f.write(b'</sheetData></worksheet>')
+
+
+def read_manifest(backend, path):
+    return manifest_from_workbook(backend(path))
+
+
+def load_xltrail_core():
+    """Return the Workbook class of xltrail-core, or None where it cannot be loaded.
+
+    The assembly is loaded here rather than with `workbook.load_engine`, which
+    returns whatever engine was installed before, e.g. the stand-ins of
+    other benchmarks.
+    """
+    try:
+        import clr
+        clr.AddReference('xltrail-core')
+        from xltrail.core import Workbook
+    except Exception:
+        return None
+    return Workbook
+
+
+def main():
+    engine = load_xltrail_core()
+    if engine is None:
+        print('xltrail-core not available, only the pure Python reader is measured')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in (10000, 100000):
+            path = os.path.join(tmp_dir, f'Book{n_rows}.xlsx')
+            write_workbook(path, n_rows, n_rows)
+            size = os.path.getsize(path) / 1024 / 1024
+            report(f'ooxml manifest {n_rows} rows ({size:.1f} MB)', read_manifest, ooxml.Workbook, path, repeat=1)
+            if engine is not None:
+                report(f'xltrail-core manifest {n_rows} rows ({size:.1f} MB)', read_manifest, engine, path, repeat=1)
+
+            # only the document properties changed, so the sheet part is skipped by its CRC
+            other = os.path.join(tmp_dir, f'Other{n_rows}.xlsx')
+            write_workbook(other, n_rows, n_rows, title='changed')
+            report(f'diff_workbooks {n_rows} rows, sheet unchanged', diff_workbooks, 'Book1.xlsx', path, other)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""Benchmark PatienceSequenceMatcher on synthetic VBA modules.
+
+Run from the src folder with `python -m benchmarks.bench_patiencediff`.
+"""
+from patiencediff import PatienceSequenceMatcher
+
+from benchmarks.common import generate_vba_module, edit, report
+
+
+def matching_blocks(a, b):
+    return PatienceSequenceMatcher(None, a, b).get_matching_blocks()
+
+
+def main():
+    for n_lines in (1000, 10000, 50000):
+        a = generate_vba_module(n_lines, n_lines)
+        b = edit(a, n_lines, n_lines // 100)
+        report(f'get_matching_blocks {n_lines} lines', matching_blocks, a, b)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Synthetic inputs and measurement helpers shared by the benchmarks.
+
+Inputs are generated from seeds, so every run measures the same work. The
+in-memory workbook stand-in replaces xltrail-core, so the benchmarks also run
+where the .NET engine is not available.
+"""
+import time
+import random
+import hashlib
+import contextlib
+import tracemalloc
+
+import workbook
+
+
+def generate_vba_module(seed, n_lines):
+    """Return the lines of a VBA module with many duplicate lines (End Sub, blank lines, ...)."""
+    rnd = random.Random(seed)
+    lines = ['Option Explicit', '']
+    while len(lines) < n_lines:
+        name = f'Proc{len(lines)}'
+        lines.append(f'Public Sub {name}()')
+        for _ in range(rnd.randint(2, 20)):
+            lines.append(rnd.choice([
+                '    Dim i As Long',
+                '    On Error GoTo ErrHandler',
+                f'    Debug.Print "{name}"',
+                f'    x = x + {rnd.randint(0, 1000)}',
+                '    End If',
+                '',
+            ]))
+        lines.append('End Sub')
+        lines.append('')
+    return lines
+
+
+def edit(lines, seed, n_edits):
+    """Return a copy of `lines` with random insertions, deletions and modifications."""
+    rnd = random.Random(seed)
+    lines = list(lines)
+    for i in range(n_edits):
+        pos = rnd.randrange(len(lines))
+        op = rnd.random()
+        if op < 0.3:
+            del lines[pos]
+        elif op < 0.6:
+            lines.insert(pos, f'    y = {i}')
+        else:
+            lines[pos] = f'    z = {i}'
+    return lines
+
+
+def generate_module_names(seed, n_names, prefix='Module'):
+    rnd = random.Random(seed)
+    return [f'{prefix}{i}' for i in rnd.sample(range(n_names * 10), n_names)]
+
+
+class Cells(list):
+    """List of cells with the `Count` property of the .NET collection."""
+
+    @property
+    def Count(self):
+        return len(self)
+
+
+class FakeCell:
+
+    def __init__(self, address, row, column, value, formula=None):
+        self.address = address
+        self.row = row
+        self.column = column
+        self.value = value
+        self.formula = formula
+
+
+class FakeWorksheet:
+
+    def __init__(self, name, cells):
+        self.name = name
+        self.cells = Cells(cells)
+        self.digest = hashlib.sha1(repr([(c.address, c.value, c.formula) for c in cells]).encode()).hexdigest()
+
+
+class FakeVBAModule:
+
+    def __init__(self, name, type, content):
+        self.name = name
+        self.type = type
+        self.content = content
+        self.digest = hashlib.sha1(content.encode()).hexdigest()
+
+
+class FakeWorkbook:
+
+    def __init__(self, worksheets, vba_modules):
+        self.worksheets = worksheets
+        self.vba_modules = vba_modules
+
+
+def generate_worksheet(seed, name, n_rows, n_columns=10):
+    rnd = random.Random(seed)
+    cells = []
+    for row in range(1, n_rows + 1):
+        for column in range(1, n_columns + 1):
+            address = chr(ord('A') + column - 1) + str(row)
+            cells.append(FakeCell(address, row, column, float(rnd.randint(0, 1000))))
+    return FakeWorksheet(name, cells)
+
+
+@contextlib.contextmanager
+def install_workbooks(workbooks):
+    """Make `load_workbook(path)` return `workbooks[path]` instead of loading xltrail-core, within the block.
+
+    The engine that was loaded before is restored afterwards, so that later
+    benchmarks do not get the stand-ins.
+    """
+    previous = workbook._Workbook
+    workbook._Workbook = workbooks.__getitem__
+    try:
+        yield
+    finally:
+        workbook._Workbook = previous
+
+
+def measure(func, *args, repeat=3):
+    """Return (best seconds, peak allocated bytes) of calling `func(*args)`.
+
+    Memory is traced in a separate call, as tracing slows down allocations.
+    """
+    seconds = min(timeit(func, *args) for _ in range(repeat))
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def report(name, func, *args, repeat=3):
+    seconds, peak = measure(func, *args, repeat=repeat)
+    print(f'{name:<40} {seconds * 1000:10.1f} ms, peak {peak / 1024 / 1024:7.1f} MB')
@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import subprocess
+from collections import namedtuple
+
+import tracing
+from workbook import load_workbook
+
+
+CACHE_DIR = 'xl-cache'
+MAX_CACHE_SIZE = 256 * 1024 * 1024
+# the cache is pruned on about one in this many puts, as pruning stats every entry
+PRUNE_INTERVAL = 256
+MANIFEST_VERSION = 2
+
+Worksheet = namedtuple('Worksheet', ['name', 'digest', 'cells'])
+VBAModule = namedtuple('VBAModule', ['name', 'type', 'digest', 'content'])
+Manifest = namedtuple('Manifest', ['worksheets', 'vba_modules'])
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Return the Git blob id of a file (same as `git hash-object`)."""
+    h = hashlib.sha1(b'blob %d\0' % os.path.getsize(path))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_from_workbook(wb):
+    with tracing.phase('read_manifest') as fields:
+        worksheets = [Worksheet(sheet.name, sheet.digest, sheet.cells.Count) for sheet in wb.worksheets]
+        vba_modules = [VBAModule(m.name, m.type, m.digest, m.content) for m in wb.vba_modules]
+        fields.update(sheets=len(worksheets), modules=len(vba_modules))
+    return Manifest(worksheets, vba_modules)
+
+
+def get_git_dir(path='.'):
+    """Return the absolute path of the Git directory, or None outside a repository."""
+    cmd = subprocess.run(['git', 'rev-parse', '--git-dir'], cwd=path, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    git_dir = cmd.stdout.split('\n')[0]
+    if cmd.returncode or not git_dir:
+        return None
+    return os.path.abspath(os.path.join(path, git_dir))
+
+
+def get_cache_dir(path='.'):
+    """Return the cache directory inside the Git directory, or None outside a repository."""
+    git_dir = get_git_dir(path)
+    if git_dir is None:
+        return None
+    return os.path.join(git_dir, CACHE_DIR)
+
+
+class ManifestCache:
+    """Content-addressed on-disk cache of workbook manifests.
+
+    Entries are stored as `<dir>/<key[:2]>/<key[2:]>.json`. The modification
+    time of an entry is bumped on every hit, so pruning by modification time
+    evicts the least recently used manifests first. Puts prune the cache only
+    for keys (blob ids) that are divisible by `PRUNE_INTERVAL`, so processes
+    that each put a few manifests share the pruning without any bookkeeping.
+    """
+
+    def __init__(self, path, max_size=MAX_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.json')
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != MANIFEST_VERSION:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return Manifest(
+            worksheets=[Worksheet(*sheet) for sheet in data['worksheets']],
+            vba_modules=[VBAModule(*module) for module in data['vba_modules']])
+
+    def put(self, key, manifest):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = {
+            'version': MANIFEST_VERSION,
+            'worksheets': [list(sheet) for sheet in manifest.worksheets],
+            'vba_modules': [list(module) for module in manifest.vba_modules]
+        }
+        # write to a temporary file first so concurrent readers never see partial entries
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        if int(key[:8], 16) % PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def entries(self):
+        """Return (mtime, size, path) of all cache entries, least recently used first."""
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def prune(self, max_size=None):
+        """Evict least recently used entries until the cache fits into `max_size` bytes.
+
+        Returns the number of evicted entries.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            evicted += 1
+        return evicted
+
+
+def load_manifest(path, cache=None):
+    """Return the manifest of the workbook at `path`, opening it only on a cache miss."""
+    if cache is None:
+        return manifest_from_workbook(load_workbook(path))
+    with tracing.phase('cache_lookup', path=path) as fields:
+        key = file_digest(path)
+        manifest = cache.get(key)
+        fields['hit'] = manifest is not None
+    if manifest is None:
+        manifest = manifest_from_workbook(load_workbook(path))
+        cache.put(key, manifest)
+    return manifest
@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 import sys
 import os
+import json
+import time
 import fnmatch
 import argparse
+import tempfile
+import functools
 import subprocess
-import clr
+import multiprocessing
+import collections
 import colorama
 
-clr.AddReference('xltrail-core')
-from xltrail.core import Workbook
+import diff
+import vba
+import server
+import tracing
+import history
+from cache import Manifest, ManifestCache, VBAModule, get_cache_dir, get_git_dir, load_manifest
 
 
 VERSION = '0.0.0'
@@ -18,6 +27,7 @@ FILE_EXTENSIONS = ['xls', 'xlt', 'xla', 'xlam', 'xlsx', 'xlsm', 'xlsb', 'xltx',
 GIT_ATTRIBUTES_DIFFER = ['*.' + file_ext + ' diff=xl' for file_ext in FILE_EXTENSIONS]
 GIT_ATTRIBUTES_MERGER = ['*.' + file_ext + ' merge=xl' for file_ext in FILE_EXTENSIONS]
 GIT_IGNORE = ['~$*.' + file_ext for file_ext in FILE_EXTENSIONS]
+LS_FILES_TIMEOUT = 300
 
 
 def is_frozen():
@@ -32,6 +42,219 @@ def is_git_repository(path):
     return False
 
 
+def list_workbooks(pattern=None, others=False, path='.'):
+    """Yield the paths of workbooks in the repository, as reported by `git ls-files`.
+
+    Paths are yielded while git is still running, so output can start right
+    away in huge repositories. With `others`, untracked files that are not
+    ignored are included. Excel lock files (~$*) and files missing from the
+    working tree (e.g. outside a sparse checkout) are skipped, and unmerged
+    paths, which git lists once per stage, are yielded once.
+    """
+    command = ['git', 'ls-files', '-z']
+    if others:
+        command += ['--cached', '--others', '--exclude-standard']
+    process = subprocess.Popen(command, cwd=path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        buffer = b''
+        previous = None
+        for chunk in iter(lambda: process.stdout.read1(64 * 1024), b''):
+            *entries, buffer = (buffer + chunk).split(b'\0')
+            for entry in entries:
+                # the stages of an unmerged path are listed one after another
+                if entry == previous:
+                    continue
+                previous = entry
+                f = os.fsdecode(entry)
+                filename = os.path.basename(f)
+                if filename.startswith('~$'):
+                    continue
+                if pattern is None:
+                    if filename.rsplit('.', 1)[-1].lower() not in FILE_EXTENSIONS:
+                        continue
+                elif not fnmatch.fnmatch(filename, pattern):
+                    continue
+                if os.path.isfile(os.path.join(path, f)):
+                    yield f
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+def read_vba_modules(path):
+    try:
+        return [VBAModule(m.name, m.type, m.digest, m.content) for m in vba.read_vba_modules(path)]
+    except Exception as e:
+        # .NET exceptions cannot be pickled back from pool workers
+        raise RuntimeError(str(e)) from None
+
+
+def read_all_vba_modules(paths, jobs=1, timeout=None):
+    """Yield (path, vba_modules, error) for each workbook, in the order of `paths`.
+
+    With more than one job (or a timeout), workbooks are read in a process
+    pool. A workbook that takes longer than `timeout` seconds is reported as
+    an error and the pool is replaced, so that a stuck worker cannot stall
+    the remaining workbooks.
+    """
+    return run_jobs(read_vba_modules, paths, jobs=jobs, timeout=timeout)
+
+
+def run_jobs(func, items, jobs=1, timeout=None):
+    """Yield (item, func(item), error) for each item, in the order of `items`.
+
+    `func` reports failures by raising RuntimeError. With more than one job
+    (or a timeout), items are processed in a process pool of `jobs` workers.
+    At most `jobs` items are in flight, so every item starts as soon as it is
+    submitted and `timeout` counts from then; an item that takes longer than
+    `timeout` seconds is reported as an error and the pool is replaced.
+    """
+    if jobs == 1 and timeout is None:
+        for item in items:
+            try:
+                yield item, func(item), None
+            except RuntimeError as e:
+                yield item, None, str(e)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    pending = collections.deque()
+    items = iter(items)
+    try:
+        while True:
+            # keep one item in flight per worker, so that no item waits for a worker
+            for item in items:
+                pending.append((item, time.monotonic(), pool.apply_async(func, (item,))))
+                if len(pending) >= jobs:
+                    break
+            if not pending:
+                return
+
+            item, started, result = pending.popleft()
+            try:
+                wait = None if timeout is None else max(0, started + timeout - time.monotonic())
+                yield item, result.get(wait), None
+            except multiprocessing.TimeoutError:
+                yield item, None, f'timed out after {timeout:g} seconds'
+                pool.terminate()
+                pool = multiprocessing.Pool(jobs)
+                pending = collections.deque(
+                    (item, time.monotonic(), pool.apply_async(func, (item,))) for item, _, _ in pending)
+            except RuntimeError as e:
+                yield item, None, str(e)
+    finally:
+        pool.terminate()
+
+
+def is_workbook_path(name):
+    """Return whether a path names a workbook, leaving out Excel lock files (~$*)."""
+    filename = os.path.basename(name)
+    return not filename.startswith('~$') and filename.rsplit('.', 1)[-1].lower() in FILE_EXTENSIONS
+
+
+def list_changed_workbooks(rev_a, rev_b, paths=(), path='.'):
+    """Return (name, blob_a, blob_b) for the workbooks that differ between two revisions.
+
+    All changes are read with a single `git diff --raw` call and returned in
+    path order; the blob id is None on the side where the workbook does not
+    exist.
+    """
+    command = ['git', 'diff', '--raw', '-z', '--no-abbrev', '--no-renames', rev_a, rev_b, '--'] + list(paths)
+    cmd = subprocess.run(command, cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if cmd.returncode != 0:
+        raise RuntimeError(cmd.stderr.decode(errors='replace').strip())
+
+    changes = []
+    fields = cmd.stdout.split(b'\0')
+    # each change is ":<mode a> <mode b> <blob a> <blob b> <status>" followed by its path
+    for info, name in zip(fields[0::2], fields[1::2]):
+        _, _, blob_a, blob_b, _ = info.decode().split(' ')
+        name = os.fsdecode(name)
+        if not is_workbook_path(name):
+            continue
+        changes.append((name, None if set(blob_a) == {'0'} else blob_a, None if set(blob_b) == {'0'} else blob_b))
+    return changes
+
+
+def write_blob(blob, path):
+    with open(path, 'wb') as f:
+        subprocess.run(['git', 'cat-file', 'blob', blob], stdout=f, stderr=subprocess.PIPE, check=True)
+
+
+def diff_blobs(change, numlines=3, **options):
+    """Return the rendered diff of a (name, blob_a, blob_b) change from `list_changed_workbooks`.
+
+    Accepts the options of `diff.write_diff`.
+    """
+    name, blob_a, blob_b = change
+    try:
+        cache_dir = get_cache_dir()
+        cache = ManifestCache(cache_dir) if cache_dir else None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for side, blob in (('a', blob_a), ('b', blob_b)):
+                if blob is None:
+                    paths.append(None)
+                    continue
+                # keep the file name, the workbook format is detected from the extension
+                os.mkdir(os.path.join(tmp_dir, side))
+                paths.append(os.path.join(tmp_dir, side, os.path.basename(name)))
+                write_blob(blob, paths[-1])
+            return diff.diff_workbooks(name, paths[0], paths[1], numlines, cache=cache, **options)
+    except Exception as e:
+        # .NET exceptions cannot be pickled back from pool workers
+        raise RuntimeError(str(e)) from None
+
+
+def read_blob_manifest(item):
+    """Return the manifest of a (blob, name) workbook blob, without the VBA source code."""
+    blob, name = item
+    try:
+        cache_dir = get_cache_dir()
+        cache = ManifestCache(cache_dir) if cache_dir else None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # keep the file name, the workbook format is detected from the extension
+            path = os.path.join(tmp_dir, os.path.basename(name))
+            write_blob(blob, path)
+            manifest = load_manifest(path, cache)
+        return Manifest(manifest.worksheets, [module._replace(content='') for module in manifest.vba_modules])
+    except Exception as e:
+        # .NET exceptions cannot be pickled back from pool workers
+        raise RuntimeError(str(e)) from None
+
+
+def update_history_index(index, revisions, jobs=1, timeout=None):
+    """Add the commits of `revisions` that are not in the `history.HistoryIndex` yet.
+
+    Only the workbook blobs that the index has no manifest for are read, in
+    `jobs` worker processes. A blob that cannot be read is stored with its
+    error and not read again either. Returns the number of commits with
+    workbook changes, the number of blobs added and (path, blob, error) for
+    the blobs that could not be read.
+    """
+    with tracing.phase('index.update') as fields:
+        # tips that were rewritten and pruned since cannot be left out any more
+        tips = history.existing_commits(index.tips())
+        commits = [commit for commit in history.resolve_revisions(revisions) if not commit.startswith('^')]
+        added = 0
+        if set(commits) - set(tips):
+            changes = history.iter_commit_changes(commits, tips, is_workbook=is_workbook_path)
+            added = index.add_changes(changes)
+        blobs = index.missing_blobs()
+        errors = []
+        for (blob, name), manifest, error in run_jobs(
+                read_blob_manifest, blobs, jobs=min(jobs, len(blobs) or 1), timeout=timeout):
+            index.add_manifest(blob, manifest, error)
+            if error:
+                errors.append((name, blob, error))
+        # the history of the new tips is complete only now; only the current tips
+        # are kept, so that the commits to leave out do not pile up
+        index.set_tips(commits)
+        fields.update(commits=added, blobs=len(blobs), errors=len(errors))
+    return added, len(blobs), errors
+
+
 class Installer:
 
     def __init__(self, mode='global', path=None):
@@ -40,12 +263,15 @@ class Installer:
         if is_frozen():
             self.GIT_XL_DIFF = 'git-xl-diff.exe'
             self.GIT_XL_MERGE = 'git-xl-merge.exe'
+            self.GIT_XL_TEXTCONV = 'git-xl.exe textconv'
         else:
             executable_path = sys.executable.replace('\\', '/')
             differ_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diff.py').replace('\\', '/')
             merger_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'merge.py').replace('\\', '/')
+            textconv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'textconv.py').replace('\\', '/')
             self.GIT_XL_DIFF = f'{executable_path} {differ_path}'
             self.GIT_XL_MERGE = f'{executable_path} {merger_path}'
+            self.GIT_XL_TEXTCONV = f'{executable_path} {textconv_path}'
 
         if mode == 'global' and path:
             raise ValueError('must not specify repository path when installing globally')
@@ -66,9 +292,13 @@ class Installer:
         self.git_attributes_path = self.get_git_attributes_path()
         self.git_ignore_path = self.get_git_ignore_path()
 
-    def install(self):
+    def install(self, textconv=False):
         # 1. gitconfig: set-up diff.xl.command
         self.execute(['diff.xl.command', self.GIT_XL_DIFF])
+        if textconv:
+            # git diff keeps using diff.xl.command, git log -p & co. use the cached text conversion
+            self.execute(['diff.xl.textconv', self.GIT_XL_TEXTCONV])
+            self.execute(['diff.xl.cachetextconv', 'true'])
 
         # 2. gitconfig: merge-driver
         self.execute(['merge.xl.name', 'xl merge driver for Excel workbooks'])
@@ -203,7 +433,18 @@ Commands
 * git xl uninstall:
     Uninstall Git xl.
 * git xl ls-files:
-    Show information about Excel workbooks content."""
+    Show information about Excel workbooks content.
+* git xl diff:
+    Show the changes to all workbooks between two revisions.
+* git xl textconv:
+    Render a workbook as text for git log -p, --word-diff and -S.
+* git xl cache:
+    Manage the cache of workbook manifests.
+* git xl index:
+    Index the workbook history to find the commits that changed a
+    worksheet or VBA module.
+* git xl server:
+    Keep the workbook engine loaded for git diff and git merge."""
 
 HELP_ENV = 'git xl env\n\nDisplay the current Git XL environment.'
 
@@ -216,7 +457,12 @@ Without any options, git xl install will setup the Excel differ and
 .gitignore globally.\n
 * --local:
     Sets the .gitignore filters and the git-diff Excel drop-in replacement
-    in the local repository, instead of the global git config (~/.gitconfig)."""
+    in the local repository, instead of the global git config (~/.gitconfig).
+* --textconv:
+    Also render workbooks as text for git log -p, git show, --stat,
+    --word-diff and the pickaxe options (-S, -G), and let Git cache the
+    rendering of every blob (diff.xl.textconv, diff.xl.cachetextconv).
+    git diff keeps using the Git xl differ."""
 
 HELP_UNINSTALL = """git xl uninstall [options]\n
 Uninstalls Git XL:\n
@@ -229,13 +475,101 @@ replacement for Excel files and .gitignore globally.\n
 
 HELP_LS_FILES = """git xl ls-files [options]\n
 List workbooks in repository:\n
-Without any options, git xl ls-files will list all workbooks in your repository
-and show list of VBA modules.\n
+Without any options, git xl ls-files will list all workbooks tracked in your
+repository and show list of VBA modules.\n
 Options:\n
 * -v:
    Verbose. Shows VBA code.
 * -vv:
-   Very verbose. Shows VBA code and content hash."""
+   Very verbose. Shows VBA code and content hash.
+* -x <pattern>:
+   Only list files matching the pattern instead of all Excel file types.
+* --others:
+   Also list untracked workbooks that are not ignored by .gitignore.
+* -j <n>, --jobs <n>:
+   Read workbooks in n parallel processes. The output order does not change.
+* --timeout <seconds>:
+   Report workbooks that take longer than this to read as errors and
+   move on (default with --jobs: 300)."""
+
+HELP_DIFF = """git xl diff <rev-a> <rev-b> [options] [-- <path>...]\n
+Show the changes to all workbooks between two revisions, like git diff
+with the Git xl differ, but in a single process: the changed workbooks are
+found with one git call and diffed in a pool of worker processes. The
+output is in path order.\n
+Options:\n
+* -U <n>:
+    Show n lines of context around VBA changes (default: 3).
+* --color[=<when>], --no-color:
+    Color the output always, never or when writing to a terminal (auto,
+    the default; set the default with git config xl.diff.color).
+* --max-lines <n>:
+    Show at most n lines per workbook, followed by a note that lines
+    were left out (git config xl.diff.maxLines).
+* --format=ndjson:
+    Write one JSON object per change instead of a text diff
+    (git config xl.diff.format).
+* --diff-algorithm <algorithm>:
+    Diff VBA modules with myers (the default), histogram or patience
+    (git config xl.diff.algorithm).
+* -j <n>, --jobs <n>:
+    Diff workbooks in n parallel processes (default: number of CPUs).
+* --timeout <seconds>:
+    Report workbooks that take longer than this to diff as errors and
+    move on."""
+
+HELP_TEXTCONV = """git xl textconv <file>\n
+Write a line-oriented text rendering of a workbook to stdout: every
+worksheet with its digest and one line per populated cell, followed by
+the source code of the VBA modules. Set up by git xl install --textconv
+as the textconv filter of the xl diff driver."""
+
+HELP_CACHE = """git xl cache <command> [options]\n
+Manage the cache of workbook manifests used by git diff. The cache is
+stored in .git/xl-cache of the current repository.\n
+Commands:\n
+* prune:
+    Evict the least recently used manifests until the cache fits into
+    its size limit.\n
+Options:\n
+* --max-size <bytes>:
+    Prune down to the given size instead of the default limit. Use 0
+    to empty the cache."""
+
+HELP_INDEX = """git xl index [<revision>...] [options]\n
+Update the index of the workbook history in .git/xl-index.sqlite: the
+sheet digests and VBA modules of every workbook version, and the
+workbooks changed by every commit. Only commits that were not indexed
+before are walked, and workbook versions that are in the index already
+are never read again. Without revisions, all branches and tags are
+indexed.\n
+Options:\n
+* --module <name>:
+    List the commits that added, changed or deleted the VBA module
+    <name> in any workbook, latest first.
+* --sheet <name>:
+    List the commits that added, changed or deleted the worksheet
+    <name> in any workbook, latest first.
+* -j <n>, --jobs <n>:
+    Read workbooks in n parallel processes (default: number of CPUs).
+* --timeout <seconds>:
+    Report workbooks that take longer than this to read as errors and
+    move on."""
+
+HELP_SERVER = """git xl server [options]\n
+Run a local server that keeps the workbook engine loaded. While it is
+running, git diff and git merge hand their work to the server instead of
+loading the engine for every workbook. Without a server, they fall back
+to doing the work themselves.\n
+The server shuts down after a period without requests and restarts itself
+when its memory usage grows too large.\n
+Options:\n
+* --idle-timeout <seconds>:
+    Shut down after this many seconds without requests (default: 1800).
+* --max-memory <MB>:
+    Restart once the server used more than this much memory (default: 1024).
+* --stop:
+    Stop the running server."""
 
 class CommandParser:
 
@@ -257,7 +591,8 @@ class CommandParser:
                 f"""Error: unknown command "{command}" for "git-xl"\nRun 'git-xl --help' for usage.""")
 
         # execute command
-        getattr(self, command)(*args)
+        with tracing.profile(command), tracing.phase(command, args=args):
+            getattr(self, command)(*args)
 
     def version(self, *args):
         print(GIT_XL_VERSION)
@@ -285,14 +620,21 @@ class CommandParser:
                 print(getattr(module, help_text))
 
     def install(self, *args):
-        if not args or args[0] == '--global':
-            installer = Installer(mode='global')
-        elif args[0] == '--local':
+        for arg in args:
+            if arg not in ('--global', '--local', '--textconv'):
+                return print(
+                    f"""Invalid option "{arg}" for "git-xl install"\nRun 'git-xl --help' for usage.""")
+        if '--local' in args:
             installer = Installer(mode='local', path=os.getcwd())
         else:
+            installer = Installer(mode='global')
+        installer.install(textconv='--textconv' in args)
+
+    def textconv(self, *args):
+        if len(args) != 1:
             return print(
-                f"""Invalid option "{args[0]}" for "git-xl install"\nRun 'git-xl --help' for usage.""")
-        installer.install()
+                f"""Expected one file for "git-xl textconv"\nRun 'git-xl help textconv' for usage.""")
+        sys.exit(server.forward('textconv', list(args)))
 
     def uninstall(self, *args):
         if args:
@@ -305,31 +647,115 @@ class CommandParser:
             installer = Installer(mode='global')
         installer.uninstall()
 
-    def ls_files(self, *args):
-        def _ls_files(pattern):
-            files = []
-            for dirpath, dirnames, filenames in os.walk('.'):
-                if not filenames:
-                    continue
-
-                _files = fnmatch.filter(filenames, pattern)
-                if _files:
-                    for f in _files:
-                        files.append('{}/{}'.format(dirpath, f))
-            return files
-
+    def cache(self, *args):
+        if not args or args[0] != 'prune':
+            return print(
+                f"""Invalid command "{' '.join(args)}" for "git-xl cache"\nRun 'git-xl help cache' for usage.""")
+
+        cache_dir = get_cache_dir(os.getcwd())
+        if cache_dir is None:
+            return print('Error: not a Git repository')
+
+        cache = ManifestCache(cache_dir)
+        max_size = cache.max_size
+        if '--max-size' in args:
+            try:
+                max_size = int(args[args.index('--max-size') + 1])
+            except (IndexError, ValueError):
+                return print(
+                    f"""Expected a size in bytes for "--max-size"\nRun 'git-xl help cache' for usage.""")
+        evicted = cache.prune(max_size=max_size)
+        print(f'Pruned {evicted} manifest' + ('' if evicted == 1 else 's'))
+
+    def index(self, *args):
+        git_dir = get_git_dir(os.getcwd())
+        if git_dir is None:
+            return print('Error: not a Git repository')
+
+        jobs = os.cpu_count() or 1
+        timeout = None
+        module = sheet = None
+        revisions = []
+        args = iter(args)
+        for arg in args:
+            if arg in ('-j', '--jobs'):
+                jobs = int(next(args))
+            elif arg == '--timeout':
+                timeout = float(next(args))
+            elif arg == '--module':
+                module = next(args)
+            elif arg == '--sheet':
+                sheet = next(args)
+            else:
+                revisions.append(arg)
+
+        index = history.HistoryIndex(os.path.join(git_dir, history.INDEX_FILE))
+        try:
+            revisions = revisions or ['--branches', '--tags']
+            commits, blobs, errors = update_history_index(index, revisions, jobs=jobs, timeout=timeout)
+            for name, blob, error in errors:
+                print(f'Error: {name} ({blob}): {error}')
+            if module is None and sheet is None:
+                print(f'Indexed {commits} commit' + ('' if commits == 1 else 's') +
+                      f' and {blobs} workbook version' + ('' if blobs == 1 else 's'))
+            if sheet is not None:
+                for commit, path, change in index.sheet_changes(sheet):
+                    print(f'{commit} {path}/Worksheets/{sheet} {change}')
+            if module is not None:
+                for commit, path, module_type, change in index.module_changes(module):
+                    print(f'{commit} {path}/VBA/{module_type}/{module} {change}')
+        except RuntimeError as e:
+            print(f'Error: {e}')
+        finally:
+            index.close()
+
+    def server(self, *args):
+        if '--stop' in args:
+            try:
+                if not server.stop():
+                    print('No server running')
+            except RuntimeError as e:
+                print(f'Error: {e}')
+            return
+
+        idle_timeout = server.IDLE_TIMEOUT
+        max_memory = server.MAX_MEMORY
+        if '--idle-timeout' in args:
+            idle_timeout = int(args[args.index('--idle-timeout') + 1])
+        if '--max-memory' in args:
+            max_memory = int(args[args.index('--max-memory') + 1]) * 1024 * 1024
+
+        if '--worker' in args:
+            sys.exit(server.serve(idle_timeout=idle_timeout, max_memory=max_memory))
+
+        # run the server in a child process, so it can be recycled when it grows too large
+        command = [sys.executable] if is_frozen() else [sys.executable, os.path.abspath(__file__)]
+        command += ['server', '--worker'] + list(args)
+        while subprocess.run(command).returncode == server.EXIT_RECYCLE:
+            pass
 
-        if '-x' in args:
-            pattern = args[args.index('-x') + 1]
-            files = _ls_files(pattern)
-        else:
-            files = _ls_files('*.xls*')
+    def ls_files(self, *args):
+        if not is_git_repository(os.getcwd()):
+            return print('Error: not a Git repository')
+
+        pattern = args[args.index('-x') + 1] if '-x' in args else None
+        files = list_workbooks(pattern=pattern, others='--others' in args)
+
+        jobs = 1
+        timeout = None
+        for option in ('-j', '--jobs'):
+            if option in args:
+                jobs = int(args[args.index(option) + 1])
+                timeout = LS_FILES_TIMEOUT
+        if '--timeout' in args:
+            timeout = float(args[args.index('--timeout') + 1])
         colorama.init(strip=False)
 
-        for f in files:
-            wb = Workbook(f)
+        for f, vba_modules, error in read_all_vba_modules(files, jobs=jobs, timeout=timeout):
             print(colorama.Fore.WHITE + colorama.Style.BRIGHT + f)
-            for vba_module in wb.vba_modules:
+            if error:
+                print(colorama.Fore.RED + colorama.Style.NORMAL + '    Error: %s' % error)
+            for vba_module in vba_modules or []:
                 print(colorama.Fore.WHITE + colorama.Style.NORMAL + '    %s' % ('VBA/' + vba_module.type + '/' + vba_module.name))
                 if '-v' in args or '-vv' in args or '--verbose' in args:
                     if '-vv' in args:
@@ -338,7 +764,62 @@ class CommandParser:
                         print(colorama.Fore.YELLOW + colorama.Style.NORMAL + '        %s' % (line))
             print('')
 
+    def diff(self, *args):
+        if not is_git_repository(os.getcwd()):
+            return print('Error: not a Git repository')
+
+        paths = []
+        if '--' in args:
+            paths = list(args[args.index('--') + 1:])
+            args = args[:args.index('--')]
+
+        options = diff.read_diff_config()
+        try:
+            args = diff.parse_options(args, options)
+        except ValueError as e:
+            return print(f'Error: {e}')
+
+        numlines = 3
+        jobs = os.cpu_count() or 1
+        timeout = None
+        revisions = []
+        args = iter(args)
+        for arg in args:
+            if arg == '-U':
+                numlines = int(next(args))
+            elif arg in ('-j', '--jobs'):
+                jobs = int(next(args))
+            elif arg == '--timeout':
+                timeout = float(next(args))
+            else:
+                revisions.append(arg)
+        if len(revisions) != 2:
+            return print(
+                f"""Expected two revisions for "git-xl diff"\nRun 'git-xl help diff' for usage.""")
+
+        try:
+            with tracing.phase('diff.list_changes') as fields:
+                changes = list_changed_workbooks(*revisions, paths=paths)
+                fields['workbooks'] = len(changes)
+        except RuntimeError as e:
+            return print(f'Error: {e}')
+        options['color'] = diff.use_color(options['color'], sys.stdout)
+        func = functools.partial(diff_blobs, numlines=numlines, **options)
+        colorama.init(strip=False)
+
+        for (name, _, _), output, error in run_jobs(func, changes, jobs=min(jobs, len(changes) or 1), timeout=timeout):
+            if error and options['output_format'] == 'ndjson':
+                print(json.dumps({'object': 'error', 'workbook': name, 'error': error}))
+            elif error:
+                print(colorama.Style.BRIGHT + 'diff --xl a/' + name + ' b/' + name)
+                print(colorama.Fore.RED + colorama.Style.NORMAL + 'Error: %s' % error + colorama.Style.RESET_ALL)
+                print('')
+            else:
+                sys.stdout.write(output)
+            sys.stdout.flush()
+
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     command_parser = CommandParser(sys.argv[1:])
     command_parser.execute()
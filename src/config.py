@@ -0,0 +1,16 @@
+import subprocess
+
+
+def read_config(path='.'):
+    """Return all `xl.*` Git config entries as a dict, read with a single git call.
+
+    Section and key names are lower case, as reported by git.
+    """
+    cmd = subprocess.run(['git', 'config', '-z', '--get-regexp', r'^xl\.'], cwd=path,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    config = {}
+    for entry in cmd.stdout.split('\0'):
+        if entry:
+            key, _, value = entry.partition('\n')
+            config[key] = value
+    return config
@@ -1,34 +1,128 @@
 import sys
 import os
-import shutil
+import io
+import json
 import colorama
-import clr
-from difflib import unified_diff
-from colorama import Fore, Back, Style, init
+from colorama import Fore, Style
 
-clr.AddReference('xltrail-core')
-from xltrail.core import Workbook 
+import ooxml
+import server
+import tracing
+from cache import ManifestCache, get_cache_dir, load_manifest
+from config import read_config
+from linetable import LineTable
+from matchers import DIFF_ALGORITHMS, MAX_OPERATIONS, TIMEOUT, get_sequence_matcher
+from sheetdiff import MAX_CELL_CHANGES, read_cells, diff_cells, diff_rows, format_cell, has_value
+from workbook import load_workbook
 
 
-if __name__ == '__main__':
-    if not 8 <= len(sys.argv) <= 9:
-        print('Unexpected number of arguments')
-        sys.exit(0)
+OUTPUT_FORMATS = ['text', 'ndjson']
+DIFF_ALGORITHM = 'myers'
+BUFFER_SIZE = 64 * 1024
 
-    if len(sys.argv) == 8:
-        _, workbook_name, workbook_b, _, _, workbook_a, _ , _ = sys.argv
-        numlines = 3
-    if len(sys.argv) == 9:
-        _, numlines, workbook_name, workbook_b, _, _, workbook_a, _, _ = sys.argv
-        numlines = int(numlines)
+STYLES = {'header': Style.BRIGHT, 'hunk': Fore.CYAN, 'delete': Fore.RED, 'insert': Fore.GREEN}
 
-    path_workbook_a = os.path.abspath(workbook_a) if workbook_a != 'nul' and workbook_a != '/dev/null' else None
-    path_workbook_b = os.path.abspath(workbook_b) if workbook_b != 'nul' and workbook_b != '/dev/null' else None
 
-    workbook_a = Workbook(path_workbook_a) if path_workbook_a is not None else None
-    workbook_b = Workbook(path_workbook_b) if path_workbook_b is not None else None
+def is_unchanged(sheet_a, sheet_b, unchanged_parts):
+    """Return True if a sheet is stored in the same, unchanged package part on both sides."""
+    member = getattr(sheet_a, 'member', None)
+    return member is not None and member == getattr(sheet_b, 'member', None) and member in unchanged_parts
+
+
+def plural(n, word):
+    return f'{n} {word}' + ('' if n == 1 else 's')
+
+
+def format_range(start, stop):
+    """Format a line range like the hunk headers of unified diffs."""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+def iter_sheet_changes(sheet, cells_b, cells_a, max_changes, align_rows=False):
+    """Yield the records of the cell changes from `cells_b` (old) to `cells_a` (new)."""
+    if align_rows:
+        changes, total = diff_rows(cells_b, cells_a, limit=max_changes)
+    else:
+        changes, total = diff_cells(cells_b, cells_a, limit=max_changes)
+    yield {'object': 'worksheet', 'change': 'modified', 'name': sheet,
+           'cells_old': len(cells_b), 'cells_new': len(cells_a)}
+    for change in changes:
+        yield {'object': 'cell', 'sheet': sheet, 'old': change.a, 'new': change.b,
+               'change': 'added' if change.a is None else 'deleted' if change.b is None else 'modified'}
+    if total > len(changes):
+        yield {'object': 'omitted_cells', 'sheet': sheet, 'count': total - len(changes)}
+
+
+def iter_module_changes(vba_b, vba_a, numlines, diff_algorithm=DIFF_ALGORITHM):
+    """Yield the records of the changes from module `vba_b` (old) to `vba_a` (new), hunk by hunk."""
+    yield {'object': 'vba_module', 'change': 'modified', 'name': vba_a.name, 'type': vba_a.type}
+    # line tables are matched by line hashes; only the lines of the hunks are sliced out
+    lines_b = LineTable(vba_b.content)
+    lines_a = LineTable(vba_a.content)
+    # on pathological input, the budget makes the matcher fall back to one coarse hunk
+    matcher = get_sequence_matcher(diff_algorithm)(None, lines_b, lines_a, timeout=TIMEOUT,
+                                                    max_operations=MAX_OPERATIONS)
+    with tracing.phase('diff.vba', module=vba_a.name, lines=len(lines_a) + len(lines_b),
+                       algorithm=diff_algorithm) as fields:
+        groups = list(matcher.get_grouped_opcodes(numlines))
+        fields['coarse'] = matcher.budget.exhausted
+    for group in groups:
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines += [' ' + line for line in lines_b[i1:i2]]
+                continue
+            if tag in ('replace', 'delete'):
+                lines += ['-' + line for line in lines_b[i1:i2]]
+            if tag in ('replace', 'insert'):
+                lines += ['+' + line for line in lines_a[j1:j2]]
+        yield {'object': 'vba_hunk', 'module': vba_a.name, 'type': vba_a.type,
+               'old': format_range(group[0][1], group[-1][2]), 'new': format_range(group[0][3], group[-1][4]),
+               'lines': lines}
+
 
-    diffs = []
+def iter_changes(workbook_name, path_workbook_b, path_workbook_a, numlines=3, cache=None,
+                 max_cell_changes=MAX_CELL_CHANGES, align_rows=False, diff_algorithm=DIFF_ALGORITHM):
+    """Yield change records from `path_workbook_b` (old) to `path_workbook_a` (new).
+
+    Either path can be None for an added or deleted workbook. Records are
+    dicts with an 'object' key and are produced lazily, sheet by sheet and
+    hunk by hunk.
+    """
+    # cell contents are not part of the cached manifests, so workbooks are only
+    # opened when a sheet actually changed
+    opened = {}
+
+    unchanged = ooxml.unchanged_parts(path_workbook_b, path_workbook_a)
+    with tracing.phase('diff.manifests', workbook=workbook_name) as fields:
+        if unchanged is not None:
+            # parts with the same CRC and size in both packages are never parsed; this
+            # is cheaper than hashing the whole files to look them up in the cache
+            workbook_a = ooxml.PackageManifest(path_workbook_a)
+            workbook_b = ooxml.PackageManifest(path_workbook_b)
+            fields['unchanged_parts'] = len(unchanged)
+            for path, manifest in ((path_workbook_a, workbook_a), (path_workbook_b, workbook_b)):
+                opened[path] = dict([(sheet.name, sheet) for sheet in manifest.workbook.worksheets])
+        else:
+            # manifests are cached by content, so the workbook engine is only loaded on a cache miss
+            unchanged = set()
+            workbook_a = load_manifest(path_workbook_a, cache) if path_workbook_a is not None else None
+            workbook_b = load_manifest(path_workbook_b, cache) if path_workbook_b is not None else None
+        fields['sheets'] = sum(len(wb.worksheets) for wb in (workbook_a, workbook_b) if wb)
+
+    def read_sheet_cells(path, name):
+        if path not in opened:
+            opened[path] = dict([(sheet.name, sheet) for sheet in load_workbook(path).worksheets])
+        with tracing.phase('diff.read_cells', sheet=name) as fields:
+            cells = read_cells(opened[path][name])
+            fields['cells'] = len(cells)
+        return cells
 
     # sheets
     a_sheets = {} if workbook_a is None else dict([(i.name, i) for i in workbook_a.worksheets])
@@ -36,59 +130,279 @@ if __name__ == '__main__':
 
     for a_name, a_sheet in a_sheets.items():
         if a_name not in b_sheets:
-            diffs.append({
-                'a': '--- /dev/null',
-                'b': '+++ b/' + workbook_name + '/Worksheets/' + a_name,
-                'diff': Fore.GREEN + '+' + str(a_sheet.cells.Count) + ' cell' + ('' if a_sheet.cells.Count == 1 else 's')
-            })
+            yield {'object': 'worksheet', 'change': 'added', 'name': a_name, 'cells': a_sheet.cells}
+        elif is_unchanged(a_sheet, b_sheets[a_name], unchanged):
+            continue
         elif a_sheet.digest != b_sheets[a_name].digest:
-            b_sheet = b_sheets[a_name]
-            diffs.append({
-                'a': '--- a/' + workbook_name + '/Worksheets/' + a_name,
-                'b': '+++ b/' + workbook_name + '/Worksheets/' + a_name,
-                'diff': Fore.RED + '-' + str(b_sheet.cells.Count) + ' cell' + ('' if b_sheet.cells.Count == 1 else 's') + '\n' + Fore.GREEN + '+' + str(a_sheet.cells.Count) + ' cell' + ('' if a_sheet.cells.Count == 1 else 's')
-            })
+            cells_b = read_sheet_cells(path_workbook_b, a_name)
+            cells_a = read_sheet_cells(path_workbook_a, a_name)
+            with tracing.phase('diff.cells', sheet=a_name):
+                records = list(iter_sheet_changes(a_name, cells_b, cells_a, max_cell_changes, align_rows=align_rows))
+            yield from records
 
     for b_name, b_sheet in b_sheets.items():
         if b_name not in a_sheets:
-            diffs.append({
-                'a': '--- b/' + workbook_name + '/Worksheet/' + b_name,
-                'b': '+++ /dev/null',
-                'diff': Fore.RED + '-' + str(b_sheet.cells.Count) + ' cell' + ('' if b_sheet.cells.Count == 1 else 's')
-            })
-
+            yield {'object': 'worksheet', 'change': 'deleted', 'name': b_name, 'cells': b_sheet.cells}
 
     # VBA modules
-    a_modules = {} if workbook_a is None else dict([(m.name, m) for m in workbook_a.vba_modules])
-    b_modules = {} if workbook_b is None else dict([(m.name, m) for m in workbook_b.vba_modules])
+    if ooxml.VBA_PROJECT in unchanged:
+        a_modules = b_modules = {}
+    else:
+        a_modules = {} if workbook_a is None else dict([(m.name, m) for m in workbook_a.vba_modules])
+        b_modules = {} if workbook_b is None else dict([(m.name, m) for m in workbook_b.vba_modules])
     for module_a, vba_a in a_modules.items():
         if module_a not in b_modules:
-            diffs.append({
-                'a': '--- /dev/null',
-                'b': '+++ b/' + workbook_name + '/VBA/' + vba_a.type + '/' + module_a,
-                'diff': '\n'.join([Fore.GREEN + '+' + line for line in vba_a.content.split('\n')])
-            })
+            yield {'object': 'vba_module', 'change': 'added', 'name': module_a, 'type': vba_a.type,
+                   'content': vba_a.content}
         elif vba_a.digest != b_modules[module_a].digest:
-            diffs.append({
-                'a': '--- a/' + workbook_name + '/VBA/' + vba_a.type + '/' + module_a,
-                'b': '+++ b/' + workbook_name + '/VBA/' + vba_a.type + '/' + module_a,
-                'diff': '\n'.join([(Fore.RED if line.startswith('-') else (Fore.GREEN if line.startswith('+') else (Fore.CYAN if line.startswith('@') else ''))) + line.strip('\n') for line in list(unified_diff(b_modules[module_a].content.split('\n'), vba_a.content.split('\n'), n=numlines))[2:]])
-            })
+            yield from iter_module_changes(b_modules[module_a], vba_a, numlines, diff_algorithm=diff_algorithm)
 
     for module_b, vba_b in b_modules.items():
         if module_b not in a_modules:
-            diffs.append({
-                'a': '--- b/' + workbook_name + '/VBA/' + vba_b.type + '/' + module_b,
-                'b': '+++ /dev/null',
-                'diff': '\n'.join([Fore.RED + '-' + line for line in vba_b.content.split('\n')])
-            })
+            yield {'object': 'vba_module', 'change': 'deleted', 'name': module_b, 'type': vba_b.type,
+                   'content': vba_b.content}
 
 
-    colorama.init(strip=False)
+def render_text(workbook_name, records, color=True):
+    """Yield the lines of the text diff for a stream of change records."""
+    styles = STYLES if color else {}
+
+    def styled(style, text):
+        style = styles.get(style)
+        return style + text + Style.RESET_ALL if style else text
+
+    yield styled('header', 'diff --xl ' + 'a/' + workbook_name + ' b/' + workbook_name)
+    sections = 0
+    for record in records:
+        kind = record['object']
+        if kind in ('worksheet', 'vba_module'):
+            # every sheet or module starts a new section, separated by an empty line
+            if sections:
+                yield ''
+            sections += 1
+
+        if kind == 'worksheet':
+            path = workbook_name + '/Worksheets/' + record['name']
+            if record['change'] == 'added':
+                yield styled('header', '--- /dev/null')
+                yield styled('header', '+++ b/' + path)
+                yield styled('insert', '+' + plural(record['cells'], 'cell'))
+            elif record['change'] == 'deleted':
+                yield styled('header', '--- b/' + workbook_name + '/Worksheet/' + record['name'])
+                yield styled('header', '+++ /dev/null')
+                yield styled('delete', '-' + plural(record['cells'], 'cell'))
+            else:
+                yield styled('header', '--- a/' + path)
+                yield styled('header', '+++ b/' + path)
+                yield styled('hunk', '@@ -' + plural(record['cells_old'], 'cell') +
+                             ' +' + plural(record['cells_new'], 'cell') + ' @@')
+        elif kind == 'cell':
+            if record['old'] is not None:
+                yield styled('delete', '-' + record['old'].address + ': ' + format_cell(record['old']))
+            if record['new'] is not None:
+                yield styled('insert', '+' + record['new'].address + ': ' + format_cell(record['new']))
+        elif kind == 'omitted_cells':
+            yield styled('hunk', '... ' + str(record['count']) + ' more changed ' +
+                         ('cell' if record['count'] == 1 else 'cells'))
+        elif kind == 'vba_module':
+            path = workbook_name + '/VBA/' + record['type'] + '/' + record['name']
+            if record['change'] == 'added':
+                yield styled('header', '--- /dev/null')
+                yield styled('header', '+++ b/' + path)
+                for line in record['content'].split('\n'):
+                    yield styled('insert', '+' + line)
+            elif record['change'] == 'deleted':
+                yield styled('header', '--- b/' + path)
+                yield styled('header', '+++ /dev/null')
+                for line in record['content'].split('\n'):
+                    yield styled('delete', '-' + line)
+            else:
+                yield styled('header', '--- a/' + path)
+                yield styled('header', '+++ b/' + path)
+        elif kind == 'vba_hunk':
+            yield styled('hunk', '@@ -' + record['old'] + ' +' + record['new'] + ' @@')
+            for line in record['lines']:
+                yield styled('delete' if line[0] == '-' else 'insert' if line[0] == '+' else None, line)
+    if sections:
+        yield ''
+
+
+def cell_record(cell):
+    if cell is None:
+        return None
+    if not has_value(cell):
+        return {'address': cell.address, 'fingerprint': cell.digest[1]}
+    return {'address': cell.address, 'value': cell.value, 'formula': cell.formula}
+
+
+def render_ndjson(workbook_name, records):
+    """Yield one JSON object per change record."""
+    for record in records:
+        record = dict(record, workbook=workbook_name)
+        if record['object'] == 'cell':
+            record['old'] = cell_record(record['old'])
+            record['new'] = cell_record(record['new'])
+        yield json.dumps(record, default=str)
+
+
+class LineWriter:
+    """Write lines to a stream through a buffer, flushing it every `buffer_size` characters."""
+
+    def __init__(self, stream, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+        self.lines = 0
+
+    def write(self, line):
+        self.lines += 1
+        self.buffer.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
 
-    print(Style.BRIGHT + 'diff --xl ' + 'a/' + workbook_name + ' b/' + workbook_name)
-    for diff in diffs:
-        print(Style.BRIGHT + diff['a'])
-        print(Style.BRIGHT + diff['b'])
-        print(diff['diff'])
-        print('')
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.stream.write('\n'.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+        self.stream.flush()
+
+
+def write_diff(stream, workbook_name, path_workbook_b, path_workbook_a, numlines=3, cache=None,
+               max_cell_changes=MAX_CELL_CHANGES, align_rows=False, color=True, max_lines=None,
+               output_format='text', diff_algorithm=DIFF_ALGORITHM):
+    """Stream the diff from `path_workbook_b` (old) to `path_workbook_a` (new) to `stream`.
+
+    Returns the number of lines (or records) written. Once `max_lines` lines
+    are written, the rest of the diff is not computed and a note that lines
+    were left out is written instead.
+    """
+    records = iter_changes(workbook_name, path_workbook_b, path_workbook_a, numlines, cache=cache,
+                           max_cell_changes=max_cell_changes, align_rows=align_rows,
+                           diff_algorithm=diff_algorithm)
+    if output_format == 'ndjson':
+        lines = render_ndjson(workbook_name, records)
+    else:
+        lines = render_text(workbook_name, records, color=color)
+
+    writer = LineWriter(stream)
+    with tracing.phase('diff.write', workbook=workbook_name) as fields:
+        truncated = False
+        for line in lines:
+            if max_lines is not None and writer.lines >= max_lines:
+                truncated = True
+                break
+            writer.write(line)
+        # stop reading the workbooks and matching modules for lines that are not shown
+        lines.close()
+        if truncated:
+            if output_format == 'ndjson':
+                writer.write(json.dumps({'object': 'truncated', 'workbook': workbook_name}))
+            else:
+                summary = '... more lines left out (--max-lines ' + str(max_lines) + ')'
+                writer.write(Fore.CYAN + summary + Style.RESET_ALL if color else summary)
+        writer.flush()
+        fields.update(lines=writer.lines, truncated=truncated)
+    return writer.lines
+
+
+def diff_workbooks(workbook_name, path_workbook_b, path_workbook_a, numlines=3, cache=None, **options):
+    """Return the diff from `path_workbook_b` (old) to `path_workbook_a` (new) as a string.
+
+    Accepts the options of `write_diff`.
+    """
+    output = io.StringIO()
+    write_diff(output, workbook_name, path_workbook_b, path_workbook_a, numlines, cache=cache, **options)
+    return output.getvalue()
+
+
+def use_color(setting, stream):
+    """Resolve a color setting (always, never or auto) for an output stream."""
+    if setting in ('always', 'true'):
+        return True
+    if setting in ('never', 'false'):
+        return False
+    # git exports GIT_PAGER_IN_USE when it pipes the output to a pager that shows colors
+    return stream.isatty() or os.environ.get('GIT_PAGER_IN_USE') == 'true'
+
+
+def read_diff_config(path='.'):
+    """Return the diff options of the Git config as keyword arguments of `write_diff`.
+
+    The color setting is returned unresolved, see `use_color`.
+    """
+    config = read_config(path)
+    return {
+        'max_cell_changes': int(config.get('xl.diff.maxcells', MAX_CELL_CHANGES)),
+        'align_rows': config.get('xl.diff.alignrows', 'false').lower() in ('true', 'yes', 'on', '1'),
+        'color': config.get('xl.diff.color', 'auto').lower(),
+        'max_lines': int(config['xl.diff.maxlines']) if 'xl.diff.maxlines' in config else None,
+        'output_format': config.get('xl.diff.format', 'text').lower(),
+        'diff_algorithm': config.get('xl.diff.algorithm', DIFF_ALGORITHM).lower(),
+    }
+
+
+def parse_options(args, options):
+    """Apply the --color, --no-color, --max-lines, --format and --diff-algorithm options in `args` to `options`.
+
+    Returns the remaining arguments.
+    """
+    remaining = []
+    args = iter(args)
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if arg == '--color':
+            options['color'] = value or 'always'
+        elif name == '--color':
+            options['color'] = value
+        elif arg == '--no-color':
+            options['color'] = 'never'
+        elif name == '--max-lines':
+            options['max_lines'] = int(value or next(args))
+        elif name == '--format':
+            options['output_format'] = value or next(args)
+        elif name == '--diff-algorithm':
+            options['diff_algorithm'] = (value or next(args)).lower()
+        else:
+            remaining.append(arg)
+    if options['output_format'] not in OUTPUT_FORMATS:
+        raise ValueError(f'unknown format "{options["output_format"]}"')
+    if options['diff_algorithm'] not in DIFF_ALGORITHMS:
+        raise ValueError(f'unknown diff algorithm "{options["diff_algorithm"]}"')
+    return remaining
+
+
+def main(args):
+    options = read_diff_config()
+    try:
+        args = parse_options(args, options)
+    except ValueError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+
+    if not 7 <= len(args) <= 8:
+        print('Unexpected number of arguments')
+        sys.exit(0)
+
+    if len(args) == 7:
+        workbook_name, workbook_b, _, _, workbook_a, _ , _ = args
+        numlines = 3
+    if len(args) == 8:
+        numlines, workbook_name, workbook_b, _, _, workbook_a, _, _ = args
+        numlines = int(numlines)
+
+    path_workbook_a = os.path.abspath(workbook_a) if workbook_a != 'nul' and workbook_a != '/dev/null' else None
+    path_workbook_b = os.path.abspath(workbook_b) if workbook_b != 'nul' and workbook_b != '/dev/null' else None
+
+    cache_dir = get_cache_dir()
+    cache = ManifestCache(cache_dir) if cache_dir else None
+    options['color'] = use_color(options['color'], sys.stdout)
+    write_diff(sys.stdout, workbook_name, path_workbook_b, path_workbook_a, numlines, cache=cache, **options)
+
+
+if __name__ == '__main__':
+    colorama.init(strip=False)
+    sys.exit(server.forward('diff', sys.argv[1:]))
@@ -0,0 +1,180 @@
+"""Repository-wide index of workbook history, for `git xl index`.
+
+The index is a SQLite database in the Git directory. It stores the
+manifest (sheet digests, VBA module names and digests) of every workbook
+blob once, keyed by the blob id, and the workbook changes of every indexed
+commit. Updates only walk the commits that are not reachable from the
+revisions indexed before, and blobs that are in the index already are never
+read again, as most commits reuse most blobs.
+"""
+import os
+import sqlite3
+import subprocess
+
+
+INDEX_FILE = 'xl-index.sqlite'
+# bump to rebuild indexes written by older versions
+INDEX_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (blob TEXT PRIMARY KEY, error TEXT);
+CREATE TABLE IF NOT EXISTS sheets (blob TEXT, name TEXT, digest TEXT, cells INTEGER, PRIMARY KEY (blob, name));
+CREATE TABLE IF NOT EXISTS modules (blob TEXT, name TEXT, type TEXT, digest TEXT, PRIMARY KEY (blob, name));
+CREATE TABLE IF NOT EXISTS changes (
+    commit_id TEXT, time INTEGER, path TEXT, old_blob TEXT, new_blob TEXT, PRIMARY KEY (commit_id, path));
+CREATE TABLE IF NOT EXISTS tips (commit_id TEXT PRIMARY KEY);
+"""
+
+# the sheets or modules of the old and new blob of every change, with the
+# same name; blobs that could not be read are left out
+OBJECT_CHANGES = """
+SELECT c.commit_id, c.path, coalesce(n.{kind}, o.{kind}), o.digest, n.digest
+FROM changes c
+LEFT JOIN {table} o ON o.blob = c.old_blob AND o.name = :name
+LEFT JOIN {table} n ON n.blob = c.new_blob AND n.name = :name
+WHERE o.digest IS NOT n.digest
+AND NOT EXISTS (SELECT 1 FROM blobs b WHERE b.blob IN (c.old_blob, c.new_blob) AND b.error IS NOT NULL)
+ORDER BY c.time DESC, c.commit_id, c.path
+"""
+
+
+def iter_commit_changes(revisions, exclude=(), is_workbook=None, path='.'):
+    """Yield (commit, time, path, old_blob, new_blob) for the changed files of the commits in `revisions`.
+
+    Commits reachable from `exclude` are skipped. Merge commits are compared
+    with their first parent. A blob id is None where the file does not
+    exist; `is_workbook(path)` selects the files. The revisions are passed
+    on stdin, so that there can be any number of them.
+    """
+    command = ['git', 'log', '--raw', '-z', '--no-abbrev', '--no-renames', '--diff-merges=first-parent',
+               '--format=%H %ct', '--stdin']
+    process = subprocess.Popen(command, cwd=path, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    try:
+        # git reads all revisions before it writes anything
+        process.stdin.write(''.join(f'{revision}\n' for revision in revisions).encode())
+        process.stdin.write(''.join(f'^{revision}\n' for revision in exclude).encode())
+        process.stdin.close()
+        commit = time = None
+        buffer = b''
+        info = None
+        for chunk in iter(lambda: process.stdout.read1(64 * 1024), b''):
+            *fields, buffer = (buffer + chunk).split(b'\0')
+            for field in fields:
+                if info is not None:
+                    # the path that follows ":<mode a> <mode b> <blob a> <blob b> <status>"
+                    name = os.fsdecode(field)
+                    if is_workbook is None or is_workbook(name):
+                        _, _, blob_a, blob_b, _ = info.split(' ')
+                        yield (commit, time, name,
+                               None if set(blob_a) == {'0'} else blob_a, None if set(blob_b) == {'0'} else blob_b)
+                    info = None
+                    continue
+                field = field.decode().lstrip('\n')
+                if field.startswith(':'):
+                    info = field
+                elif field:
+                    commit, time = field.split(' ')
+                    time = int(time)
+        process.wait()
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.read().decode(errors='replace').strip())
+    finally:
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def resolve_revisions(revisions, path='.'):
+    """Return the commit ids of `revisions`."""
+    cmd = subprocess.run(['git', 'rev-parse'] + list(revisions), cwd=path, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    if cmd.returncode != 0:
+        raise RuntimeError(cmd.stderr.strip())
+    return cmd.stdout.split()
+
+
+def existing_commits(commits, path='.'):
+    """Return the commits of `commits` that are still in the repository, e.g. not pruned after a rebase."""
+    if not commits:
+        return []
+    cmd = subprocess.run(['git', 'cat-file', '--batch-check=%(objectname) %(objecttype)'], cwd=path,
+                         input=''.join(f'{commit}\n' for commit in commits), stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    if cmd.returncode != 0:
+        raise RuntimeError(cmd.stderr.strip())
+    # a missing object is reported as "<commit> missing"
+    return [commit for commit, line in zip(commits, cmd.stdout.splitlines()) if line.endswith(' commit')]
+
+
+class HistoryIndex:
+    """SQLite index of workbook manifests by blob id and of workbook changes by commit."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+            with self.db:
+                for table in ('blobs', 'sheets', 'modules', 'changes', 'tips'):
+                    self.db.execute(f'DROP TABLE IF EXISTS {table}')
+                self.db.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def tips(self):
+        """Return the commit ids whose history is indexed."""
+        return [row[0] for row in self.db.execute('SELECT commit_id FROM tips')]
+
+    def set_tips(self, commits):
+        """Replace the indexed tips by `commits`, whose history has to be indexed already."""
+        with self.db:
+            self.db.execute('DELETE FROM tips')
+            self.db.executemany('INSERT OR IGNORE INTO tips VALUES (?)', [(commit,) for commit in commits])
+
+    def add_changes(self, changes):
+        """Add (commit, time, path, old_blob, new_blob) changes; returns the number of commits added."""
+        with self.db:
+            before = self.db.execute('SELECT count(DISTINCT commit_id) FROM changes').fetchone()[0]
+            self.db.executemany('INSERT OR IGNORE INTO changes VALUES (?, ?, ?, ?, ?)', changes)
+            return self.db.execute('SELECT count(DISTINCT commit_id) FROM changes').fetchone()[0] - before
+
+    def missing_blobs(self):
+        """Return (blob, path) of the blobs of indexed changes that have no manifest yet."""
+        rows = self.db.execute("""
+            SELECT blob, min(path) FROM (
+                SELECT old_blob AS blob, path FROM changes UNION ALL SELECT new_blob, path FROM changes)
+            WHERE blob IS NOT NULL AND blob NOT IN (SELECT blob FROM blobs)
+            GROUP BY blob ORDER BY blob""")
+        return [tuple(row) for row in rows]
+
+    def add_manifest(self, blob, manifest=None, error=None):
+        """Store the manifest of a blob, or the error that kept it from being read."""
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?)', (blob, error))
+            if manifest is None:
+                return
+            self.db.executemany('INSERT OR REPLACE INTO sheets VALUES (?, ?, ?, ?)',
+                                [(blob, sheet.name, sheet.digest, sheet.cells) for sheet in manifest.worksheets])
+            self.db.executemany('INSERT OR REPLACE INTO modules VALUES (?, ?, ?, ?)',
+                                [(blob, module.name, module.type, module.digest) for module in manifest.vba_modules])
+
+    def sheet_changes(self, name):
+        """Yield (commit, path, change) for every change of the worksheet `name`, latest first."""
+        return self._object_changes('sheets', 'name', name)
+
+    def module_changes(self, name):
+        """Yield (commit, path, type, change) for every change of the VBA module `name`, latest first."""
+        return self._object_changes('modules', 'type', name)
+
+    def _object_changes(self, table, kind, name):
+        for commit, path, kind_value, old_digest, new_digest in self.db.execute(
+                OBJECT_CHANGES.format(table=table, kind=kind), {'name': name}):
+            change = 'added' if old_digest is None else 'deleted' if new_digest is None else 'modified'
+            if table == 'sheets':
+                yield commit, path, change
+            else:
+                yield commit, path, kind_value, change
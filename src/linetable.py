@@ -0,0 +1,129 @@
+"""Compact line tables for diffing and merging large VBA modules.
+
+`text.split('\n')` keeps a string object per line, which for a multi-megabyte
+module costs several times the size of the text. A `LineTable` keeps the text
+as is, plus an array of line offsets and an array of line hashes; lines are
+only sliced from the text when they are indexed, and the matchers compare
+them by their hashes.
+"""
+import sys
+from array import array
+from collections import defaultdict
+from itertools import accumulate, chain, count, islice, repeat
+from operator import add
+
+
+# characters split at a time when a table is built
+CHUNK_SIZE = 1 << 16
+# 64-bit string hashes (SipHash with a random key per process) do not collide in
+# practice; with 32-bit hashes, lines with the same hash are compared by their text
+EXACT_HASHES = sys.hash_info.width >= 64
+
+
+class LineTable:
+    """The lines of a text, like `text.split('\n')`, without a string per line.
+
+    `LineTable()` has no lines at all, while `LineTable('')` has one empty
+    line, as ''.split('\n') does. Indexing returns a line, slicing returns a
+    list of lines.
+    """
+    __slots__ = ('text', 'starts', 'hashes')
+
+    def __init__(self, text=None):
+        # starts[i] is the offset of line i; a virtual line starts after the
+        # end of the text, so that line i ends at starts[i + 1] - 1
+        self.starts = starts = array('q', [0])
+        self.hashes = hashes = array('q')
+        self.text = '' if text is None else text
+        if text is None:
+            return
+        # the text is split chunk by chunk, so only the lines of one chunk exist at a time
+        start = 0
+        while True:
+            end = text.find('\n', start + CHUNK_SIZE)
+            lines = text[start:end if end != -1 else len(text)].split('\n')
+            hashes.extend(map(hash, lines))
+            line_starts = accumulate(chain((start,), map(add, map(len, lines), repeat(1))))
+            starts.extend(islice(line_starts, 1, None))
+            if end == -1:
+                return
+            start = end + 1
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('line index out of range')
+        return self.text[self.starts[index]:self.starts[index + 1] - 1]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def line_length(self, index):
+        return self.starts[index + 1] - self.starts[index] - 1
+
+    def join(self, start, stop):
+        """Return '\n'.join(self[start:stop]) with a single copy."""
+        if start >= stop:
+            return ''
+        return self.text[self.starts[start]:self.starts[stop] - 1]
+
+    def line_equals(self, index, other, other_index):
+        """Return self[index] == other[other_index]."""
+        if self.hashes[index] != other.hashes[other_index]:
+            return False
+        if self.line_length(index) != other.line_length(other_index):
+            return False
+        return self[index] == other[other_index]
+
+    def range_equals(self, start, stop, other, other_start, other_stop):
+        """Return self[start:stop] == other[other_start:other_stop]."""
+        if stop - start != other_stop - other_start:
+            return False
+        if self.starts[stop] - self.starts[start] != other.starts[other_stop] - other.starts[other_start]:
+            return False
+        if self.hashes[start:stop] != other.hashes[other_start:other_stop]:
+            return False
+        return self.join(start, stop) == other.join(other_start, other_stop)
+
+
+def intern_tables(a, b):
+    """Map the lines of two line tables to integer ids, equal lines getting the same id.
+
+    Lines are identified by their precomputed hashes, without slicing them
+    from the text, unless the hashes are too narrow to be unique.
+    """
+    if not EXACT_HASHES:
+        return intern_lines_by_text(a, b)
+    # a new hash gets the next id from the counter
+    ids = defaultdict(count().__next__)
+    return array('i', map(ids.__getitem__, a.hashes)), array('i', map(ids.__getitem__, b.hashes))
+
+
+def intern_lines_by_text(a, b):
+    """Like `intern_tables`, comparing lines with the same hash by their text."""
+    ids = {}
+    # the first line of every id, and ids of lines whose hash collides with a different line
+    first_lines = []
+    collisions = {}
+    result = []
+    for table in (a, b):
+        table_ids = array('i')
+        for index, line_hash in enumerate(table.hashes):
+            line_id = ids.get(line_hash)
+            if line_id is None:
+                line_id = ids[line_hash] = len(first_lines)
+                first_lines.append((table, index))
+            elif not table.line_equals(index, *first_lines[line_id]):
+                line_id = collisions.setdefault(table[index], len(first_lines))
+                if line_id == len(first_lines):
+                    first_lines.append((table, index))
+            table_ids.append(line_id)
+        result.append(table_ids)
+    return result[0], result[1]
@@ -0,0 +1,324 @@
+"""Sequence matchers for the diff algorithms of `--diff-algorithm`.
+
+Like `PatienceSequenceMatcher`, the matchers are `difflib.SequenceMatcher`
+subclasses that only replace `get_matching_blocks()`, so `get_opcodes()`
+and `get_grouped_opcodes()` work unchanged:
+
+* myers: Myers' O(ND) algorithm in linear space (git's default). Finds a
+  longest common subsequence, so it produces the smallest diff, unless the
+  inputs are so different that the search is cut short.
+* histogram: extends the patience algorithm to lines that are not unique,
+  by anchoring on the least frequent lines (git's `--histogram`). Reads
+  better on code with many duplicate lines such as `End Sub`.
+* patience: matches unique lines first (see patiencediff).
+
+Lines are interned to integer ids before matching, and ranges are kept on
+explicit work stacks, so deep diffs do not hit the recursion limit. All
+matchers take an optional `timeout` and `max_operations` budget, after which
+the remaining ranges are only matched by their common prefix and suffix.
+"""
+import math
+import difflib
+from array import array
+
+from patiencediff import Budget, PatienceSequenceMatcher, intern_lines
+
+
+# lines that occur more often than this in a range are not used as histogram anchors
+MAX_CHAIN_LENGTH = 64
+# edit distance after which Myers settles for a good split instead of the optimal one (like git's xdiff)
+MIN_MAX_COST = 256
+# budget of diff and merge per pair of modules: a 100k line module with 1% of its lines
+# edited takes up to 2M operations, and 10M operations take about 5 seconds
+MAX_OPERATIONS = 10 * 1000 * 1000
+TIMEOUT = 10.0
+
+
+def trim(a, b, alo, ahi, blo, bhi, matches):
+    """Strip the common prefix and suffix of a[alo:ahi] and b[blo:bhi].
+
+    The matching lines are added to `matches` as (i, j, n) blocks. Returns
+    the remaining ranges.
+    """
+    start = alo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    if alo > start:
+        matches.append((start, blo - (alo - start), alo - start))
+    end = ahi
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+    if ahi < end:
+        matches.append((ahi, bhi, end - ahi))
+    return alo, ahi, blo, bhi
+
+
+def middle_snake(a, b, alo, ahi, blo, bhi, max_cost=None, budget=None):
+    """Return (x, y, u, v), the middle snake of an optimal edit path from a[alo:ahi] to b[blo:bhi].
+
+    Both ranges must be non-empty and differ in their first and last lines.
+    The snake a[x:u] == b[y:v] splits the path into two halves of at most
+    half the edit distance each. Uses O(len(a) + len(b)) memory. Once the
+    search passes `max_cost` edits or spends the `budget`, the furthest
+    reaching path is used as an empty snake instead, which bounds the time on
+    very different inputs.
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + abs(delta) + 2
+    forward = array('l', [0]) * (2 * offset + 1)
+    backward = array('l', [0]) * (2 * offset + 1)
+    forward[offset + 1] = 0
+    backward[offset + delta - 1] = n
+
+    for d in range(max_d + 1):
+        # extend the forward paths by one edit, then follow the diagonal
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and delta - d < k < delta + d and backward[offset + k] <= x:
+                return alo + x0, blo + y0, alo + x, blo + y
+
+        # extend the backward paths, on the diagonals around delta
+        for k in range(-d, d + 1, 2):
+            kk = k + delta
+            if k == d or (k != -d and backward[offset + kk - 1] < backward[offset + kk + 1]):
+                x = backward[offset + kk - 1]
+            else:
+                x = backward[offset + kk + 1] - 1
+            y = x - kk
+            u, v = x, y
+            while x > 0 and y > 0 and a[alo + x - 1] == b[blo + y - 1]:
+                x -= 1
+                y -= 1
+            backward[offset + kk] = x
+            if not odd and -d <= kk <= d and forward[offset + kk] >= x:
+                return alo + x, blo + y, alo + u, blo + v
+
+        if (max_cost is not None and d >= max_cost) or (d and budget is not None and not budget.spend(2 * d + 2)):
+            # split where either search got furthest; both halves are smaller than the range
+            forward_best = max(((forward[offset + k], forward[offset + k] - k) for k in range(-d, d + 1, 2)
+                                if forward[offset + k] <= n and 0 <= forward[offset + k] - k <= m),
+                               key=sum)
+            backward_best = min(((backward[offset + k + delta], backward[offset + k + delta] - k - delta)
+                                 for k in range(-d, d + 1, 2)
+                                 if 0 <= backward[offset + k + delta] and 0 <= backward[offset + k + delta] - k - delta <= m),
+                                key=sum)
+            if sum(forward_best) >= n + m - sum(backward_best):
+                x, y = forward_best
+            else:
+                x, y = backward_best
+            return alo + x, blo + y, alo + x, blo + y
+    raise AssertionError('no middle snake')
+
+
+def myers_matches(a, b, alo, ahi, blo, bhi, matches, minimal=False, budget=None):
+    """Add the (i, j, n) blocks of a common subsequence of a[alo:ahi] and b[blo:bhi] to `matches`.
+
+    The subsequence is a longest one if `minimal` is true or the edit distance
+    is small; otherwise the search is cut short as described in `middle_snake`.
+    """
+    max_cost = None if minimal else max(MIN_MAX_COST, math.isqrt(ahi - alo + bhi - blo))
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        alo, ahi, blo, bhi = trim(a, b, *stack.pop(), matches)
+        if alo == ahi or blo == bhi:
+            continue
+        if budget is not None and not budget.spend(ahi - alo + bhi - blo):
+            continue
+        # after trimming, the edit distance is at least 2, so both halves are smaller
+        x, y, u, v = middle_snake(a, b, alo, ahi, blo, bhi, max_cost, budget)
+        if u > x:
+            matches.append((x, y, u - x))
+        stack.append((alo, x, blo, y))
+        stack.append((u, ahi, v, bhi))
+
+
+def discard_unmatched(a, b):
+    """Drop the lines that only occur on one side; they cannot be part of any match.
+
+    Returns the remaining lines and the positions they had in a and b.
+    """
+    in_a = set(a)
+    in_b = set(b)
+    a_index = array('l', [i for i, line in enumerate(a) if line in in_b])
+    b_index = array('l', [j for j, line in enumerate(b) if line in in_a])
+    return array('i', [a[i] for i in a_index]), array('i', [b[j] for j in b_index]), a_index, b_index
+
+
+def histogram_matches(a, b, alo, ahi, blo, bhi, matches, budget=None):
+    """Add the (i, j, n) blocks of the histogram diff of a[alo:ahi] and b[blo:bhi] to `matches`."""
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        alo, ahi, blo, bhi = trim(a, b, *stack.pop(), matches)
+        if alo == ahi or blo == bhi:
+            continue
+        if budget is not None and not budget.spend(ahi - alo + bhi - blo):
+            continue
+
+        candidates = 0
+        occurrences = {}
+        for i in range(alo, ahi):
+            occurrences.setdefault(a[i], []).append(i)
+
+        # the anchor is the common region whose rarest line is rarest; the longer region wins
+        # ties, then the one closer to the middle, so that the ranges are split evenly
+        best = None
+        best_count = MAX_CHAIN_LENGTH + 1
+        best_length = 0
+        best_distance = 0
+        middle = (blo + bhi) // 2
+        j = blo
+        while j < bhi:
+            positions = occurrences.get(b[j])
+            if positions is None or len(positions) > best_count:
+                j += 1
+                continue
+            j_next = j + 1
+            candidates += len(positions)
+            for i in positions:
+                # extend the match in both directions, tracking the rarest line
+                count = len(positions)
+                i1, j1 = i, j
+                while i1 > alo and j1 > blo and a[i1 - 1] == b[j1 - 1]:
+                    i1 -= 1
+                    j1 -= 1
+                    count = min(count, len(occurrences[a[i1]]))
+                i2, j2 = i + 1, j + 1
+                while i2 < ahi and j2 < bhi and a[i2] == b[j2]:
+                    count = min(count, len(occurrences[a[i2]]))
+                    i2 += 1
+                    j2 += 1
+                j_next = max(j_next, j2)
+                distance = abs(j1 + j2 - 2 * middle)
+                if count < best_count or (count == best_count and (i2 - i1 > best_length or (
+                        i2 - i1 == best_length and distance < best_distance))):
+                    best = (i1, j1, i2 - i1)
+                    best_count = count
+                    best_length = i2 - i1
+                    best_distance = distance
+            j = j_next
+        if budget is not None:
+            budget.spend(candidates)
+
+        if best is None:
+            # every common line is too frequent to be a good anchor
+            myers_matches(a, b, alo, ahi, blo, bhi, matches, budget=budget)
+            continue
+        i, j, length = best
+        matches.append(best)
+        stack.append((alo, i, blo, j))
+        stack.append((i + length, ahi, j + length, bhi))
+
+
+def collapse(matches):
+    """Sort (i, j, n) blocks and merge adjacent ones, like get_matching_blocks() does."""
+    blocks = []
+    for i, j, n in sorted(matches):
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + n)
+        else:
+            blocks.append((i, j, n))
+    return blocks
+
+
+class LineSequenceMatcher(difflib.SequenceMatcher):
+    """Base class of the matchers; subclasses implement `find_matches`."""
+
+    def __init__(self, isjunk=None, a='', b='', timeout=None, max_operations=None):
+        if isjunk is not None:
+            raise NotImplementedError('Currently we do not support'
+                                      ' isjunk for sequence matching')
+        self.timeout = timeout
+        self.max_operations = max_operations
+        self.budget = None
+        difflib.SequenceMatcher.__init__(self, isjunk, a, b)
+
+    def _SequenceMatcher__chain_b(self):
+        # the index of b is only used by find_longest_match, which is never called
+        self.b2j = {}
+        self.bjunk = set()
+        self.bpopular = set()
+
+    def find_matches(self, a, b):
+        """Return the unordered (i, j, n) matching blocks of two arrays of line ids."""
+        raise NotImplementedError
+
+    def get_matching_blocks(self):
+        """Return list of triples describing matching subsequences.
+
+        Each triple is of the form (i, j, n), and means that
+        a[i:i+n] == b[j:j+n]. The triples are monotonically increasing in
+        i and in j. The last triple is a dummy, (len(a), len(b), 0).
+        """
+        if self.matching_blocks is None:
+            a, b = intern_lines(self.a, self.b)
+            self.budget = Budget(self.timeout, self.max_operations)
+            self.matching_blocks = collapse(self.find_matches(a, b))
+            self.matching_blocks.append((len(self.a), len(self.b), 0))
+        return self.matching_blocks
+
+
+class MyersSequenceMatcher(LineSequenceMatcher):
+    """Compare a pair of sequences with Myers' O(ND) algorithm in linear space.
+
+    >>> MyersSequenceMatcher(None, 'abxcd', 'abcd').get_matching_blocks()
+    [(0, 0, 2), (3, 2, 2), (5, 4, 0)]
+    """
+
+    def find_matches(self, a, b):
+        # lines that only occur on one side are dropped first, which keeps the
+        # edit distance D small when one side adds or removes whole blocks
+        a_ids, b_ids, a_index, b_index = discard_unmatched(a, b)
+        matches = []
+        myers_matches(a_ids, b_ids, 0, len(a_ids), 0, len(b_ids), matches, budget=self.budget)
+        # map the positions back, splitting blocks where discarded lines were in between
+        result = []
+        for i, j, n in matches:
+            start = 0
+            for k in range(1, n + 1):
+                if k == n or a_index[i + k] != a_index[i + k - 1] + 1 or b_index[j + k] != b_index[j + k - 1] + 1:
+                    result.append((a_index[i + start], b_index[j + start], k - start))
+                    start = k
+        return result
+
+
+class HistogramSequenceMatcher(LineSequenceMatcher):
+    """Compare a pair of sequences with the histogram algorithm.
+
+    >>> HistogramSequenceMatcher(None, 'abxcd', 'abcd').get_matching_blocks()
+    [(0, 0, 2), (3, 2, 2), (5, 4, 0)]
+    """
+
+    def find_matches(self, a, b):
+        matches = []
+        histogram_matches(a, b, 0, len(a), 0, len(b), matches, budget=self.budget)
+        return matches
+
+
+DIFF_ALGORITHMS = {
+    'myers': MyersSequenceMatcher,
+    'histogram': HistogramSequenceMatcher,
+    'patience': PatienceSequenceMatcher,
+}
+
+
+def get_sequence_matcher(algorithm):
+    """Return the SequenceMatcher class of a diff algorithm name."""
+    try:
+        return DIFF_ALGORITHMS[algorithm.lower()]
+    except KeyError:
+        raise ValueError(f'unknown diff algorithm "{algorithm}"') from None
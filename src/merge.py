@@ -5,14 +5,24 @@ import difflib
 import os
 import time
 import shutil
-import clr
+import hashlib
+from collections import namedtuple
+import ooxml
 import patiencediff
-
-# clr
-clr.AddReference('xltrail-core')
-from xltrail.core import Workbook
+import server
+import tracing
+import vba
+from cache import file_digest
+from config import read_config
+from linetable import LineTable
+from matchers import DIFF_ALGORITHMS, MAX_OPERATIONS, TIMEOUT, get_sequence_matcher
+from sheetmerge import merge_worksheets
+from workbook import load_workbook
 
 
+MERGE_ALGORITHM = 'patience'
+# conflicting cell addresses listed per sheet
+MAX_CONFLICT_ADDRESSES = 20
 
 # This is a version of unified_diff which only adds a factory parameter
 # so that you can override the default SequenceMatcher
@@ -138,6 +148,8 @@ def intersect(ra, rb):
 def compare_range(a, astart, aend, b, bstart, bend):
     """Compare a[astart:aend] == b[bstart:bend], without slicing.
     """
+    if isinstance(a, LineTable) and isinstance(b, LineTable):
+        return a.range_equals(astart, aend, b, bstart, bend)
     if (aend-astart) != (bend-bstart):
         return False
     for ia, ib in zip(range(astart, aend), range(bstart, bend)):
@@ -149,6 +161,12 @@ def compare_range(a, astart, aend, b, bstart, bend):
 
 
 
+# result of a 3-way merge, computed once per Merge3:
+# sync regions (see find_sync_regions), merge regions (see merge_regions)
+# and the number of conflicting regions
+MergeResult = namedtuple('MergeResult', ['sync_regions', 'merge_regions', 'conflicts'])
+
+
 class Merge3:
     """3-way merge of texts.
 
@@ -156,23 +174,36 @@ class Merge3:
     incorporating the changes from both BASE->OTHER and BASE->THIS.
     All three will typically be sequences of lines."""
 
-    def __init__(self, base, a, b, is_cherrypick=False, allow_objects=False):
+    def __init__(self, base, a, b, is_cherrypick=False, allow_objects=False, sequencematcher=None,
+                 timeout=None, max_operations=None):
         """Constructor.
 
         :param base: lines in BASE
         :param a: lines in A
-        :param b: lines in B
+        :param b: lines in B; base, a and b can also be `LineTable`s
         :param is_cherrypick: flag indicating if this merge is a cherrypick.
             When cherrypicking b => a, matches with b and base do not conflict.
         :param allow_objects: if True, do not require that base, a and b are
             plain Python strs.  Also prevents BinaryFile from being raised.
             Lines can be any sequence of comparable and hashable Python
             objects.
+        :param sequencematcher: the SequenceMatcher class used to match a and
+            b against base, PatienceSequenceMatcher by default.
+        :param timeout, max_operations: budget of every match; see
+            PatienceSequenceMatcher. Regions left when it is spent are
+            merged coarsely, which can only add conflicts.
         """
+        if sequencematcher is None:
+            sequencematcher = patiencediff.PatienceSequenceMatcher
+        self.sequencematcher = sequencematcher
+        self.match_budget = {'timeout': timeout, 'max_operations': max_operations}
         self.base = base
         self.a = a
         self.b = b
         self.is_cherrypick = is_cherrypick
+        self._matching_blocks = None
+        self._sync_regions = None
+        self._result = None
 
     def merge_lines(self,
                     name_a=None,
@@ -228,6 +259,55 @@ class Merge3:
             else:
                 raise ValueError(what)
 
+    def merge_text(self,
+                   name_a=None,
+                   name_b=None,
+                   start_marker='<<<<<<<',
+                   mid_marker='=======',
+                   end_marker='>>>>>>>'):
+        """Return '\n'.join(self.merge_lines(...)) for lines without line endings.
+
+        Runs of lines from a `LineTable` are copied as one piece of its text,
+        so no string is created per line.
+        """
+        newline = '\n'
+        if len(self.a) > 0:
+            if self.a[0].endswith('\r\n'):
+                newline = '\r\n'
+            elif self.a[0].endswith('\r'):
+                newline = '\r'
+        if name_a:
+            start_marker = start_marker + ' ' + name_a
+        if name_b:
+            end_marker = end_marker + ' ' + name_b
+        pieces = []
+
+        def add(lines, start, end):
+            if start >= end:
+                return
+            if isinstance(lines, LineTable):
+                pieces.append(lines.join(start, end))
+            else:
+                pieces.append('\n'.join(lines[start:end]))
+
+        for t in self.merge_regions():
+            what = t[0]
+            if what == 'unchanged':
+                add(self.base, t[1], t[2])
+            elif what == 'a' or what == 'same':
+                add(self.a, t[1], t[2])
+            elif what == 'b':
+                add(self.b, t[1], t[2])
+            elif what == 'conflict':
+                pieces.append(start_marker + newline)
+                add(self.a, t[3], t[4])
+                pieces.append(mid_marker + newline)
+                add(self.b, t[5], t[6])
+                pieces.append(end_marker + newline)
+            else:
+                raise ValueError(what)
+        return '\n'.join(pieces)
+
     def merge_annotated(self):
         """Return merge with conflicts, showing origin of lines.
 
@@ -290,9 +370,25 @@ class Merge3:
                 raise ValueError(what)
     
     def is_conflicted(self):
-        return sum([1 if t[0] == 'conflict' else 0 for t in self.merge_regions()])
+        return self.merge_result().conflicts
+
+    def merge_result(self):
+        """Return the MergeResult, computing the regions on first use.
+
+        merge_lines, merge_groups, merge_annotated and is_conflicted all share
+        this result, so the two diffs against base run only once.
+        """
+        if self._result is None:
+            merge_regions = list(self._merge_regions())
+            conflicts = sum(1 for t in merge_regions if t[0] == 'conflict')
+            self._result = MergeResult(self.find_sync_regions(), merge_regions, conflicts)
+        return self._result
 
     def merge_regions(self):
+        """Return the list of matching and conflicting regions (see _merge_regions)."""
+        return self.merge_result().merge_regions
+
+    def _merge_regions(self):
         """Return sequences of matching and conflicting regions.
 
         This returns tuples, where the first value says what kind we
@@ -386,8 +482,8 @@ class Merge3:
     def _refine_cherrypick_conflict(self, zstart, zend, astart, aend, bstart, bend):
         """When cherrypicking b => a, ignore matches with b and base."""
         # Do not emit regions which match, only regions which do not match
-        matches = patiencediff.PatienceSequenceMatcher(None,
-            self.base[zstart:zend], self.b[bstart:bend]).get_matching_blocks()
+        matches = self.sequencematcher(None,
+            self.base[zstart:zend], self.b[bstart:bend], **self.match_budget).get_matching_blocks()
         last_base_idx = 0
         last_b_idx = 0
         last_b_idx = 0
@@ -436,8 +532,8 @@ class Merge3:
             type, iz, zmatch, ia, amatch, ib, bmatch = region
             a_region = self.a[ia:amatch]
             b_region = self.b[ib:bmatch]
-            matches = patiencediff.PatienceSequenceMatcher(
-                    None, a_region, b_region).get_matching_blocks()
+            matches = self.sequencematcher(
+                    None, a_region, b_region, **self.match_budget).get_matching_blocks()
             next_a = ia
             next_b = ib
             for region_ia, region_ib, region_len in matches[:-1]:
@@ -459,18 +555,30 @@ class Merge3:
         if next_a < region_ia or next_b < region_ib:
             return 'conflict', None, None, next_a, region_ia, next_b, region_ib
 
+    def matching_blocks(self):
+        """Return the matching blocks of base against a and of base against b.
+
+        The two diffs are only computed once per Merge3.
+        """
+        if self._matching_blocks is None:
+            amatches = self.sequencematcher(
+                    None, self.base, self.a, **self.match_budget).get_matching_blocks()
+            bmatches = self.sequencematcher(
+                    None, self.base, self.b, **self.match_budget).get_matching_blocks()
+            self._matching_blocks = amatches, bmatches
+        return self._matching_blocks
+
     def find_sync_regions(self):
         """Return a list of sync regions, where both descendents match the base.
 
         Generates a list of (base1, base2, a1, a2, b1, b2).  There is
         always a zero-length sync region at the end of all the files.
         """
+        if self._sync_regions is not None:
+            return self._sync_regions
 
         ia = ib = 0
-        amatches = patiencediff.PatienceSequenceMatcher(
-                None, self.base, self.a).get_matching_blocks()
-        bmatches = patiencediff.PatienceSequenceMatcher(
-                None, self.base, self.b).get_matching_blocks()
+        amatches, bmatches = self.matching_blocks()
         len_a = len(amatches)
         len_b = len(bmatches)
 
@@ -518,36 +626,36 @@ class Merge3:
         bbase = len(self.b)
         sl.append((intbase, intbase, abase, abase, bbase, bbase))
 
+        self._sync_regions = sl
         return sl
 
     def find_unconflicted(self):
         """Return a list of ranges in base that are not conflicted."""
-        am = patiencediff.PatienceSequenceMatcher(
-                None, self.base, self.a).get_matching_blocks()
-        bm = patiencediff.PatienceSequenceMatcher(
-                None, self.base, self.b).get_matching_blocks()
+        am, bm = self.matching_blocks()
 
         unc = []
+        ia = ib = 0
 
-        while am and bm:
+        while ia < len(am) and ib < len(bm):
             # there is an unconflicted block at i; how long does it
             # extend?  until whichever one ends earlier.
-            a1 = am[0][0]
-            a2 = a1 + am[0][2]
-            b1 = bm[0][0]
-            b2 = b1 + bm[0][2]
+            a1 = am[ia][0]
+            a2 = a1 + am[ia][2]
+            b1 = bm[ib][0]
+            b2 = b1 + bm[ib][2]
             i = intersect((a1, a2), (b1, b2))
             if i:
                 unc.append(i)
 
             if a2 < b2:
-                del am[0]
+                ia += 1
             else:
-                del bm[0]
+                ib += 1
 
         return unc
 
 def merge3_lists(a, b, x):
+    a = set(a)
     b_added = list(set(b) - set(x))
     b_deleted = list(set(x) - set(b))
     maybe_modified = list(sorted(set(b) & set(x)))
@@ -571,79 +679,215 @@ def merge3_lists(a, b, x):
     return added, deleted, maybe_modified
 
 
+class VBAModuleSnapshot:
+    """Name, type and digest of a VBA module, read once.
 
-def merge_workbook(filename, x, a, b):
-    # get file extension from original filename
-    ext = filename.split('.')[-1]
+    The content is only fetched from the underlying module on first access.
+    """
 
-    # add file extension
-    x, x_ = f'{x}.{ext}', x  # ancestor of the conflicting workbook
-    a, a_ = f'{a}.{ext}', a  #   current version of the conflicting file
-    b, b_ = f'{b}.{ext}', b
+    __slots__ = ('module', 'name', 'type', 'digest', '_content')
 
-    x = os.path.abspath(x)
-    a = os.path.abspath(a)
-    b = os.path.abspath(b)
+    def __init__(self, module):
+        self.module = module
+        self.name = module.name
+        self.type = module.type
+        self.digest = module.digest
+        self._content = None
 
-    # aspose requires file extension
-    os.rename(a_, a)
-    os.rename(b_, b)
-    os.rename(x_, x)
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.module.content
+        return self._content
+
+
+def snapshot_vba_modules(vba_modules):
+    """Return {name: VBAModuleSnapshot} for a list of VBA modules."""
+    return dict((vba_module.name, VBAModuleSnapshot(vba_module)) for vba_module in vba_modules)
+
+
+def vba_project_digest(modules):
+    """Return a digest over name, type and digest of all mergeable (non-Document) VBA modules."""
+    h = hashlib.sha1()
+    for name in sorted(modules):
+        vba_module = modules[name]
+        if vba_module.type != 'Document':
+            h.update(f'{name}\0{vba_module.type}\0{vba_module.digest}\n'.encode('utf-8'))
+    return h.hexdigest()
 
-    wb_x = Workbook(x)
-    wb_a = Workbook(a)
-    wb_b = Workbook(b)
+
+def merge_files(x, a, b):
+    """Resolve a merge from the file contents alone, without loading any workbook.
+
+    Returns True if the merged result is in `a`, or False if the workbooks
+    need to be merged.
+    """
+    digest_x = file_digest(x)
+    digest_a = file_digest(a)
+    digest_b = file_digest(b)
+    if digest_a == digest_b or digest_b == digest_x:
+        # theirs is identical to ours or unchanged: keep ours
+        return True
+    if digest_a == digest_x:
+        # ours is unchanged: take theirs
+        shutil.copyfile(b, a)
+        return True
+    return False
+
+
+def read_merge_algorithm(path='.'):
+    """Return the diff algorithm for merging VBA modules, from git config xl.merge.algorithm."""
+    return read_config(path).get('xl.merge.algorithm', MERGE_ALGORITHM).lower()
+
+
+def merge_sheets(filename, x, a, b):
+    """Merge the cells that theirs (b) changed into ours (a).
+
+    Cells are only written to Office Open XML packages; changes of theirs to
+    other workbook formats are reported as conflicts. Returns True if there
+    are conflicts.
+    """
+    workbooks = [load_workbook(path) for path in (x, a, b)]
+    writable = all(isinstance(wb, ooxml.Workbook) for wb in workbooks)
+    edits = {}
+    try:
+        with tracing.phase('merge.sheets') as fields:
+            merges, sheet_conflicts = merge_worksheets(*[dict((sheet.name, sheet) for sheet in wb.worksheets)
+                                                         for wb in workbooks])
+            fields.update(sheets=len(merges), conflicts=len(sheet_conflicts) + sum(len(m.conflicts) for m in merges))
+
+        if writable:
+            sheets_b = dict((sheet.name, sheet) for sheet in workbooks[2].worksheets)
+            for merge in merges:
+                if merge.edits:
+                    records = sheets_b[merge.name].read_records(set(merge.edits))
+                    edits[merge.name] = dict((address, records.get(address) if cell else None)
+                                             for address, cell in merge.edits.items())
+    finally:
+        # the packages are replaced below, and renamed back by the caller
+        for wb in workbooks:
+            if isinstance(wb, ooxml.Workbook):
+                wb.close()
+    with tracing.phase('merge.write_cells', path=a) as fields:
+        failed = ooxml.write_cells(a, edits) if edits else set()
+        fields['sheets'] = len(edits) - len(failed)
+
+    for name, reason in sheet_conflicts:
+        if reason == 'modify/delete':
+            print(f'CONFLICT (sheet modify/delete): {filename}/Worksheets/{name} deleted in one branch and modified in other branch')
+        else:
+            print(f'CONFLICT (sheet {reason}): {filename}/Worksheets/{name} {reason} in theirs, please merge manually')
+    conflict = bool(sheet_conflicts)
+    for merge in merges:
+        sheet = f'{filename}/Worksheets/{merge.name}'
+        unwritten = merge.edits and (not writable or merge.name in failed)
+        if unwritten:
+            print(f'CONFLICT (cells): {len(merge.edits)} changed cells of theirs in {sheet} could not be written, '
+                  f'please merge manually')
+        if merge.conflicts:
+            addresses = ', '.join(merge.conflicts[:MAX_CONFLICT_ADDRESSES])
+            if len(merge.conflicts) > MAX_CONFLICT_ADDRESSES:
+                addresses += f' and {len(merge.conflicts) - MAX_CONFLICT_ADDRESSES} more'
+            print(f'CONFLICT (cells): Merge conflict in {sheet}: {addresses}')
+        if unwritten or merge.conflicts:
+            conflict = True
+        elif merge.edits:
+            print(f'--- a/{sheet} +++ b/{sheet}')
+    return conflict
+
+
+def merge_contents(filename, x, a, b, sequencematcher):
+    """Merge the VBA modules and cells of theirs (b) into ours (a). Returns True if there are conflicts."""
+    # read the VBA modules of each workbook once, without xltrail-core
+    with tracing.phase('merge.snapshot') as fields:
+        modules_x = snapshot_vba_modules(vba.read_vba_modules(x))
+        modules_a = snapshot_vba_modules(vba.read_vba_modules(a))
+        modules_b = snapshot_vba_modules(vba.read_vba_modules(b))
+        fields['modules'] = len(modules_x) + len(modules_a) + len(modules_b)
+
+    # our workbook is only opened with xltrail-core once it has to be changed
+    opened = []
+
+    def workbook_a():
+        if not opened:
+            opened.append(load_workbook(a, writable=True))
+        return opened[0]
 
     # ignore 'Document' type; this is bound to a sheet/chart
     # as soon as sheets are implemented, we can lift the restriction
-    vba_modules_a = [vba_module.name for vba_module in wb_a.vba_modules if vba_module.type != 'Document']
-    vba_modules_b = [vba_module.name for vba_module in wb_b.vba_modules if vba_module.type != 'Document']
-    vba_modules_x = [vba_module.name for vba_module in wb_x.vba_modules if vba_module.type != 'Document']
-
-    # perform 3-way list merge
-    added, deleted, maybe_modified = merge3_lists(a=vba_modules_a, b=vba_modules_b, x=vba_modules_x)
+    vba_modules_a = [name for name, vba_module in modules_a.items() if vba_module.type != 'Document']
+    vba_modules_b = [name for name, vba_module in modules_b.items() if vba_module.type != 'Document']
+    vba_modules_x = [name for name, vba_module in modules_x.items() if vba_module.type != 'Document']
+
+    project_b = vba_project_digest(modules_b)
+    if project_b == vba_project_digest(modules_x) or project_b == vba_project_digest(modules_a):
+        # theirs did not change the VBA project or made the same changes as ours
+        added, deleted, maybe_modified = [], [], []
+    else:
+        # perform 3-way list merge
+        added, deleted, maybe_modified = merge3_lists(a=vba_modules_a, b=vba_modules_b, x=vba_modules_x)
+    modified = False
 
     # remove deleted VBA modules
     for name in deleted:
-        vba_module = [m for m in wb_a.vba_modules if m.name == name][0]
+        vba_module = modules_a[name]
         print(f'--- a/{filename}/VBA/{vba_module.type}/{name}')
-        wb_a.remove_vba_module(name)
+        workbook_a().remove_vba_module(name)
+        modified = True
 
     # add VBA modules
     for name in added:
-        vba_module = [m for m in wb_b.vba_modules if m.name == name][0]
-        wb_a.add_vba_module(name, vba_module.type, vba_module.content)
+        vba_module = modules_b[name]
+        workbook_a().add_vba_module(name, vba_module.type, vba_module.content)
         print(f'+++ b/{filename}/VBA/{vba_module.type}/{name}')
+        modified = True
 
     conflict = False
     # merge modified VBA modules
     for name in maybe_modified:
-        vba_module_a = wb_a.get_vba_module(name)
-        vba_module_b = wb_b.get_vba_module(name)
+        vba_module_a = modules_a.get(name)
+        vba_module_b = modules_b.get(name)
 
         digest_a = vba_module_a.digest if vba_module_a else ''
         digest_b = vba_module_b.digest if vba_module_b else ''
 
         if digest_a != digest_b:
-            vba_module_x = wb_x.get_vba_module(name)
-            content_a = vba_module_a.content.split('\n') if vba_module_a else []
-            content_b = vba_module_b.content.split('\n') if vba_module_b else []
-            content_x = vba_module_x.content.split('\n') if vba_module_x else []
-            # perform a 3-way merge
-            m3 = Merge3(
-                a=content_a,
-                b=content_b,
-                base=content_x)
-            is_conflicted = m3.is_conflicted()
-            conflict = conflict or is_conflicted
-            merged = '\n'.join([line for line in m3.merge_lines(name_a=f'{name}:ours', name_b=f'{name}:theirs')])
+            vba_module_x = modules_x.get(name)
+            digest_x = vba_module_x.digest if vba_module_x else ''
+            if digest_b == digest_x:
+                # only ours changed the module
+                continue
+            modified = True
+            if vba_module_a and digest_a == digest_x:
+                # only theirs changed the module
+                is_conflicted = False
+                merged = vba_module_b.content
+            else:
+                content_a = LineTable(vba_module_a.content) if vba_module_a else LineTable()
+                content_b = LineTable(vba_module_b.content) if vba_module_b else LineTable()
+                content_x = LineTable(vba_module_x.content) if vba_module_x else LineTable()
+                # perform a 3-way merge
+                with tracing.phase('merge.merge3', module=name,
+                                   lines=len(content_a) + len(content_b) + len(content_x)) as fields:
+                    m3 = Merge3(
+                        a=content_a,
+                        b=content_b,
+                        base=content_x,
+                        sequencematcher=sequencematcher,
+                        timeout=TIMEOUT,
+                        max_operations=MAX_OPERATIONS)
+                    is_conflicted = m3.is_conflicted()
+                    conflict = conflict or is_conflicted
+                    merged = m3.merge_text(name_a=f'{name}:ours', name_b=f'{name}:theirs')
+                    fields.update(regions=len(m3.merge_regions()), conflicted=is_conflicted)
             modify_delete_conflict = False
             if vba_module_a:
-                vba_module_a.content = merged
+                workbook_a().get_vba_module(name).content = merged
+                m = vba_module_a
             else:
                 modify_delete_conflict = True
-                wb_a.add_vba_module(name, vba_module_b.type, merged)
-            m = wb_a.get_vba_module(name)
+                workbook_a().add_vba_module(name, vba_module_b.type, merged)
+                m = vba_module_b
             if is_conflicted:
                 if modify_delete_conflict:
                     print(f'CONFLICT (VBA modify/delete): {filename}/VBA/{m.type}/{m.name} deleted in one branch and modified in other branch')
@@ -652,22 +896,102 @@ def merge_workbook(filename, x, a, b):
             else:
                 print(f'--- a/{filename}/VBA/{m.type}/{m.name} +++ b/{filename}/VBA/{m.type}/{m.name}')
 
-    # there could be merge conflicts outside VBA (which we do not consider yet)
-    print(f'There might be CONFLICTs in sheets, please check and merge manually')
+    # Document modules are not merged, so changes of theirs to them are conflicts
+    for name, vba_module_b in modules_b.items():
+        vba_module_x = modules_x.get(name)
+        vba_module_a = modules_a.get(name)
+        if vba_module_b.type != 'Document' or vba_module_x is None:
+            continue
+        digest_a = vba_module_a.digest if vba_module_a else ''
+        if vba_module_b.digest not in (vba_module_x.digest, digest_a):
+            print(f'CONFLICT (VBA content): {filename}/VBA/{vba_module_b.type}/{name} changed in theirs, please merge manually')
+            conflict = True
+
+    if modified:
+        with tracing.phase('merge.save', path=a):
+            workbook_a().save()
+
+    # the cells are merged after the VBA project was saved, straight into the package
+    conflict = merge_sheets(filename, x, a, b) or conflict
+    return conflict
+
+
+def merge_workbook(filename, x, a, b, diff_algorithm=None):
+    with tracing.phase('merge.files', path=a) as fields:
+        fields['merged'] = merge_files(x, a, b)
+    if fields['merged']:
+        sys.exit(0)
+
+    # packages that changed in different parts are merged part by part, without opening any workbook
+    with tracing.phase('merge.parts', path=a) as fields:
+        parts = ooxml.merge_parts(x, a, b)
+        fields['parts'] = None if parts is None else len(parts)
+    if parts is not None:
+        for part in parts:
+            print(f'--- a/{filename}/{part} +++ b/{filename}/{part}')
+        sys.exit(0)
+
+    # only VBA modules and cell values and formulas are merged below; other changes of theirs are conflicts
+    with tracing.phase('merge.unmerged_parts', path=a) as fields:
+        unmerged = ooxml.unmerged_parts(x, a, b)
+        fields['parts'] = None if unmerged is None else len(unmerged)
+
+    # the Git config is only read once the files have to be merged
+    if diff_algorithm is None:
+        diff_algorithm = read_merge_algorithm()
+    sequencematcher = get_sequence_matcher(diff_algorithm)
 
-    wb_a.save()
+    # get file extension from original filename
+    ext = filename.split('.')[-1]
 
-    # rename back into original filename, otherwise git won't like it
-    os.rename(a, a_)
-    os.rename(b, b_)
-    os.rename(x, x_)
+    # add file extension
+    x, x_ = f'{x}.{ext}', x  # ancestor of the conflicting workbook
+    a, a_ = f'{a}.{ext}', a  #   current version of the conflicting file
+    b, b_ = f'{b}.{ext}', b
+
+    x = os.path.abspath(x)
+    a = os.path.abspath(a)
+    b = os.path.abspath(b)
 
-    # TODO: we do not no whether there is NO conflict (ie non-VBA conflicts)
-    # if conflict:
-    #     sys.exit(1)
+    # aspose requires file extension
+    os.rename(a_, a)
+    os.rename(b_, b)
+    os.rename(x_, x)
 
-    sys.exit(1)
+    try:
+        conflict = merge_contents(filename, x, a, b, sequencematcher)
+    finally:
+        # rename back into original filename, otherwise git won't like it
+        os.rename(a, a_)
+        os.rename(b, b_)
+        os.rename(x, x_)
+
+    if unmerged is None:
+        print(f'CONFLICT (content): {filename} can only be merged in VBA modules and cells, '
+              f'please check the other changes of theirs manually')
+        conflict = True
+    for part in unmerged or []:
+        print(f'CONFLICT (part): {filename}/{part} changed in theirs, please merge manually')
+        conflict = True
+
+    sys.exit(1 if conflict else 0)
+
+
+def main(args):
+    diff_algorithm = None
+    remaining = []
+    args = iter(args)
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if name == '--diff-algorithm':
+            diff_algorithm = (value or next(args)).lower()
+        else:
+            remaining.append(arg)
+    if diff_algorithm is not None and diff_algorithm not in DIFF_ALGORITHMS:
+        print(f'Error: unknown diff algorithm "{diff_algorithm}"')
+        sys.exit(1)
+    merge_workbook(*remaining, diff_algorithm=diff_algorithm)
 
 
 if __name__ == '__main__':
-    merge_workbook(*sys.argv[1:])
\ No newline at end of file
+    sys.exit(server.forward('merge', sys.argv[1:]))
\ No newline at end of file
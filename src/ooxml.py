@@ -0,0 +1,672 @@
+"""Read-only workbook backend for Office Open XML packages (.xlsx, .xlsm, .xltx, .xltm).
+
+Sheets are streamed from the zip package with iterparse, so digests and cell
+counts are computed in bounded memory and without the .NET runtime. The
+shared string table is only read once a sheet refers to it.
+
+For merges, `merge_parts` combines packages part by part, and `write_cells`
+changes cells of a package in place; both leave all other parts as they are.
+"""
+import os
+import re
+import hashlib
+import zipfile
+import tempfile
+import posixpath
+from xml.etree.ElementTree import iterparse, tostring
+from xml.sax.saxutils import escape
+
+import vba
+
+
+FILE_EXTENSIONS = ['xlsx', 'xlsm', 'xltx', 'xltm']
+WORKBOOK_PART = 'xl/workbook.xml'
+SHARED_STRINGS = 'xl/sharedStrings.xml'
+VBA_PROJECT = 'xl/vbaProject.bin'
+CALC_CHAIN = 'xl/calcChain.xml'
+CONTENT_TYPES = '[Content_Types].xml'
+WORKBOOK_RELS = 'xl/_rels/workbook.xml.rels'
+STYLES = 'xl/styles.xml'
+# parts whose entries other parts refer to by index
+INDEXED_PARTS = (SHARED_STRINGS, STYLES)
+# document properties change on every save; merges keep ours
+METADATA_PARTS = ('docProps/core.xml', 'docProps/app.xml')
+# parts whose changes the VBA and cell merges carry over: the VBA modules are
+# merged, cells are written with inline strings, and the calculation chain
+# is rebuilt by Excel
+MERGED_PARTS = METADATA_PARTS + (VBA_PROJECT, SHARED_STRINGS, CALC_CHAIN)
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def string_item_text(elem):
+    """Return the text of a string item (<si> or <is>), joining rich text runs and skipping phonetic hints."""
+    parts = []
+    for child in elem:
+        name = local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.extend(t.text or '' for t in child if local_name(t.tag) == 't')
+    return ''.join(parts)
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def column_letters(number):
+    letters = ''
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def split_address(address):
+    """Return (row, column) of an A1-style address."""
+    i = 0
+    while i < len(address) and address[i].isalpha():
+        i += 1
+    return int(address[i:]), column_number(address[:i].upper())
+
+
+class Cell:
+    __slots__ = ('address', 'row', 'column', 'value', 'formula')
+
+    def __init__(self, address, row, column, value, formula):
+        self.address = address
+        self.row = row
+        self.column = column
+        self.value = value
+        self.formula = formula
+
+
+class Cells:
+    """The populated cells of a sheet, streamed from the package on every iteration."""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def __iter__(self):
+        return self.worksheet.iter_cells()
+
+    @property
+    def Count(self):
+        return self.worksheet.count
+
+
+class Worksheet:
+
+    def __init__(self, workbook, name, member):
+        self.workbook = workbook
+        self.name = name
+        self.member = member
+        self.cells = Cells(self)
+        self._digest = None
+        self._count = None
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._scan()
+        return self._digest
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._scan()
+        return self._count
+
+    def _scan(self):
+        # digest and count are computed in one pass; shared strings are resolved,
+        # as Excel renumbers the shared string table when it saves a workbook
+        sha1 = hashlib.sha1()
+        count = 0
+        for address, kind, text, formula in self.iter_records():
+            value = self.workbook.convert(kind, text)
+            sha1.update(f'{address}\0{value!r}\0{formula}\n'.encode('utf-8'))
+            count += 1
+        self._digest = sha1.hexdigest()
+        self._count = count
+
+    def iter_records(self, formula_types=False):
+        """Yield (address, type, value text, formula) of the populated cells, in file order.
+
+        With `formula_types`, the type attribute of the formula ('shared',
+        'array', ... or None) is yielded as well.
+        """
+        with self.workbook.open_member(self.member) as f:
+            events = iterparse(f, events=('start', 'end'))
+            _, root = next(events)
+            # compare full tag names, the namespace differs between transitional and strict files
+            ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+            sheet_data_tag, row_tag, cell_tag = ns + 'sheetData', ns + 'row', ns + 'c'
+            value_tag, formula_tag, inline_string_tag = ns + 'v', ns + 'f', ns + 'is'
+            sheet_data = root
+            row = 0
+            for event, elem in events:
+                if elem.tag != row_tag:
+                    if event == 'start' and elem.tag == sheet_data_tag:
+                        sheet_data = elem
+                    continue
+                if event == 'start':
+                    continue
+
+                # a row is processed once it is complete
+                row = int(elem.get('r', row + 1))
+                previous = None
+                for cell in elem:
+                    if cell.tag != cell_tag:
+                        continue
+                    address = cell.get('r')
+                    if address is None:
+                        column = split_address(previous)[1] + 1 if previous else 1
+                        address = column_letters(column) + str(row)
+                    previous = address
+                    text = formula = formula_type = None
+                    for child in cell:
+                        if child.tag == value_tag:
+                            text = child.text or ''
+                        elif child.tag == formula_tag:
+                            formula = child.text
+                            formula_type = child.get('t')
+                        elif child.tag == inline_string_tag:
+                            text = string_item_text(child)
+                    if text is None and formula is None:
+                        continue
+                    if formula_types:
+                        yield address, cell.get('t', 'n'), text, formula, formula_type
+                    else:
+                        yield address, cell.get('t', 'n'), text, formula
+                # drop parsed rows, so memory does not grow with the sheet
+                sheet_data.clear()
+
+    def iter_cells(self):
+        # a complete pass also yields the digest and count, if they are not known yet
+        sha1 = hashlib.sha1() if self._digest is None else None
+        count = 0
+        for address, kind, text, formula in self.iter_records():
+            row, column = split_address(address)
+            value = self.workbook.convert(kind, text)
+            if sha1 is not None:
+                sha1.update(f'{address}\0{value!r}\0{formula}\n'.encode('utf-8'))
+                count += 1
+            yield Cell(address, row, column, value, '=' + formula if formula else None)
+        if sha1 is not None:
+            self._digest = sha1.hexdigest()
+            self._count = count
+
+    def read_records(self, addresses):
+        """Return {address: (type, value text, formula, formula type)} of the given cells.
+
+        Shared strings are resolved into inline strings, so that the records
+        can be written to another package with `write_cells`.
+        """
+        records = {}
+        for address, kind, text, formula, formula_type in self.iter_records(formula_types=True):
+            if address in addresses:
+                if kind == 's':
+                    kind, text = 'inlineStr', self.workbook.shared_strings[int(text)]
+                records[address] = (kind, text, formula, formula_type)
+        return records
+
+
+class Workbook:
+    """Read-only workbook with the `worksheets` and `vba_modules` of xltrail-core's Workbook."""
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        self._shared_strings = None
+        self._vba_modules = None
+        self.worksheets = self._read_worksheets()
+
+    def open_member(self, name):
+        return self.zip.open(name)
+
+    def close(self):
+        self.zip.close()
+
+    def _read_worksheets(self):
+        targets = {}
+        with self.open_member(WORKBOOK_RELS) as f:
+            for _, elem in iterparse(f):
+                if local_name(elem.tag) == 'Relationship' and elem.get('Type', '').endswith('/worksheet'):
+                    target = elem.get('Target')
+                    if target.startswith('/'):
+                        target = target[1:]
+                    else:
+                        target = posixpath.normpath(posixpath.join('xl', target))
+                    targets[elem.get('Id')] = target
+
+        worksheets = []
+        with self.open_member(WORKBOOK_PART) as f:
+            for _, elem in iterparse(f):
+                if local_name(elem.tag) == 'sheet':
+                    rel_id = next((value for key, value in elem.attrib.items() if local_name(key) == 'id'), None)
+                    if rel_id in targets:
+                        worksheets.append(Worksheet(self, elem.get('name'), targets[rel_id]))
+        return worksheets
+
+    @property
+    def shared_strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = []
+            try:
+                f = self.open_member(SHARED_STRINGS)
+            except KeyError:
+                return self._shared_strings
+            with f:
+                for _, elem in iterparse(f):
+                    if local_name(elem.tag) == 'si':
+                        self._shared_strings.append(string_item_text(elem))
+                        elem.clear()
+        return self._shared_strings
+
+    def convert(self, kind, text):
+        """Return the value of a cell from its type attribute and raw text."""
+        if text is None:
+            return None
+        if kind == 's':
+            return self.shared_strings[int(text)]
+        if kind == 'b':
+            return text == '1'
+        if kind == 'n':
+            return float(text) if text else None
+        return text
+
+    @property
+    def vba_modules(self):
+        if self._vba_modules is None:
+            if VBA_PROJECT in self.zip.namelist():
+                self._vba_modules = vba.read_vba_project(self.zip.read(VBA_PROJECT))
+            else:
+                self._vba_modules = []
+        return self._vba_modules
+
+
+class WorksheetManifest:
+    """Manifest entry of a worksheet; digest and cell count are only computed on access."""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.name = worksheet.name
+        self.member = worksheet.member
+
+    @property
+    def digest(self):
+        return self.worksheet.digest
+
+    @property
+    def cells(self):
+        return self.worksheet.count
+
+
+class PackageManifest:
+    """Manifest of a package, with the `worksheets` and `vba_modules` of `cache.Manifest`."""
+
+    def __init__(self, path):
+        self.workbook = Workbook(path)
+        self.worksheets = [WorksheetManifest(sheet) for sheet in self.workbook.worksheets]
+
+    @property
+    def vba_modules(self):
+        return self.workbook.vba_modules
+
+
+def read_part_index(path):
+    """Return {part name: (CRC-32, size)} from the central directory of a package.
+
+    Nothing is decompressed. Returns None if `path` is not an Office Open XML
+    package.
+    """
+    if path is None or not zipfile.is_zipfile(path):
+        return None
+    with zipfile.ZipFile(path) as z:
+        index = dict((info.filename, (info.CRC, info.file_size)) for info in z.infolist())
+    return index if WORKBOOK_PART in index else None
+
+
+def unchanged_parts(path_a, path_b):
+    """Return the names of the parts that are identical in two packages, by CRC-32 and size.
+
+    Worksheet parts only count as unchanged if the shared strings they refer
+    to are unchanged too. Returns None unless both files are Office Open XML
+    packages.
+    """
+    index_a = read_part_index(path_a)
+    index_b = read_part_index(path_b) if index_a is not None else None
+    if index_b is None:
+        return None
+    unchanged = set(name for name, entry in index_a.items() if index_b.get(name) == entry)
+    if index_a.get(SHARED_STRINGS) != index_b.get(SHARED_STRINGS):
+        unchanged = set(name for name in unchanged if not name.startswith('xl/worksheets/'))
+    return unchanged
+
+
+SHEET_DATA_PATTERN = re.compile(r'<(\w+:)?sheetData\b[^>]*?(/?)>')
+ROW_PATTERN = re.compile(r'<(?:\w+:)?row\b[^>]*?(?:/>|>.*?</(?:\w+:)?row>)', re.S)
+CELL_PATTERN = re.compile(r'<(?:\w+:)?c\b[^>]*?(?:/>|>.*?</(?:\w+:)?c>)', re.S)
+REFERENCE_PATTERN = re.compile(r'\sr="([^"]*)"')
+STYLE_PATTERN = re.compile(r'\ss="([^"]*)"')
+# the first cell of a shared or array formula, which other cells depend on
+FORMULA_RANGE_PATTERN = re.compile(r'<(?:\w+:)?f\b[^>]*\sref="')
+ATTRIBUTE_PATTERN = re.compile(r'\s([\w:]+)="([^"]*)"')
+# the used range and the selection change with the cells and the view, not with the layout
+VIEW_PATTERN = re.compile(r'<(?:\w+:)?dimension\b[^>]*/>|<(?:\w+:)?sheetViews\b.*?</(?:\w+:)?sheetViews>', re.S)
+
+
+def start_tag(element):
+    return element[:element.index('>') + 1]
+
+
+def cell_xml(prefix, address, style, record):
+    """Return the XML of a cell from a record of `Worksheet.read_records`.
+
+    Returns None if the record cannot be written on its own, e.g. a cell
+    that refers to a shared formula of other cells.
+    """
+    kind, text, formula, formula_type = record
+    if formula_type not in (None, 'normal', 'shared') or (formula_type == 'shared' and formula is None):
+        return None
+    attributes = f' r="{address}"'
+    if style is not None:
+        attributes += f' s="{style}"'
+    if kind != 'n':
+        attributes += f' t="{kind}"'
+    content = ''
+    if formula is not None:
+        content += f'<{prefix}f>{escape(formula)}</{prefix}f>'
+    if kind == 'inlineStr':
+        content += f'<{prefix}is><{prefix}t xml:space="preserve">{escape(text)}</{prefix}t></{prefix}is>'
+    elif text is not None:
+        content += f'<{prefix}v>{escape(text)}</{prefix}v>'
+    return f'<{prefix}c{attributes}>{content}</{prefix}c>'
+
+
+def edit_row_xml(prefix, row, edits):
+    """Apply {address: record or None} to the XML of a row; returns None if that is not possible."""
+    if row.endswith('/>'):
+        start, body, end = row[:-2] + '>', '', f'</{prefix}row>'
+    else:
+        start = start_tag(row)
+        end_position = row.rindex('</')
+        body, end = row[len(start):end_position], row[end_position:]
+    # cells that are not in the row yet, in column order
+    new_cells = sorted((split_address(address)[1], address) for address in edits)
+    pieces = [start]
+    position = 0
+    for match in CELL_PATTERN.finditer(body):
+        element = match.group(0)
+        reference = REFERENCE_PATTERN.search(start_tag(element))
+        if reference is None:
+            return None
+        address = reference.group(1)
+        column = split_address(address)[1]
+        pieces.append(body[position:match.start()])
+        position = match.end()
+        while new_cells and new_cells[0][0] < column:
+            cell = new_cells.pop(0)[1]
+            if edits[cell] is not None:
+                pieces.append(cell_xml(prefix, cell, None, edits[cell]))
+        if new_cells and new_cells[0][1] == address:
+            new_cells.pop(0)
+        if address not in edits:
+            pieces.append(element)
+            continue
+        if FORMULA_RANGE_PATTERN.search(element):
+            return None
+        if edits[address] is not None:
+            style = STYLE_PATTERN.search(start_tag(element))
+            pieces.append(cell_xml(prefix, address, style.group(1) if style else None, edits[address]))
+    pieces.append(body[position:])
+    for _, cell in new_cells:
+        if edits[cell] is not None:
+            pieces.append(cell_xml(prefix, cell, None, edits[cell]))
+    if None in pieces:
+        return None
+    pieces.append(end)
+    return ''.join(pieces)
+
+
+def edit_sheet_xml(xml, edits):
+    """Apply {address: record or None} to the XML of a worksheet.
+
+    Only the rows with edited cells are rewritten, everything else is kept
+    as it is. Returns None if the edits cannot be applied, e.g. to rows or
+    cells without a reference or to the first cell of a shared formula.
+    """
+    sheet_data = SHEET_DATA_PATTERN.search(xml)
+    if sheet_data is None:
+        return None
+    prefix = sheet_data.group(1) or ''
+    if sheet_data.group(2):
+        # an empty <sheetData/>
+        head, body, tail = xml[:sheet_data.start()] + sheet_data.group(0)[:-2] + '>', '', f'</{prefix}sheetData>' + xml[sheet_data.end():]
+    else:
+        end = xml.index(f'</{prefix}sheetData>', sheet_data.end())
+        head, body, tail = xml[:sheet_data.end()], xml[sheet_data.end():end], xml[end:]
+
+    rows = {}
+    for address, record in edits.items():
+        rows.setdefault(split_address(address)[0], {})[address] = record
+    # rows that are not in the sheet yet, in row order
+    new_rows = sorted(rows)
+    pieces = [head]
+    position = 0
+
+    def add_new_rows(before):
+        while new_rows and new_rows[0] < before:
+            number = new_rows.pop(0)
+            row = edit_row_xml(prefix, f'<{prefix}row r="{number}"/>', rows[number])
+            if row != f'<{prefix}row r="{number}"></{prefix}row>':
+                pieces.append(row)
+
+    for match in ROW_PATTERN.finditer(body):
+        reference = REFERENCE_PATTERN.search(start_tag(match.group(0)))
+        if reference is None:
+            return None
+        number = int(reference.group(1))
+        pieces.append(body[position:match.start()])
+        position = match.end()
+        add_new_rows(number)
+        if new_rows and new_rows[0] == number:
+            new_rows.pop(0)
+        if number in rows:
+            pieces.append(edit_row_xml(prefix, match.group(0), rows[number]))
+        else:
+            pieces.append(match.group(0))
+    pieces.append(body[position:])
+    add_new_rows(float('inf'))
+    if None in pieces:
+        return None
+    pieces.append(tail)
+    return ''.join(pieces)
+
+
+def remove_calc_chain(parts):
+    """Drop the calculation chain from {part name: content}; Excel rebuilds it when a workbook is opened."""
+    del parts[CALC_CHAIN]
+    parts[CONTENT_TYPES] = re.sub(rb'<Override[^>]*PartName="/xl/calcChain.xml"[^>]*/>', b'', parts[CONTENT_TYPES])
+    parts[WORKBOOK_RELS] = re.sub(rb'<Relationship[^>]*Target="(?:/xl/)?calcChain.xml"[^>]*/>', b'', parts[WORKBOOK_RELS])
+
+
+def write_cells(path, edits):
+    """Apply cell edits {sheet name: {address: record or None}} to a package in place.
+
+    Records are the tuples of `Worksheet.read_records`; None removes a cell.
+    Only the parts of the edited sheets are rewritten, and the calculation
+    chain is dropped, as it may list cells that no longer have a formula.
+    Returns the names of the sheets whose edits could not be written.
+    """
+    workbook = Workbook(path)
+    members = dict((sheet.name, sheet.member) for sheet in workbook.worksheets)
+    workbook.close()
+    failed = set()
+    with zipfile.ZipFile(path) as z:
+        parts = dict((name, None) for name in z.namelist())
+        for name, sheet_edits in edits.items():
+            xml = edit_sheet_xml(z.read(members[name]).decode('utf-8'), sheet_edits)
+            if xml is None:
+                failed.add(name)
+            else:
+                parts[members[name]] = xml.encode('utf-8')
+        if len(failed) == len(edits):
+            return failed
+        if CALC_CHAIN in parts:
+            parts[CONTENT_TYPES] = z.read(CONTENT_TYPES)
+            parts[WORKBOOK_RELS] = z.read(WORKBOOK_RELS)
+            remove_calc_chain(parts)
+        members = [(info, z.read(info) if parts[info.filename] is None else parts[info.filename])
+                   for info in z.infolist() if info.filename in parts]
+    replace_package(path, members)
+    return failed
+
+
+def replace_package(path, members):
+    """Replace the package at `path` by one with the given (ZipInfo, content) members.
+
+    The new package is written next to the old one first, so that it is
+    never left half written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp_path, 'w') as out:
+            for info, content in members:
+                out.writestr(info, content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_string_items(z):
+    """Return the serialized items of the shared string table of an open package."""
+    items = []
+    if SHARED_STRINGS not in z.namelist():
+        return items
+    with z.open(SHARED_STRINGS) as f:
+        for _, elem in iterparse(f):
+            if local_name(elem.tag) == 'si':
+                # whitespace between the items does not matter
+                elem.tail = None
+                items.append(tostring(elem))
+                elem.clear()
+    return items
+
+
+def merge_parts(path_x, path_a, path_b):
+    """Three-way merge of packages by their parts, without parsing any sheet.
+
+    Parts that only theirs (b) changed, added or removed are taken verbatim
+    into ours (a). Returns the names of the parts taken from theirs, or None,
+    without changing ours, if the packages have to be merged by content:
+    because a part changed differently on both sides, or because a table
+    that other parts refer to by index changed on one side while the other
+    side changed the parts that refer to it. The shared string table may
+    still change on one side if it only got new strings appended.
+
+    The merge by content only carries over VBA modules and cells, so after
+    falling back, the caller has to report the other parts that theirs
+    changed, see `unmerged_parts`.
+    """
+    indexes = [read_part_index(path) for path in (path_x, path_a, path_b)]
+    if None in indexes:
+        return None
+    index_x, index_a, index_b = indexes
+    changed_a = set(name for name in set(index_a) | set(index_x) if index_a.get(name) != index_x.get(name))
+    changed_b = set(name for name in set(index_b) | set(index_x) if index_b.get(name) != index_x.get(name))
+    taken = sorted(name for name in changed_b - changed_a if name not in METADATA_PARTS)
+    for name in changed_a & changed_b:
+        if index_a.get(name) != index_b.get(name) and name not in METADATA_PARTS:
+            return None
+    for name in INDEXED_PARTS:
+        for changed, other in ((changed_a, changed_b), (changed_b, changed_a)):
+            if name in changed and name not in other and other - set(METADATA_PARTS):
+                if name != SHARED_STRINGS:
+                    return None
+                with zipfile.ZipFile(path_x) as zx, zipfile.ZipFile(path_a if changed is changed_a else path_b) as z:
+                    items_x = read_string_items(zx)
+                    if read_string_items(z)[:len(items_x)] != items_x:
+                        return None
+    if not taken:
+        return taken
+
+    with zipfile.ZipFile(path_a) as za, zipfile.ZipFile(path_b) as zb:
+        members = []
+        for info in za.infolist():
+            if info.filename not in taken:
+                members.append((info, za.read(info)))
+            elif info.filename in index_b:
+                members.append((info, zb.read(info.filename)))
+        members.extend((info, zb.read(info)) for info in zb.infolist()
+                       if info.filename in taken and info.filename not in index_a)
+    replace_package(path_a, members)
+    return taken
+
+
+def sheet_layout(xml):
+    """Return the XML of a worksheet without the values and formulas of its cells.
+
+    What is left are the parts of a sheet that the cell merge does not carry
+    over: cell styles, row and column formats, merged ranges, conditional
+    formats and so on. The used range and the sheet views are left out too.
+    """
+    def reference(element):
+        match = REFERENCE_PATTERN.search(start_tag(element))
+        return f' r="{match.group(1)}"' if match else ''
+
+    def cell_layout(match):
+        style = STYLE_PATTERN.search(start_tag(match.group(0)))
+        if style is None or style.group(1) == '0':
+            return ''
+        return f'<c{reference(match.group(0))} s="{style.group(1)}"/>'
+
+    def row_layout(match):
+        row = match.group(0)
+        attributes = ''.join(f' {name}="{value}"' for name, value in ATTRIBUTE_PATTERN.findall(start_tag(row))
+                             if name not in ('r', 'spans'))
+        cells = '' if row.endswith('/>') else ''.join(map(cell_layout, CELL_PATTERN.finditer(row)))
+        if not attributes and not cells:
+            return ''
+        return f'<row{reference(row)}{attributes}>{cells}</row>'
+
+    return ROW_PATTERN.sub(row_layout, VIEW_PATTERN.sub('', xml))
+
+
+def is_worksheet_part(name):
+    return name.startswith('xl/worksheets/') and name.endswith('.xml')
+
+
+def unmerged_parts(path_x, path_a, path_b):
+    """Return the parts that theirs (b) changed and that merging VBA modules and cells does not carry over.
+
+    A part counts as carried over if theirs left it as in the base or as in
+    ours (a), if it is one of `MERGED_PARTS`, or if it is a worksheet whose
+    `sheet_layout` theirs left as in the base or as in ours. Returns None if
+    the files are not Office Open XML packages and cannot be checked.
+    """
+    indexes = [read_part_index(path) for path in (path_x, path_a, path_b)]
+    if None in indexes:
+        return None
+    index_x, index_a, index_b = indexes
+    changed = sorted(name for name in set(index_x) | set(index_b)
+                     if index_b.get(name) not in (index_x.get(name), index_a.get(name)) and name not in MERGED_PARTS)
+    unmerged = []
+    with zipfile.ZipFile(path_x) as zx, zipfile.ZipFile(path_a) as za, zipfile.ZipFile(path_b) as zb:
+        for name in changed:
+            if is_worksheet_part(name) and name in index_b and name in index_x:
+                layout_b = sheet_layout(zb.read(name).decode('utf-8'))
+                if layout_b == sheet_layout(zx.read(name).decode('utf-8')):
+                    continue
+                if name in index_a and layout_b == sheet_layout(za.read(name).decode('utf-8')):
+                    continue
+            unmerged.append(name)
+    return unmerged
@@ -1,10 +1,14 @@
 from __future__ import absolute_import
 
+from array import array
 from bisect import bisect
 import difflib
+import time
 
+from linetable import LineTable, intern_tables
 
-__all__ = ['PatienceSequenceMatcher', 'unified_diff', 'unified_diff_files']
+
+__all__ = ['PatienceSequenceMatcher', 'Budget', 'unified_diff', 'unified_diff_files']
 
 
 def unique_lcs_py(a, b):
@@ -21,39 +25,47 @@ def unique_lcs_py(a, b):
     The longest common subset uses the Patience Sorting algorithm:
     http://en.wikipedia.org/wiki/Patience_sorting
     """
+    return _unique_lcs_range(a, b, 0, len(a), 0, len(b))
+
+
+def _unique_lcs_range(a, b, alo, ahi, blo, bhi):
+    """Like unique_lcs_py, but on a[alo:ahi] and b[blo:bhi].
+
+    Returns absolute positions in a and b. Slicing a memoryview does not
+    copy, so the matcher passes memoryviews of its interned line ids.
+    """
     # set index[line in a] = position of line in a unless
     # a is a duplicate, in which case it's set to None
     index = {}
-    for i in range(len(a)):
-        line = a[i]
+    for i, line in enumerate(a[alo:ahi], alo):
         if line in index:
             index[line] = None
         else:
             index[line]= i
-    # make btoa[i] = position of line i in a, unless
+    # make btoa[i] = position of line blo+i in a, unless
     # that line doesn't occur exactly once in both,
-    # in which case it's set to None
-    btoa = [None] * len(b)
+    # in which case it's set to -1
+    btoa = array('i', [-1]) * (bhi - blo)
     index2 = {}
-    for pos, line in enumerate(b):
+    for pos, line in enumerate(b[blo:bhi], blo):
         next = index.get(line)
         if next is not None:
             if line in index2:
                 # unset the previous mapping, which we now know to
                 # be invalid because the line isn't unique
-                btoa[index2[line]] = None
+                btoa[index2[line] - blo] = -1
                 del index[line]
             else:
                 index2[line] = pos
-                btoa[pos] = next
+                btoa[pos - blo] = next
     # this is the Patience sorting algorithm
     # see http://en.wikipedia.org/wiki/Patience_sorting
-    backpointers = [None] * len(b)
+    backpointers = array('i', [-1]) * (bhi - blo)
     stacks = []
     lasts = []
     k = 0
     for bpos, apos in enumerate(btoa):
-        if apos is None:
+        if apos == -1:
             continue
         # as an optimization, check if the next line comes at the end,
         # because it usually does
@@ -78,100 +90,180 @@ def unique_lcs_py(a, b):
         return []
     result = []
     k = lasts[-1]
-    while k is not None:
-        result.append((btoa[k], k))
+    while k != -1:
+        result.append((btoa[k], k + blo))
         k = backpointers[k]
     result.reverse()
     return result
 
 
-def recurse_matches_py(a, b, alo, blo, ahi, bhi, answer, maxrecursion):
+def intern_lines(a, b):
+    """Map the lines of a and b to integer ids, equal lines getting the same id.
+
+    Returns two compact `array('i')` buffers, so that the matcher only hashes
+    every line once and then compares small integers. Line tables are
+    interned by their precomputed hashes, without slicing every line.
+    """
+    if isinstance(a, LineTable) and isinstance(b, LineTable):
+        return intern_tables(a, b)
+    ids = {}
+    a_ids = array('i', [ids.setdefault(line, len(ids)) for line in a])
+    b_ids = array('i', [ids.setdefault(line, len(ids)) for line in b])
+    return a_ids, b_ids
+
+
+class Budget:
+    """Time and operation limit of a matcher.
+
+    Once the budget is spent, the remaining ranges are only matched coarsely
+    (see `coarse_matches`), so that matching finishes in bounded time on
+    pathological input. Operations are counted in lines examined.
+    """
+
+    def __init__(self, timeout=None, max_operations=None):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.operations_left = max_operations
+        self.exhausted = False
+
+    def spend(self, operations):
+        """Account for `operations` units of work; returns False once the budget is spent."""
+        if self.exhausted:
+            return False
+        if self.operations_left is not None:
+            self.operations_left -= operations
+            if self.operations_left < 0:
+                self.exhausted = True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.exhausted = True
+        return not self.exhausted
+
+
+def coarse_matches(a, b, alo, blo, ahi, bhi, answer):
+    """Match the common prefix and suffix of a[alo:ahi] and b[blo:bhi], leaving one replacement in between."""
+    start = alo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        answer.append((alo, blo))
+        alo += 1
+        blo += 1
+    nahi = ahi
+    nbhi = bhi
+    while nahi > alo and nbhi > blo and a[nahi - 1] == b[nbhi - 1]:
+        nahi -= 1
+        nbhi -= 1
+    for i in range(ahi - nahi):
+        answer.append((nahi + i, nbhi + i))
+
+
+def find_matches(a, b, alo, blo, ahi, bhi, answer, budget=None):
     """Find all of the matching text in the lines of a and b.
 
     :param a: A sequence
     :param b: Another sequence
     :param alo: The start location of a to check, typically 0
-    :param ahi: The start location of b to check, typically 0
+    :param blo: The start location of b to check, typically 0
     :param ahi: The maximum length of a to check, typically len(a)
     :param bhi: The maximum length of b to check, typically len(b)
     :param answer: The return array. Will be filled with tuples
-                   indicating [(line_in_a, line_in_b)]
-    :param maxrecursion: The maximum depth to recurse.
-                         Must be a positive integer.
+                   indicating [(line_in_a, line_in_b)], in increasing order
+    :param budget: An optional Budget; ranges left once it is spent are
+                   matched with `coarse_matches`
     :return: None, the return value is in the parameter answer, which
              should be a list
 
+    Ranges between matched unique lines are refined on an explicit work
+    stack instead of by recursion, so there is no limit on the nesting.
     """
-    if maxrecursion < 0:
-        raise ValueError('max recursion depth reached')
-        # this will never happen normally, this check is to prevent DOS attacks
-        return
-    oldlength = len(answer)
-    if alo == ahi or blo == bhi:
-        return
-    last_a_pos = alo-1
-    last_b_pos = blo-1
-    for apos, bpos in unique_lcs_py(a[alo:ahi], b[blo:bhi]):
-        # recurse between lines which are unique in each file and match
-        apos += alo
-        bpos += blo
-        # Most of the time, you will have a sequence of similar entries
-        if last_a_pos+1 != apos or last_b_pos+1 != bpos:
-            recurse_matches_py(a, b, last_a_pos+1, last_b_pos+1,
-                apos, bpos, answer, maxrecursion - 1)
-        last_a_pos = apos
-        last_b_pos = bpos
-        answer.append((apos, bpos))
-    if len(answer) > oldlength:
-        # find matches between the last match and the end
-        recurse_matches_py(a, b, last_a_pos+1, last_b_pos+1,
-                           ahi, bhi, answer, maxrecursion - 1)
-    elif a[alo] == b[blo]:
-        # find matching lines at the very beginning
-        while alo < ahi and blo < bhi and a[alo] == b[blo]:
-            answer.append((alo, blo))
-            alo += 1
-            blo += 1
-        recurse_matches_py(a, b, alo, blo,
-                           ahi, bhi, answer, maxrecursion - 1)
-    elif a[ahi - 1] == b[bhi - 1]:
-        # find matching lines at the very end
-        nahi = ahi - 1
-        nbhi = bhi - 1
-        while nahi > alo and nbhi > blo and a[nahi - 1] == b[nbhi - 1]:
-            nahi -= 1
-            nbhi -= 1
-        recurse_matches_py(a, b, last_a_pos+1, last_b_pos+1,
-                           nahi, nbhi, answer, maxrecursion - 1)
-        for i in range(ahi - nahi):
-            answer.append((nahi + i, nbhi + i))
-
-
-def _collapse_sequences(matches):
-    """Find sequences of lines.
-
-    Given a sequence of [(line_in_a, line_in_b),]
-    find regions where they both increment at the same time
+    # tasks are ranges to match, or runs of (apos, bpos, length) known matches,
+    # popped in order so that answer is filled with increasing positions
+    stack = [(False, alo, blo, ahi, bhi)]
+    while stack:
+        is_match, alo, blo, ahi, bhi = stack.pop()
+        if is_match:
+            # (apos, bpos, length)
+            for i in range(ahi):
+                answer.append((alo + i, blo + i))
+            continue
+        if alo == ahi or blo == bhi:
+            continue
+        if ahi - alo == bhi - blo and a[alo:ahi] == b[blo:bhi]:
+            # identical ranges always match line by line; this is the common
+            # case for the gaps between unique lines (End Sub, blank lines, ...)
+            stack.append((True, alo, blo, ahi - alo, None))
+            continue
+        if budget is not None and not budget.spend(ahi - alo + bhi - blo):
+            coarse_matches(a, b, alo, blo, ahi, bhi, answer)
+            continue
+
+        tasks = []
+        last_a_pos = alo - 1
+        last_b_pos = blo - 1
+        for apos, bpos in _unique_lcs_range(a, b, alo, ahi, blo, bhi):
+            # refine between lines which are unique in each file and match
+            # Most of the time, you will have a sequence of similar entries
+            if last_a_pos + 1 != apos or last_b_pos + 1 != bpos:
+                tasks.append((False, last_a_pos + 1, last_b_pos + 1, apos, bpos))
+            last_a_pos = apos
+            last_b_pos = bpos
+            tasks.append((True, apos, bpos, 1, None))
+        if tasks:
+            # find matches between the last match and the end
+            tasks.append((False, last_a_pos + 1, last_b_pos + 1, ahi, bhi))
+        elif a[alo] == b[blo]:
+            # find matching lines at the very beginning
+            length = 0
+            while alo + length < ahi and blo + length < bhi and a[alo + length] == b[blo + length]:
+                length += 1
+            tasks.append((True, alo, blo, length, None))
+            tasks.append((False, alo + length, blo + length, ahi, bhi))
+        elif a[ahi - 1] == b[bhi - 1]:
+            # find matching lines at the very end
+            nahi = ahi - 1
+            nbhi = bhi - 1
+            while nahi > alo and nbhi > blo and a[nahi - 1] == b[nbhi - 1]:
+                nahi -= 1
+                nbhi -= 1
+            tasks.append((False, alo, blo, nahi, nbhi))
+            tasks.append((True, nahi, nbhi, ahi - nahi, None))
+        stack.extend(reversed(tasks))
+
+
+class _MatchCollector:
+    """Stand-in for the `answer` list of find_matches.
+
+    Given a sequence of (line_in_a, line_in_b) appended in increasing order,
+    find regions where they both increment at the same time. Matches are
+    collapsed into (start_a, start_b, length) blocks as they arrive instead
+    of keeping a tuple per matching line.
     """
-    answer = []
-    start_a = start_b = None
-    length = 0
-    for i_a, i_b in matches:
-        if (start_a is not None
-            and (i_a == start_a + length)
-            and (i_b == start_b + length)):
-            length += 1
-        else:
-            if start_a is not None:
-                answer.append((start_a, start_b, length))
-            start_a = i_a
-            start_b = i_b
-            length = 1
 
-    if length != 0:
-        answer.append((start_a, start_b, length))
+    def __init__(self):
+        self.blocks = []
+        self.count = 0
+        self.start_a = self.start_b = None
+        self.length = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, match):
+        i_a, i_b = match
+        self.count += 1
+        if (self.start_a is not None
+            and (i_a == self.start_a + self.length)
+            and (i_b == self.start_b + self.length)):
+            self.length += 1
+        else:
+            if self.start_a is not None:
+                self.blocks.append((self.start_a, self.start_b, self.length))
+            self.start_a = i_a
+            self.start_b = i_b
+            self.length = 1
 
-    return answer
+    def get_blocks(self):
+        blocks = list(self.blocks)
+        if self.length != 0:
+            blocks.append((self.start_a, self.start_b, self.length))
+        return blocks
 
 
 def _check_consistency(answer):
@@ -188,16 +280,31 @@ def _check_consistency(answer):
 
 
 class PatienceSequenceMatcher(difflib.SequenceMatcher):
-    """Compare a pair of sequences using longest common subset."""
+    """Compare a pair of sequences using longest common subset.
+
+    With a `timeout` (in seconds) or `max_operations`, ranges that are left
+    when the budget is spent are only matched by their common prefix and
+    suffix; `budget.exhausted` tells whether that happened.
+    """
 
     _do_check_consistency = True
 
-    def __init__(self, isjunk=None, a='', b=''):
+    def __init__(self, isjunk=None, a='', b='', timeout=None, max_operations=None):
         if isjunk is not None:
             raise NotImplementedError('Currently we do not support'
                                       ' isjunk for sequence matching')
+        self.timeout = timeout
+        self.max_operations = max_operations
+        self.budget = None
         difflib.SequenceMatcher.__init__(self, isjunk, a, b)
 
+    def _SequenceMatcher__chain_b(self):
+        # difflib indexes every line of b for find_longest_match, which the
+        # patience algorithm never calls; skip building that index
+        self.b2j = {}
+        self.bjunk = set()
+        self.bpopular = set()
+
     def get_matching_blocks(self):
         """Return list of triples describing matching subsequences.
 
@@ -212,20 +319,16 @@ class PatienceSequenceMatcher(difflib.SequenceMatcher):
         >>> s.get_matching_blocks()
         [(0, 0, 2), (3, 2, 2), (5, 4, 0)]
         """
-        # jam 20060525 This is the python 2.4.1 difflib get_matching_blocks
-        # implementation which uses __helper. 2.4.3 got rid of helper for
-        # doing it inline with a queue.
-        # We should consider doing the same for recurse_matches
-
         if self.matching_blocks is not None:
             return self.matching_blocks
 
-        matches = []
-        recurse_matches_py(self.a, self.b, 0, 0,
-                           len(self.a), len(self.b), matches, 10)
-        # Matches now has individual line pairs of
-        # line A matches line B, at the given offsets
-        self.matching_blocks = _collapse_sequences(matches)
+        # compare integer ids instead of hashing the lines again at every level
+        a, b = intern_lines(self.a, self.b)
+        a, b = memoryview(a), memoryview(b)
+        matches = _MatchCollector()
+        self.budget = Budget(self.timeout, self.max_operations)
+        find_matches(a, b, 0, 0, len(a), len(b), matches, self.budget)
+        self.matching_blocks = matches.get_blocks()
         self.matching_blocks.append( (len(self.a), len(self.b), 0) )
         if PatienceSequenceMatcher._do_check_consistency:
             if __debug__:
@@ -0,0 +1,356 @@
+import io
+import os
+import sys
+import time
+import stat
+import secrets
+import getpass
+import tempfile
+import threading
+import contextlib
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import tracing
+from workbook import load_engine
+
+
+IDLE_TIMEOUT = 30 * 60
+MAX_MEMORY = 1024 * 1024 * 1024
+EXIT_RECYCLE = 3
+KEY_SIZE = 32
+# the output of a request is sent to the client in chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+
+# the environment variables of the client that a request runs with; anything
+# else, e.g. credentials, stays with the client
+CLIENT_ENVIRONMENT = frozenset([
+    'PATH', 'HOME', 'USERPROFILE', 'XDG_CONFIG_HOME', 'LANG', 'LC_ALL',
+    'GIT_DIR', 'GIT_WORK_TREE', 'GIT_INDEX_FILE', 'GIT_COMMON_DIR', 'GIT_OBJECT_DIRECTORY',
+    'GIT_ALTERNATE_OBJECT_DIRECTORIES', 'GIT_NAMESPACE', 'GIT_CEILING_DIRECTORIES',
+    'GIT_CONFIG', 'GIT_CONFIG_GLOBAL', 'GIT_CONFIG_SYSTEM', 'GIT_CONFIG_NOSYSTEM', 'GIT_CONFIG_PARAMETERS',
+    'GIT_PAGER_IN_USE',
+])
+CLIENT_ENVIRONMENT_PREFIX = 'GIT_XL_'
+
+
+def get_address():
+    """Return the address of the current user's server (named pipe on Windows, Unix socket elsewhere)."""
+    user = getpass.getuser()
+    if sys.platform == 'win32':
+        return rf'\\.\pipe\git-xl-{user}'
+    return os.path.join(tempfile.gettempdir(), f'git-xl-{user}', 'server.sock')
+
+
+def get_key_path():
+    """Return the path of the key that clients and the server authenticate each other with."""
+    return os.path.join(os.path.expanduser('~'), '.git-xl', 'server.key')
+
+
+def check_private(path):
+    """Raise RuntimeError unless `path` is owned by the current user and only accessible by them.
+
+    Windows relies on the access control lists of the user's profile instead.
+    """
+    if sys.platform == 'win32':
+        return
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f'{path} must be owned by the current user and not accessible by others')
+
+
+def make_private_dir(path):
+    """Create the directory `path` with mode 0700 if needed and check that it is private."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    check_private(path)
+
+
+def read_key(create=False):
+    """Return the authentication key, creating it with `create`.
+
+    Raises OSError if there is no key and RuntimeError if the key or its
+    directory can be accessed by other users.
+    """
+    path = get_key_path()
+    if create and not os.path.exists(path):
+        make_private_dir(os.path.dirname(path))
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(secrets.token_bytes(KEY_SIZE))
+    check_private(os.path.dirname(path))
+    check_private(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def connect():
+    """Return an authenticated connection to the server.
+
+    Raises OSError if no server is running and RuntimeError if the server
+    cannot be trusted. The server has to prove that it knows the key
+    before anything is sent or received.
+    """
+    address = get_address()
+    if not address.startswith('\\\\'):
+        check_private(os.path.dirname(address))
+    try:
+        return Client(address, authkey=read_key())
+    except AuthenticationError as e:
+        raise RuntimeError(f'the server at {address} could not be authenticated: {e}') from None
+
+
+def client_environment(env):
+    """Return the part of a client's environment that is sent with its requests."""
+    return {name: value for name, value in env.items()
+            if name in CLIENT_ENVIRONMENT or name.startswith(CLIENT_ENVIRONMENT_PREFIX)}
+
+
+def get_memory_usage():
+    """Return the peak resident memory of this process in bytes."""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                        ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextlib.contextmanager
+def client_context(cwd, env):
+    """Temporarily run in the client's working directory and with the client's environment variables.
+
+    Only the variables of `CLIENT_ENVIRONMENT` are taken from the client, the
+    rest of the environment is the server's.
+    """
+    saved_cwd = os.getcwd()
+    saved_env = dict(os.environ)
+    os.chdir(cwd)
+    for name in client_environment(saved_env):
+        del os.environ[name]
+    os.environ.update(client_environment(env))
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+
+
+def run(command, args):
+    """Run `diff`, `merge` or `textconv` in this process and return its exit code."""
+    try:
+        with tracing.profile(command), tracing.phase(command, args=args):
+            if command == 'diff':
+                import diff
+                diff.main(args)
+            elif command == 'merge':
+                import merge
+                merge.main(args)
+            elif command == 'textconv':
+                import textconv
+                textconv.main(args)
+            else:
+                raise ValueError(f'unknown command "{command}"')
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code)
+        return 1
+    return 0
+
+
+def forward(command, args):
+    """Run a command on the server, or in this process when no server is running.
+
+    The output of the command is written as the server sends it. Returns the
+    exit code of the command.
+    """
+    try:
+        conn = connect()
+    except OSError:
+        return run(command, args)
+    except RuntimeError as e:
+        print(f'Warning: not using the server: {e}', file=sys.stderr)
+        return run(command, args)
+
+    with conn:
+        conn.send({'command': command, 'args': args, 'cwd': os.getcwd(), 'env': client_environment(os.environ),
+                   'isatty': sys.stdout.isatty(), 'stderr_isatty': sys.stderr.isatty()})
+        # chunks of stdout and stderr, followed by the exit code
+        streams = (('stdout', sys.stdout), ('stderr', sys.stderr))
+        while True:
+            response = conn.recv()
+            if 'exit_code' in response:
+                return response['exit_code']
+            for name, stream in streams:
+                if name in response:
+                    stream.write(response[name])
+                    stream.flush()
+
+
+def stop():
+    """Ask a running server to shut down. Returns False if no server is running."""
+    try:
+        conn = connect()
+    except OSError:
+        return False
+    with conn:
+        conn.send({'command': 'stop'})
+        conn.recv()
+    return True
+
+
+class StreamedOutput(io.TextIOBase):
+    """Stdout or stderr of a request, sent to the client in chunks as it is flushed.
+
+    Reports whether the client's stream is a terminal.
+    """
+
+    def __init__(self, conn, name, isatty=False, chunk_size=CHUNK_SIZE):
+        super().__init__()
+        self.conn = conn
+        self.name = name
+        self._isatty = isatty
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.size = 0
+
+    def isatty(self):
+        return self._isatty
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            text = ''.join(self.buffer)
+            self.buffer = []
+            self.size = 0
+            self.conn.send({self.name: text})
+
+
+def handle(conn, request):
+    """Run a request, sending its output to the client while it runs and its exit code at the end.
+
+    Raises OSError if the client went away; sending to it keeps failing, so
+    this is not hidden by the error handling of the command.
+    """
+    stdout = StreamedOutput(conn, 'stdout', request.get('isatty', False))
+    # stderr is not buffered, like in a process of its own
+    stderr = StreamedOutput(conn, 'stderr', request.get('stderr_isatty', False), chunk_size=0)
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            with client_context(request['cwd'], request['env']):
+                exit_code = run(request['command'], request['args'])
+        except Exception as e:
+            print(f'Error: {e}')
+            exit_code = 1
+        stdout.flush()
+        stderr.flush()
+    conn.send({'exit_code': exit_code})
+
+
+def serve(address=None, idle_timeout=IDLE_TIMEOUT, max_memory=MAX_MEMORY):
+    """Keep the workbook engine loaded and serve diff, merge and textconv requests.
+
+    Requests are handled one at a time. Returns 0 when stopped or after
+    `idle_timeout` seconds without requests, and `EXIT_RECYCLE` once the
+    process used more than `max_memory` bytes, so that a supervisor can start
+    a fresh process.
+    """
+    address = address or get_address()
+    authkey = read_key(create=True)
+    load_engine()
+
+    if not address.startswith('\\\\'):
+        make_private_dir(os.path.dirname(address))
+        # remove the socket of a server that did not shut down cleanly
+        if os.path.exists(address):
+            try:
+                Client(address, authkey=authkey).close()
+            except (OSError, AuthenticationError):
+                os.remove(address)
+            else:
+                raise RuntimeError(f'a server is already listening on {address}')
+
+    listener = Listener(address, authkey=authkey)
+    state = {'last_request': time.time(), 'busy': False}
+
+    def is_idle():
+        return not state['busy'] and time.time() - state['last_request'] > idle_timeout
+
+    def watchdog():
+        # accept() cannot time out, so wake it up with an empty connection
+        while True:
+            time.sleep(min(idle_timeout, 1))
+            if is_idle():
+                try:
+                    Client(address, authkey=authkey).close()
+                except (OSError, AuthenticationError):
+                    pass
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError):
+                # a client that does not know the key; nothing was read from it
+                continue
+            with conn:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    if is_idle():
+                        return 0
+                    continue
+                if request['command'] == 'stop':
+                    conn.send({'exit_code': 0})
+                    return 0
+                state['busy'] = True
+                try:
+                    handle(conn, request)
+                except OSError:
+                    # the client went away, e.g. its pager was closed
+                    pass
+                finally:
+                    state['busy'] = False
+                    state['last_request'] = time.time()
+            if get_memory_usage() > max_memory:
+                return EXIT_RECYCLE
+    finally:
+        listener.close()
@@ -0,0 +1,135 @@
+import heapq
+from collections import namedtuple
+
+from patiencediff import PatienceSequenceMatcher
+
+
+MAX_CELL_CHANGES = 1000
+
+# digest: a key that is equal for two cells exactly when their values (including
+# the type, so that 1 and TRUE differ) and formulas are
+Cell = namedtuple('Cell', ['address', 'row', 'column', 'value', 'formula', 'digest'])
+CellChange = namedtuple('CellChange', ['address', 'row', 'column', 'a', 'b'])
+
+# first item of the digest of cells whose backend only exposes a fingerprint
+FINGERPRINT = 'fingerprint'
+
+
+def make_cell(address, row, column, value, formula=None):
+    return Cell(address, row, column, value, formula, (type(value), value, formula))
+
+
+def make_fingerprint_cell(address, row, column, fingerprint):
+    """Return a Cell without value and formula, compared by the fingerprint of the workbook engine."""
+    return Cell(address, row, column, None, None, (FINGERPRINT, fingerprint))
+
+
+def has_value(cell):
+    return cell.digest[0] != FINGERPRINT
+
+
+def read_cells(worksheet):
+    """Return {address: Cell} for the populated cells of a worksheet.
+
+    Every cell is read across the .NET boundary exactly once. The cells of
+    xltrail-core only expose a fingerprint of their content, not the value
+    and formula; they are compared by the fingerprint and have no value.
+    """
+    cells = {}
+    fingerprints = None
+    for cell in worksheet.cells:
+        if fingerprints is None:
+            fingerprints = not hasattr(cell, 'value')
+        if fingerprints:
+            cells[cell.address] = make_fingerprint_cell(cell.address, cell.row, cell.column, cell.fingerprint)
+        else:
+            cells[cell.address] = make_cell(cell.address, cell.row, cell.column, cell.value,
+                                            getattr(cell, 'formula', None))
+    return cells
+
+
+def diff_cells(cells_a, cells_b, limit=None):
+    """Compare two {address: Cell} dicts.
+
+    Returns `(changes, total)`: the added, removed and changed cells ordered
+    by row and column (at most `limit` of them), and the total number of
+    changes. A change has `a=None` for added and `b=None` for removed cells.
+    Runs in time linear in the number of cells.
+    """
+    changes = []
+    for address, cell_a in cells_a.items():
+        cell_b = cells_b.get(address)
+        if cell_b is None:
+            changes.append(CellChange(address, cell_a.row, cell_a.column, cell_a, None))
+        elif cell_a.digest != cell_b.digest:
+            changes.append(CellChange(address, cell_a.row, cell_a.column, cell_a, cell_b))
+    for address, cell_b in cells_b.items():
+        if address not in cells_a:
+            changes.append(CellChange(address, cell_b.row, cell_b.column, None, cell_b))
+
+    key = lambda change: (change.row, change.column)
+    total = len(changes)
+    if limit is not None and limit < total:
+        return heapq.nsmallest(limit, changes, key=key), total
+    return sorted(changes, key=key), total
+
+
+def group_rows(cells):
+    """Return {row: {column: Cell}} for a {address: Cell} dict."""
+    rows = {}
+    for cell in cells.values():
+        rows.setdefault(cell.row, {})[cell.column] = cell
+    return rows
+
+
+def row_digest(row):
+    """Return a key of the content of a row, independent of its row number.
+
+    Two rows have equal keys exactly when their cells are equal, see `Cell`.
+    """
+    return tuple(sorted((column, cell.digest) for column, cell in row.items()))
+
+
+def diff_rows(cells_a, cells_b, limit=None):
+    """Compare two {address: Cell} dicts row by row.
+
+    Rows are aligned by running the patience diff over the sequences of row
+    keys, so inserting or deleting rows does not show every cell below as
+    changed. Only rows that do not align with an identical row are compared
+    cell by cell. Returns `(changes, total)` like `diff_cells`, with changes in
+    row order; the cells of a change can have different addresses.
+    """
+    rows_a = group_rows(cells_a)
+    rows_b = group_rows(cells_b)
+    keys_a = sorted(rows_a)
+    keys_b = sorted(rows_b)
+    matcher = PatienceSequenceMatcher(None, [row_digest(rows_a[row]) for row in keys_a],
+                                      [row_digest(rows_b[row]) for row in keys_b])
+
+    changes = []
+    total = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # pair up replaced rows in order; the rest are plain insertions/deletions
+        for k in range(max(i2 - i1, j2 - j1)):
+            row_a = rows_a[keys_a[i1 + k]] if i1 + k < i2 else {}
+            row_b = rows_b[keys_b[j1 + k]] if j1 + k < j2 else {}
+            for column in sorted(set(row_a) | set(row_b)):
+                cell_a = row_a.get(column)
+                cell_b = row_b.get(column)
+                if cell_a is not None and cell_b is not None and cell_a.digest == cell_b.digest:
+                    continue
+                total += 1
+                if limit is None or len(changes) < limit:
+                    cell = cell_a or cell_b
+                    changes.append(CellChange(cell.address, cell.row, cell.column, cell_a, cell_b))
+    return changes, total
+
+
+def format_cell(cell):
+    if not has_value(cell):
+        return f'[{cell.digest[1]}]'
+    if cell.formula:
+        return f'{cell.formula} [{cell.value}]'
+    return str(cell.value)
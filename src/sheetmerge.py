@@ -0,0 +1,83 @@
+"""Three-way merge of worksheet cells.
+
+Cells are keyed by address, like `sheetdiff.diff_cells` compares them.
+Sheets that theirs did not change are recognised by their digest and never
+read, so the work is proportional to the sheets that changed.
+"""
+from collections import namedtuple
+
+from sheetdiff import read_cells
+
+
+# edits: {address: Cell of theirs, or None for a removed cell} to apply to ours
+# conflicts: addresses changed differently on both sides, in row and column order
+SheetMerge = namedtuple('SheetMerge', ['name', 'edits', 'conflicts'])
+
+
+def cell_digest(cell):
+    return None if cell is None else cell.digest
+
+
+def merge_cells(cells_x, cells_a, cells_b):
+    """Three-way merge of the {address: Cell} dicts of base, ours and theirs.
+
+    Returns `(edits, conflicts)` as described for `SheetMerge`.
+    """
+    # the cells theirs changed, added or removed
+    changed = [address for address, cell in cells_b.items() if cell_digest(cells_x.get(address)) != cell.digest]
+    changed += [address for address in cells_x if address not in cells_b]
+
+    edits = {}
+    conflicts = []
+    for address in changed:
+        cell_x, cell_a, cell_b = cells_x.get(address), cells_a.get(address), cells_b.get(address)
+        if cell_digest(cell_a) == cell_digest(cell_b):
+            # both made the same change
+            continue
+        if cell_digest(cell_a) == cell_digest(cell_x):
+            edits[address] = cell_b
+        else:
+            cell = cell_a or cell_b
+            conflicts.append((cell.row, cell.column, address))
+    return edits, [address for _, _, address in sorted(conflicts)]
+
+
+def merge_worksheets(sheets_x, sheets_a, sheets_b):
+    """Three-way merge of the worksheets {name: worksheet} of base, ours and theirs.
+
+    Returns `(merges, conflicts)`: a SheetMerge for every sheet of ours that
+    theirs changed differently, and (name, reason) for sheets that theirs
+    added or deleted, which cannot be merged cell by cell. The reason is
+    'added', 'deleted', or 'modify/delete' if the other side changed the
+    sheet.
+    """
+    merges = []
+    conflicts = []
+    for name, sheet_b in sheets_b.items():
+        sheet_x, sheet_a = sheets_x.get(name), sheets_a.get(name)
+        digest_x = sheet_x.digest if sheet_x else None
+        if sheet_b.digest == digest_x:
+            # theirs did not change the sheet
+            continue
+        if sheet_a is None:
+            if sheet_x is not None:
+                conflicts.append((name, 'modify/delete'))
+            else:
+                conflicts.append((name, 'added'))
+            continue
+        if sheet_a.digest == sheet_b.digest:
+            continue
+        cells_x = read_cells(sheet_x) if sheet_x else {}
+        # ours is read only if it changed the sheet as well
+        cells_a = cells_x if sheet_a.digest == digest_x else read_cells(sheet_a)
+        edits, cell_conflicts = merge_cells(cells_x, cells_a, read_cells(sheet_b))
+        merges.append(SheetMerge(name, edits, cell_conflicts))
+
+    for name, sheet_x in sheets_x.items():
+        if name in sheets_b or name not in sheets_a:
+            continue
+        if sheets_a[name].digest == sheet_x.digest:
+            conflicts.append((name, 'deleted'))
+        else:
+            conflicts.append((name, 'modify/delete'))
+    return merges, conflicts
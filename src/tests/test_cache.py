@@ -0,0 +1,57 @@
+import os
+import tempfile
+import subprocess
+from unittest import TestCase
+from cache import ManifestCache, Manifest, Worksheet, VBAModule, file_digest
+
+
+def make_manifest(content='Option Explicit'):
+    return Manifest(
+        worksheets=[Worksheet('Sheet1', 'abc', 3)],
+        vba_modules=[VBAModule('Module1', 'Module', 'def', content)])
+
+
+class TestFileDigest(TestCase):
+
+    def test_matches_git_hash_object(self):
+        path = os.path.join(os.path.dirname(__file__), 'Book1.xlsb')
+        git_hash = subprocess.run(['git', 'hash-object', path], stdout=subprocess.PIPE,
+                                  universal_newlines=True).stdout.strip()
+        self.assertEqual(file_digest(path), git_hash)
+
+
+class TestManifestCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ManifestCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('0' * 40))
+
+    def test_roundtrip(self):
+        manifest = make_manifest()
+        self.cache.put('a' * 40, manifest)
+        self.assertEqual(self.cache.get('a' * 40), manifest)
+
+    def test_prune_evicts_least_recently_used(self):
+        for i, key in enumerate(['a' * 40, 'b' * 40, 'c' * 40]):
+            self.cache.put(key, make_manifest())
+            os.utime(self.cache.entry_path(key), (i, i))
+        # a hit makes the oldest entry the most recently used one
+        self.cache.get('a' * 40)
+        entry_size = os.path.getsize(self.cache.entry_path('a' * 40))
+        self.assertEqual(self.cache.prune(max_size=entry_size), 2)
+        self.assertIsNotNone(self.cache.get('a' * 40))
+        self.assertIsNone(self.cache.get('b' * 40))
+        self.assertIsNone(self.cache.get('c' * 40))
+
+    def test_put_prunes_occasionally(self):
+        cache = ManifestCache(self.tmp_dir.name, max_size=0)
+        cache.put('a' * 40, make_manifest())
+        self.assertEqual(len(cache.entries()), 1)
+        cache.put('0' * 40, make_manifest())
+        self.assertEqual(cache.entries(), [])
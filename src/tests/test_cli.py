@@ -1,5 +1,11 @@
+import os
 import sys
+import time
+import tempfile
+import subprocess
 import cli
+import history
+from cache import VBAModule
 from io import StringIO
 from unittest import TestCase, mock
 
@@ -82,6 +88,21 @@ class TestLocalInstaller(TestCase):
             mock.call().__exit__(None, None, None)
         ])
 
+    @mock.patch('cli.subprocess.run')
+    @mock.patch('cli.is_frozen', return_value=True)
+    @mock.patch('cli.is_git_repository', return_value=True)
+    @mock.patch('cli.os.path.exists', return_value=False)
+    @mock.patch('builtins.open', new_callable=mock.mock_open)
+    def test_can_install_textconv(self, mock_file_open, mock_path_exists, mock_is_git_repository, mock_is_frozen,
+                                  mock_run):
+        installer = cli.Installer(mode='local', path='/path/to/repository')
+        installer.install(textconv=True)
+        mock_run.assert_has_calls([
+            mock.call(['git', 'config', 'diff.xl.command', 'git-xl-diff.exe'], cwd='/path/to/repository', stderr=-1, stdout=-1, universal_newlines=True),
+            mock.call(['git', 'config', 'diff.xl.textconv', 'git-xl.exe textconv'], cwd='/path/to/repository', stderr=-1, stdout=-1, universal_newlines=True),
+            mock.call(['git', 'config', 'diff.xl.cachetextconv', 'true'], cwd='/path/to/repository', stderr=-1, stdout=-1, universal_newlines=True)
+        ])
+
     @mock.patch('cli.subprocess.run')
     @mock.patch('cli.is_git_repository', return_value=True)
     @mock.patch('cli.os.path.exists', return_value=False)
@@ -184,3 +205,218 @@ class CommandParser(TestCase):
         command_parser.execute()
         self.assertTrue(mock_stdout.getvalue())
 
+    @mock.patch('cli.get_cache_dir', return_value='xl-cache')
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_cache_prune_invalid_size(self, mock_stdout, mock_get_cache_dir):
+        for args in (['--max-size'], ['--max-size', '1MB']):
+            mock_stdout.seek(0)
+            mock_stdout.truncate()
+            cli.CommandParser(['cache', 'prune'] + args).execute()
+            self.assertTrue(mock_stdout.getvalue().startswith('Expected a size in bytes for "--max-size"'))
+
+
+LAZY_IMPORT_SCRIPT = """
+import sys
+from unittest import mock
+
+# make any attempt to load the .NET runtime fail
+sys.modules['clr'] = None
+
+import cli
+with mock.patch('cli.Installer'):
+    for args in (['version'], ['help'], ['help', 'install'], ['env'], ['install', '--local'], ['uninstall', '--local']):
+        cli.CommandParser(args).execute()
+
+import workbook
+assert workbook._Workbook is None
+"""
+
+
+class TestLazyEngine(TestCase):
+
+    def test_commands_do_not_load_clr(self):
+        cmd = subprocess.run([sys.executable, '-c', LAZY_IMPORT_SCRIPT],
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(cmd.returncode, 0, cmd.stderr)
+
+
+class TestRunJobs(TestCase):
+
+    def test_timeout_is_per_item(self):
+        # every item finishes within the timeout once it started, however long it was queued
+        results = list(cli.run_jobs(time.sleep, [0.2] * 6, jobs=2, timeout=1))
+        self.assertEqual([error for _, _, error in results], [None] * 6)
+        results = list(cli.run_jobs(time.sleep, [2, 0.1, 0.1], jobs=2, timeout=0.5))
+        self.assertEqual([error for _, _, error in results], ['timed out after 0.5 seconds', None, None])
+
+
+class TestReadAllVbaModules(TestCase):
+
+    def test_errors_are_reported_in_order(self):
+        paths = ['missing2.xlsb', 'missing1.xlsb', 'missing3.xlsb']
+        results = list(cli.read_all_vba_modules(paths, jobs=2, timeout=60))
+        self.assertEqual([path for path, _, _ in results], paths)
+        for path, vba_modules, error in results:
+            self.assertIsNone(vba_modules)
+            self.assertTrue(error)
+
+
+class TestListWorkbooks(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = self.tmp_dir.name
+        os.makedirs(os.path.join(path, 'sub'))
+        for f in ['Book1.xlsb', 'sub/Book2.XLSM', 'notes.txt', 'Untracked.xlsx', 'Ignored.xlsx', '~$Book1.xlsb']:
+            with open(os.path.join(path, f), 'w') as fh:
+                fh.write(f)
+        with open(os.path.join(path, '.gitignore'), 'w') as fh:
+            fh.write('Ignored.xlsx\n')
+        git = lambda *args: subprocess.run(['git'] + list(args), cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        git('init')
+        git('add', '-f', 'Book1.xlsb', 'sub/Book2.XLSM', 'notes.txt', '~$Book1.xlsb')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_tracked(self):
+        self.assertEqual(list(cli.list_workbooks(path=self.tmp_dir.name)), ['Book1.xlsb', 'sub/Book2.XLSM'])
+
+    def test_others(self):
+        self.assertEqual(sorted(cli.list_workbooks(others=True, path=self.tmp_dir.name)),
+                         ['Book1.xlsb', 'Untracked.xlsx', 'sub/Book2.XLSM'])
+
+    def test_pattern(self):
+        self.assertEqual(list(cli.list_workbooks(pattern='*.xlsm', path=self.tmp_dir.name)), [])
+        self.assertEqual(list(cli.list_workbooks(pattern='*.XLSM', path=self.tmp_dir.name)), ['sub/Book2.XLSM'])
+
+    def test_unmerged(self):
+        path = self.tmp_dir.name
+        git = lambda *args: subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test'] + list(args),
+                                           cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        git('commit', '-m', 'base')
+        git('checkout', '-b', 'other')
+        for content, branch in (('theirs', 'other'), ('ours', '-')):
+            if branch == '-':
+                git('checkout', '-')
+            with open(os.path.join(path, 'Book1.xlsb'), 'w') as fh:
+                fh.write(content)
+            git('commit', '-am', content)
+        git('merge', 'other')
+        # Book1.xlsb has three stages in the index
+        self.assertEqual(list(cli.list_workbooks(path=path)), ['Book1.xlsb', 'sub/Book2.XLSM'])
+
+
+class TestDiffRevisions(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = path = self.tmp_dir.name
+        self.git = lambda *args: subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test'] + list(args),
+                                                cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.git('init')
+        for f in ['Book1.xlsb', 'Book2.xlsm', 'notes.txt']:
+            self.write(f, 'old')
+        self.git('add', '.')
+        self.git('commit', '-m', 'first')
+        for f in ['Book1.xlsb', 'notes.txt', 'Book3.xlsx']:
+            self.write(f, 'new')
+        os.remove(os.path.join(path, 'Book2.xlsm'))
+        self.git('add', '-A')
+        self.git('commit', '-m', 'second')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as fh:
+            fh.write(content)
+
+    def test_list_changed_workbooks(self):
+        changes = cli.list_changed_workbooks('HEAD~1', 'HEAD', path=self.path)
+        self.assertEqual([(name, blob_a is None, blob_b is None) for name, blob_a, blob_b in changes],
+                         [('Book1.xlsb', False, False), ('Book2.xlsm', False, True), ('Book3.xlsx', True, False)])
+        self.assertEqual(cli.list_changed_workbooks('HEAD~1', 'HEAD', paths=['Book3.xlsx'], path=self.path),
+                         [changes[2]])
+
+    def test_unknown_revision(self):
+        with self.assertRaises(RuntimeError):
+            cli.list_changed_workbooks('HEAD~5', 'HEAD', path=self.path)
+
+    @mock.patch('diff.diff_workbooks', side_effect=lambda name, a, b, *args, **kwargs:
+                (name, a and open(a).read(), b and open(b).read()))
+    def test_diff_blobs(self, mock_diff_workbooks):
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        self.addCleanup(os.chdir, cwd)
+        changes = cli.list_changed_workbooks('HEAD~1', 'HEAD')
+        self.assertEqual([output for _, output, _ in cli.run_jobs(cli.diff_blobs, changes)],
+                         [('Book1.xlsb', 'old', 'new'), ('Book2.xlsm', 'old', None), ('Book3.xlsx', None, 'new')])
+
+
+class TestHistoryIndex(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = path = self.tmp_dir.name
+        self.git = lambda *args: subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test'] + list(args),
+                                                cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.git('init')
+        self.commit({'Book1.xlsb': 'first', '~$Book1.xlsb': 'lock'})
+        self.commit({'Book1.xlsb': 'second', 'Book2.xlsm': 'other'})
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        self.addCleanup(os.chdir, cwd)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def commit(self, files):
+        for name, content in files.items():
+            with open(os.path.join(self.path, name), 'w') as fh:
+                fh.write(content)
+        self.git('add', '-A')
+        self.git('commit', '-m', 'commit')
+
+    @mock.patch('cli.read_blob_manifest')
+    def test_incremental_update(self, mock_read_blob_manifest):
+        read = []
+
+        def read_blob_manifest(item):
+            read.append(item[1])
+            if item[1] == 'Book2.xlsm':
+                raise RuntimeError('corrupt')
+            return cli.Manifest([], [VBAModule('Module1', 'Module', item[0], '')])
+        mock_read_blob_manifest.side_effect = read_blob_manifest
+
+        index = history.HistoryIndex(':memory:')
+        self.addCleanup(index.close)
+        self.assertEqual(cli.update_history_index(index, ['HEAD']),
+                         (2, 3, [('Book2.xlsm', mock.ANY, 'corrupt')]))
+        self.assertEqual(sorted(read), ['Book1.xlsb', 'Book1.xlsb', 'Book2.xlsm'])
+        self.assertEqual(len(list(index.module_changes('Module1'))), 2)
+
+        # nothing new
+        self.assertEqual(cli.update_history_index(index, ['HEAD']), (0, 0, []))
+        # only the new commit is walked and only its new blob is read
+        self.commit({'Book1.xlsb': 'first', 'Book2.xlsm': 'third'})
+        del read[:]
+        self.assertEqual(cli.update_history_index(index, ['HEAD']), (1, 1, [('Book2.xlsm', mock.ANY, 'corrupt')]))
+        self.assertEqual(read, ['Book2.xlsm'])
+        # only the current tips are kept
+        self.assertEqual(index.tips(), history.resolve_revisions(['HEAD']))
+
+    @mock.patch('cli.read_blob_manifest')
+    def test_pruned_tips(self, mock_read_blob_manifest):
+        mock_read_blob_manifest.return_value = cli.Manifest([], [])
+        index = history.HistoryIndex(':memory:')
+        self.addCleanup(index.close)
+        cli.update_history_index(index, ['HEAD'])
+        # the indexed tip is rewritten and pruned
+        self.git('commit', '--amend', '-m', 'amended')
+        self.git('reflog', 'expire', '--expire=now', '--all')
+        self.git('gc', '--prune=now')
+        self.assertEqual(history.existing_commits(index.tips()), [])
+        self.assertEqual(cli.update_history_index(index, ['HEAD']), (1, 0, []))
+        self.assertEqual(index.tips(), history.resolve_revisions(['HEAD']))
@@ -0,0 +1,149 @@
+import os
+import json
+import tempfile
+import ooxml
+from io import StringIO
+from unittest import TestCase, mock
+from colorama import Fore, Style
+from diff import (LineWriter, diff_workbooks, iter_module_changes, iter_sheet_changes, parse_options,
+                  render_ndjson, render_text, write_diff)
+from sheetdiff import make_cell
+from tests.test_merge import FakeVBAModule
+from tests.test_ooxml import ROWS, write_workbook
+
+
+class TestRenderText(TestCase):
+
+    def test_sheet(self):
+        old = {'A1': make_cell('A1', 1, 1, 1.0), 'A2': make_cell('A2', 2, 1, 'gone')}
+        new = {'A1': make_cell('A1', 1, 1, 2.0), 'A3': make_cell('A3', 3, 1, 6.0, '=A1*3')}
+        records = iter_sheet_changes('Sheet1', old, new, max_changes=2)
+        self.assertEqual(list(render_text('Book1.xlsb', records, color=False)), [
+            'diff --xl a/Book1.xlsb b/Book1.xlsb',
+            '--- a/Book1.xlsb/Worksheets/Sheet1',
+            '+++ b/Book1.xlsb/Worksheets/Sheet1',
+            '@@ -2 cells +2 cells @@',
+            '-A1: 1.0',
+            '+A1: 2.0',
+            '-A2: gone',
+            '... 1 more changed cell',
+            ''
+        ])
+
+    def test_vba(self):
+        old = FakeVBAModule('Module1', 'Module', 'abc', 'Option Explicit\nSub A()\nEnd Sub')
+        new = FakeVBAModule('Module1', 'Module', 'def', 'Option Explicit\nSub B()\nEnd Sub')
+        records = iter_module_changes(old, new, numlines=1)
+        lines = list(render_text('Book1.xlsb', records))
+        self.assertEqual(lines[3:], [
+            Fore.CYAN + '@@ -1,3 +1,3 @@' + Style.RESET_ALL,
+            ' Option Explicit',
+            Fore.RED + '-Sub A()' + Style.RESET_ALL,
+            Fore.GREEN + '+Sub B()' + Style.RESET_ALL,
+            ' End Sub',
+            ''
+        ])
+
+
+class TestRenderNdjson(TestCase):
+
+    def test_cells(self):
+        old = {'A1': make_cell('A1', 1, 1, 1.0)}
+        new = {'A1': make_cell('A1', 1, 1, 2.0, '=1+1')}
+        records = [json.loads(line) for line in
+                   render_ndjson('Book1.xlsb', iter_sheet_changes('Sheet1', old, new, max_changes=10))]
+        self.assertEqual(records[1], {
+            'object': 'cell', 'workbook': 'Book1.xlsb', 'sheet': 'Sheet1', 'change': 'modified',
+            'old': {'address': 'A1', 'value': 1.0, 'formula': None},
+            'new': {'address': 'A1', 'value': 2.0, 'formula': '=1+1'}})
+
+
+class TestLineWriter(TestCase):
+
+    def test_buffer(self):
+        stream = StringIO()
+        writer = LineWriter(stream, buffer_size=4)
+        writer.write('a')
+        self.assertEqual(stream.getvalue(), '')
+        writer.write('b')
+        self.assertEqual(stream.getvalue(), 'a\nb\n')
+        writer.write('c')
+        writer.flush()
+        self.assertEqual(stream.getvalue(), 'a\nb\nc\n')
+        self.assertEqual(writer.lines, 3)
+
+
+class TestParseOptions(TestCase):
+
+    def test_options(self):
+        options = {'color': 'auto', 'max_lines': None, 'output_format': 'text', 'diff_algorithm': 'myers'}
+        args = parse_options(['--color', '--max-lines', '10', '--format=ndjson', '--diff-algorithm', 'Histogram',
+                              'Book1.xlsb'], options)
+        self.assertEqual(args, ['Book1.xlsb'])
+        self.assertEqual(options, {'color': 'always', 'max_lines': 10, 'output_format': 'ndjson',
+                                   'diff_algorithm': 'histogram'})
+        with self.assertRaises(ValueError):
+            parse_options(['--format=xml'], options)
+        with self.assertRaises(ValueError):
+            parse_options(['--diff-algorithm=minimal'], options)
+
+
+class TestDiffWorkbooks(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, rows):
+        path = os.path.join(self.tmp_dir.name, name)
+        write_workbook(path, rows)
+        return path
+
+    def test_unchanged_parts(self):
+        old = self.write('old.xlsx', ROWS)
+        new = self.write('new.xlsx', ROWS.replace('<v>1.5</v>', '<v>2.5</v>'))
+        unchanged = ooxml.unchanged_parts(old, new)
+        self.assertIn('xl/worksheets/sheet2.xml', unchanged)
+        self.assertIn('xl/sharedStrings.xml', unchanged)
+        self.assertNotIn('xl/worksheets/sheet1.xml', unchanged)
+        self.assertIsNone(ooxml.unchanged_parts(old, None))
+
+    def test_unchanged_sheets_are_not_parsed(self):
+        old = self.write('old.xlsx', ROWS)
+        new = self.write('new.xlsx', ROWS.replace('<v>1.5</v>', '<v>2.5</v>'))
+        with mock.patch('ooxml.Worksheet.iter_records', autospec=True,
+                        side_effect=ooxml.Worksheet.iter_records) as mock_iter_records:
+            output = diff_workbooks('Book1.xlsx', old, new)
+        self.assertEqual(set(call[0][0].name for call in mock_iter_records.call_args_list), {'Data'})
+        self.assertIn(Fore.RED + '-B1: 1.5', output)
+        self.assertIn(Fore.GREEN + '+B1: 2.5', output)
+        self.assertNotIn('Empty', output)
+
+    def test_max_lines(self):
+        old = self.write('old.xlsx', ROWS)
+        new = self.write('new.xlsx', ROWS.replace('<v>1.5</v>', '<v>2.5</v>'))
+        stream = StringIO()
+        write_diff(stream, 'Book1.xlsx', old, new, color=False, max_lines=3)
+        self.assertEqual(stream.getvalue().split('\n'), [
+            'diff --xl a/Book1.xlsx b/Book1.xlsx',
+            '--- a/Book1.xlsx/Worksheets/Data',
+            '+++ b/Book1.xlsx/Worksheets/Data',
+            '... more lines left out (--max-lines 3)',
+            ''
+        ])
+
+    def test_max_lines_stops_the_diff(self):
+        produced = []
+
+        def iter_changes(*args, **kwargs):
+            for i in range(100):
+                produced.append(i)
+                yield {'object': 'worksheet', 'change': 'added', 'name': f'Sheet{i}', 'cells': 1}
+
+        stream = StringIO()
+        with mock.patch('diff.iter_changes', side_effect=iter_changes):
+            write_diff(stream, 'Book1.xlsx', None, None, output_format='ndjson', max_lines=3)
+        self.assertEqual(len(produced), 4)
+        self.assertEqual(json.loads(stream.getvalue().split('\n')[3]), {'object': 'truncated', 'workbook': 'Book1.xlsx'})
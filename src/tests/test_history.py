@@ -0,0 +1,158 @@
+import os
+import tempfile
+import subprocess
+from unittest import TestCase
+
+import history
+from cache import Manifest, Worksheet, VBAModule
+
+
+def is_workbook(name):
+    return name.endswith('.xlsb')
+
+
+class TestIterCommitChanges(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = path = self.tmp_dir.name
+        self.git = lambda *args: subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test'] + list(args),
+                                                cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                universal_newlines=True).stdout.strip()
+        self.git('init')
+        self.commit('first', {'Book1.xlsb': 'old', 'notes.txt': 'old'})
+        self.git('checkout', '-b', 'dev')
+        self.commit('dev', {'Book2.xlsb': 'dev'})
+        self.git('checkout', '-')
+        self.commit('second', {'Book1.xlsb': 'new', 'notes.txt': 'new'})
+        self.git('merge', '--no-edit', 'dev')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def commit(self, message, files):
+        for name, content in files.items():
+            with open(os.path.join(self.path, name), 'w') as fh:
+                fh.write(content)
+        self.git('add', '-A')
+        self.git('commit', '-m', message)
+
+    def changes(self, revisions, exclude=()):
+        return [(self.git('log', '-1', '--format=%s', commit), name, blob_a is None, blob_b is None)
+                for commit, _, name, blob_a, blob_b
+                in history.iter_commit_changes(revisions, exclude, is_workbook=is_workbook, path=self.path)]
+
+    def test_changes(self):
+        # the merge is compared with its first parent only
+        self.assertEqual(sorted(self.changes(['HEAD'])), [
+            ("Merge branch 'dev'", 'Book2.xlsb', True, False),
+            ('dev', 'Book2.xlsb', True, False),
+            ('first', 'Book1.xlsb', True, False),
+            ('second', 'Book1.xlsb', False, False),
+        ])
+
+    def test_exclude(self):
+        self.assertEqual(self.changes(['HEAD'], exclude=['HEAD^1']), [
+            ("Merge branch 'dev'", 'Book2.xlsb', True, False),
+            ('dev', 'Book2.xlsb', True, False),
+        ])
+        self.assertEqual(self.changes(['HEAD'], exclude=['HEAD']), [])
+
+    def test_merge_without_changes(self):
+        # a merge that keeps the first parent changes nothing, whatever the other parent did
+        self.git('checkout', '-b', 'other', 'HEAD^1')
+        self.commit('other', {'Book3.xlsb': 'other'})
+        self.git('checkout', '-')
+        self.git('merge', '--no-edit', '-s', 'ours', '-m', 'ours', 'other')
+        self.assertEqual(self.changes(['HEAD'], exclude=['HEAD^1']), [('other', 'Book3.xlsb', True, False)])
+
+    def test_many_excludes(self):
+        commits = self.git('rev-list', 'HEAD').split()
+        self.assertEqual(self.changes(['HEAD'], exclude=commits[1:] * 2000), [
+            ("Merge branch 'dev'", 'Book2.xlsb', True, False),
+        ])
+
+    def test_unknown_revision(self):
+        with self.assertRaises(RuntimeError):
+            list(history.iter_commit_changes(['nope'], path=self.path))
+        with self.assertRaises(RuntimeError):
+            history.resolve_revisions(['nope'], path=self.path)
+
+    def test_existing_commits(self):
+        head = self.git('rev-parse', 'HEAD')
+        self.assertEqual(history.existing_commits([head, '0' * 40], path=self.path), [head])
+        self.assertEqual(history.existing_commits([], path=self.path), [])
+
+    def test_resolve_revisions(self):
+        self.assertEqual(history.resolve_revisions(['HEAD', 'dev'], path=self.path),
+                         [self.git('rev-parse', 'HEAD'), self.git('rev-parse', 'dev')])
+
+
+def manifest(sheets=(), modules=()):
+    return Manifest([Worksheet(name, digest, 1) for name, digest in sheets],
+                    [VBAModule(name, 'Module', digest, '') for name, digest in modules])
+
+
+class TestHistoryIndex(TestCase):
+
+    def setUp(self):
+        self.index = history.HistoryIndex(':memory:')
+        self.addCleanup(self.index.close)
+
+    def test_changes(self):
+        self.assertEqual(self.index.add_changes([
+            ('c1', 1, 'Book1.xlsb', None, 'b1'),
+            ('c2', 2, 'Book1.xlsb', 'b1', 'b2'),
+            ('c3', 3, 'Book1.xlsb', 'b2', 'b3'),
+            ('c3', 3, 'Book2.xlsb', None, 'b1'),
+            ('c4', 4, 'Book1.xlsb', 'b3', None),
+        ]), 4)
+        # a commit indexed again is not added twice
+        self.assertEqual(self.index.add_changes([('c1', 1, 'Book1.xlsb', None, 'b1')]), 0)
+        self.assertEqual(self.index.missing_blobs(), [('b1', 'Book1.xlsb'), ('b2', 'Book1.xlsb'), ('b3', 'Book1.xlsb')])
+
+        self.index.add_manifest('b1', manifest(sheets=[('Data', 'x')], modules=[('modPricing', 'x')]))
+        self.index.add_manifest('b2', manifest(sheets=[('Data', 'x')], modules=[('modPricing', 'y')]))
+        self.index.add_manifest('b3', manifest(sheets=[('Data', 'z')]))
+        self.assertEqual(self.index.missing_blobs(), [])
+
+        self.assertEqual(list(self.index.module_changes('modPricing')), [
+            ('c3', 'Book1.xlsb', 'Module', 'deleted'),
+            ('c3', 'Book2.xlsb', 'Module', 'added'),
+            ('c2', 'Book1.xlsb', 'Module', 'modified'),
+            ('c1', 'Book1.xlsb', 'Module', 'added'),
+        ])
+        self.assertEqual(list(self.index.sheet_changes('Data')), [
+            ('c4', 'Book1.xlsb', 'deleted'),
+            ('c3', 'Book1.xlsb', 'modified'),
+            ('c3', 'Book2.xlsb', 'added'),
+            ('c1', 'Book1.xlsb', 'added'),
+        ])
+        self.assertEqual(list(self.index.module_changes('Module1')), [])
+
+    def test_errors(self):
+        self.index.add_changes([('c1', 1, 'Book1.xlsb', None, 'b1'), ('c2', 2, 'Book1.xlsb', 'b1', 'b2')])
+        self.index.add_manifest('b1', manifest(modules=[('modPricing', 'x')]))
+        self.index.add_manifest('b2', error='corrupt')
+        self.assertEqual(self.index.missing_blobs(), [])
+        # changes to blobs that could not be read are unknown
+        self.assertEqual(list(self.index.module_changes('modPricing')), [('c1', 'Book1.xlsb', 'Module', 'added')])
+
+    def test_tips(self):
+        self.assertEqual(self.index.tips(), [])
+        self.index.set_tips(['c1', 'c2'])
+        self.assertEqual(sorted(self.index.tips()), ['c1', 'c2'])
+        # tips are replaced, not collected
+        self.index.set_tips(['c3'])
+        self.assertEqual(self.index.tips(), ['c3'])
+
+    def test_rebuild_old_version(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, history.INDEX_FILE)
+            index = history.HistoryIndex(path)
+            index.set_tips(['c1'])
+            index.db.execute('PRAGMA user_version = 0')
+            index.close()
+            index = history.HistoryIndex(path)
+            self.assertEqual(index.tips(), [])
+            index.close()
\ No newline at end of file
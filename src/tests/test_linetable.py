@@ -0,0 +1,59 @@
+from array import array
+from unittest import TestCase, mock
+import linetable
+from linetable import LineTable, intern_tables
+
+
+class TestLineTable(TestCase):
+
+    def test_lines(self):
+        for text in ['', '\n', 'Option Explicit', 'Option Explicit\n', '\n\nSub a()\nEnd Sub']:
+            table = LineTable(text)
+            self.assertEqual(list(table), text.split('\n'))
+            self.assertEqual(len(table), len(text.split('\n')))
+        self.assertEqual(len(LineTable()), 0)
+
+    def test_chunks(self):
+        text = '\n'.join(f'x = {i}' for i in range(100))
+        with mock.patch.object(linetable, 'CHUNK_SIZE', 7):
+            table = LineTable(text)
+        self.assertEqual(list(table), text.split('\n'))
+        self.assertEqual(list(table.hashes), [hash(line) for line in text.split('\n')])
+
+    def test_indexing(self):
+        table = LineTable('Sub a()\n    x = 1\nEnd Sub')
+        self.assertEqual(table[0], 'Sub a()')
+        self.assertEqual(table[-1], 'End Sub')
+        self.assertEqual(table[1:], ['    x = 1', 'End Sub'])
+        with self.assertRaises(IndexError):
+            table[3]
+
+    def test_join(self):
+        table = LineTable('Sub a()\n    x = 1\nEnd Sub\n')
+        self.assertEqual(table.join(1, 3), '    x = 1\nEnd Sub')
+        self.assertEqual(table.join(2, 4), 'End Sub\n')
+        self.assertEqual(table.join(2, 2), '')
+
+    def test_range_equals(self):
+        a = LineTable('Sub a()\nEnd Sub\nSub b()\nEnd Sub')
+        b = LineTable('Sub b()\nEnd Sub')
+        self.assertTrue(a.range_equals(2, 4, b, 0, 2))
+        self.assertFalse(a.range_equals(0, 2, b, 0, 2))
+        self.assertFalse(a.range_equals(2, 4, b, 0, 1))
+
+
+class TestInternTables(TestCase):
+
+    def test_ids(self):
+        a_ids, b_ids = intern_tables(LineTable('a\nb\na'), LineTable('b\nc'))
+        self.assertEqual(list(a_ids), [0, 1, 0])
+        self.assertEqual(list(b_ids), [1, 2])
+
+    def test_hash_collisions(self):
+        a, b = LineTable('a\nb\na\nc'), LineTable('b\nc\na')
+        for table in (a, b):
+            table.hashes = array('q', [7] * len(table))
+        with mock.patch.object(linetable, 'EXACT_HASHES', False):
+            a_ids, b_ids = intern_tables(a, b)
+        self.assertEqual(list(a_ids), [0, 1, 0, 2])
+        self.assertEqual(list(b_ids), [1, 2, 0])
@@ -0,0 +1,103 @@
+import random
+from unittest import TestCase
+from linetable import LineTable
+from matchers import MyersSequenceMatcher, HistogramSequenceMatcher, get_sequence_matcher
+from patiencediff import PatienceSequenceMatcher
+
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+class MatcherTests:
+
+    matcher = None
+
+    def assertValidBlocks(self, a, b, blocks):
+        next_i = next_j = 0
+        for i, j, n in blocks:
+            self.assertGreaterEqual(i, next_i)
+            self.assertGreaterEqual(j, next_j)
+            self.assertEqual(a[i:i + n], b[j:j + n])
+            next_i, next_j = i + n, j + n
+        self.assertEqual(blocks[-1], (len(a), len(b), 0))
+
+    def test_matching_blocks(self):
+        s = self.matcher(None, 'abxcd', 'abcd')
+        self.assertEqual(s.get_matching_blocks(), [(0, 0, 2), (3, 2, 2), (5, 4, 0)])
+
+    def test_empty(self):
+        self.assertEqual(self.matcher(None, [], []).get_matching_blocks(), [(0, 0, 0)])
+        self.assertEqual(self.matcher(None, ['a'], []).get_matching_blocks(), [(1, 0, 0)])
+        self.assertEqual(self.matcher(None, [], ['a']).get_opcodes(), [('insert', 0, 0, 0, 1)])
+
+    def test_identical(self):
+        a = ['End Sub'] * 100
+        self.assertEqual(self.matcher(None, a, a).get_matching_blocks(), [(0, 0, 100), (100, 100, 0)])
+
+    def test_line_tables(self):
+        a = ['Option Explicit', 'Sub a()', 'End Sub', '', 'Sub b()', 'End Sub']
+        b = ['Option Explicit', 'Sub b()', '    x = 1', 'End Sub', '']
+        self.assertEqual(self.matcher(None, LineTable('\n'.join(a)), LineTable('\n'.join(b))).get_opcodes(),
+                         self.matcher(None, a, b).get_opcodes())
+
+    def test_random(self):
+        rnd = random.Random(0)
+        for _ in range(500):
+            a = [rnd.randrange(4) for _ in range(rnd.randrange(20))]
+            b = [rnd.randrange(4) for _ in range(rnd.randrange(20))]
+            self.assertValidBlocks(a, b, self.matcher(None, a, b).get_matching_blocks())
+
+    def test_budget(self):
+        a = ['Option Explicit', 'a', 'b', 'c', 'End Sub']
+        b = ['Option Explicit', 'c', 'b', 'a', 'End Sub']
+        s = self.matcher(None, a, b, max_operations=0)
+        self.assertEqual(s.get_opcodes(), [('equal', 0, 1, 0, 1), ('replace', 1, 4, 1, 4), ('equal', 4, 5, 4, 5)])
+        self.assertTrue(s.budget.exhausted)
+
+    def test_deep(self):
+        # many small, interleaved changes do not run into the recursion limit
+        a = [f'x = {i}' if i % 2 else 'End Sub' for i in range(5000)]
+        b = [f'y = {i}' if i % 3 else line for i, line in enumerate(a)]
+        self.assertValidBlocks(a, b, self.matcher(None, a, b).get_matching_blocks())
+
+
+class TestMyersSequenceMatcher(MatcherTests, TestCase):
+
+    matcher = MyersSequenceMatcher
+
+    def test_longest_common_subsequence(self):
+        rnd = random.Random(1)
+        for _ in range(500):
+            a = [rnd.randrange(5) for _ in range(rnd.randrange(20))]
+            b = [rnd.randrange(5) for _ in range(rnd.randrange(20))]
+            blocks = self.matcher(None, a, b).get_matching_blocks()
+            self.assertEqual(sum(n for _, _, n in blocks), lcs_length(a, b))
+
+
+class TestHistogramSequenceMatcher(MatcherTests, TestCase):
+
+    matcher = HistogramSequenceMatcher
+
+    def test_anchors_on_rare_lines(self):
+        # a procedure inserted before another one is shown as a whole, like git diff --histogram
+        a = ['Sub a()', '    x = 1', 'End Sub']
+        b = ['Sub b()', '    x = 2', 'End Sub', 'Sub a()', '    x = 1', 'End Sub']
+        s = self.matcher(None, a, b)
+        self.assertEqual(s.get_opcodes(), [('insert', 0, 0, 0, 3), ('equal', 0, 3, 3, 6)])
+
+
+class TestGetSequenceMatcher(TestCase):
+
+    def test_algorithms(self):
+        self.assertIs(get_sequence_matcher('myers'), MyersSequenceMatcher)
+        self.assertIs(get_sequence_matcher('Histogram'), HistogramSequenceMatcher)
+        self.assertIs(get_sequence_matcher('patience'), PatienceSequenceMatcher)
+        with self.assertRaises(ValueError):
+            get_sequence_matcher('minimal')
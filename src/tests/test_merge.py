@@ -1,5 +1,19 @@
-from unittest import TestCase
-from merge import Merge3, merge3_lists
+import os
+import zipfile
+import tempfile
+from io import StringIO
+from unittest import TestCase, mock
+import merge
+from linetable import LineTable
+from merge import Merge3, merge3_lists, merge_files, merge_sheets, snapshot_vba_modules, vba_project_digest
+from matchers import HistogramSequenceMatcher
+from patiencediff import PatienceSequenceMatcher
+from tests.test_ooxml import WORKBOOK, write_workbook
+import ooxml
+
+
+def ooxml_workbook(extra=''):
+    return WORKBOOK.replace('</workbook>', extra + '</workbook>')
 
 
 class TestThreeWayListMerge(TestCase):
@@ -36,3 +50,301 @@ class TestThreeWayMerge(TestCase):
             ['Option Explicit', '<<<<<<< ours\n', "'test1", 'Sub test()', '=======\n', 'Function test()', '>>>>>>> theirs\n', '    Debug.Print "hello1"', '    test = "test"', 'End Function'],
             [x for x in m3.merge_lines(name_a='ours', name_b='theirs')]
         )
+
+    def test_merge_text(self):
+        a = ['Option Explicit', "'test1", 'Sub test()', '    Debug.Print "hello1"', 'End Sub']
+        b = ['Option Explicit', 'Function test()', '    Debug.Print "hello1"', '    test = "test"', 'End Function']
+        x = ['Option Explicit', 'Sub test()', '    Debug.Print "hello1"', 'End Sub']
+        expected = '\n'.join(Merge3(a=a, b=b, base=x).merge_lines(name_a='ours', name_b='theirs'))
+        for lines in (a, b, x), [LineTable('\n'.join(lines)) for lines in (a, b, x)]:
+            m3 = Merge3(a=lines[0], b=lines[1], base=lines[2])
+            self.assertEqual(m3.merge_text(name_a='ours', name_b='theirs'), expected)
+
+    def test_regions_are_computed_once(self):
+        a = ['Option Explicit', 'Sub a()', 'End Sub']
+        b = ['Option Explicit', 'Sub b()', 'End Sub']
+        x = ['Option Explicit', 'End Sub']
+        matcher = mock.Mock(wraps=PatienceSequenceMatcher)
+        m3 = Merge3(a=a, b=b, base=x, sequencematcher=matcher)
+        self.assertEqual(m3.is_conflicted(), 1)
+        list(m3.merge_lines())
+        list(m3.merge_groups())
+        list(m3.merge_annotated())
+        m3.find_unconflicted()
+        self.assertEqual(matcher.call_count, 2)
+        self.assertEqual(m3.merge_result().conflicts, 1)
+
+    def test_find_unconflicted(self):
+        x = ['a', 'b', 'c', 'd', 'e']
+        a = ['a', 'B', 'c', 'd', 'e']
+        b = ['a', 'b', 'c', 'D', 'e']
+        m3 = Merge3(a=a, b=b, base=x)
+        self.assertEqual(m3.find_unconflicted(), [(0, 1), (2, 3), (4, 5)])
+        self.assertFalse(m3.is_conflicted())
+        self.assertEqual(list(m3.merge_lines()), ['a', 'B', 'c', 'D', 'e'])
+
+    def test_sequencematcher(self):
+        x = ['Sub a()', 'End Sub']
+        a = ['Sub a()', '    x = 1', 'End Sub']
+        b = ['Sub b()', 'End Sub', 'Sub a()', 'End Sub']
+        for matcher in (PatienceSequenceMatcher, HistogramSequenceMatcher):
+            m3 = Merge3(a=a, b=b, base=x, sequencematcher=matcher)
+            self.assertEqual(list(m3.merge_lines()), ['Sub b()', 'End Sub', 'Sub a()', '    x = 1', 'End Sub'])
+
+    def test_budget(self):
+        x = ['Sub a()', '    x = 1', 'End Sub', '    y = 1', 'End Sub', '    z = 1', 'End Sub']
+        a = ['Sub a()', '    x = 2', 'End Sub', '    y = 1', 'End Sub', '    z = 2', 'End Sub']
+        b = ['Sub a()', '    x = 1', 'End Sub', '    y = 2', 'End Sub', '    z = 1', 'End Sub']
+        self.assertEqual(Merge3(a=a, b=b, base=x).is_conflicted(), 0)
+        # once the budget is spent, ours is a single change around theirs, but the merge still finishes
+        m3 = Merge3(a=a, b=b, base=x, max_operations=0)
+        self.assertEqual(m3.is_conflicted(), 1)
+
+
+class TestMain(TestCase):
+
+    @mock.patch('merge.merge_workbook')
+    def test_diff_algorithm(self, mock_merge_workbook):
+        merge.main(['Book1.xlsb', 'x', 'a', 'b', '--diff-algorithm=histogram'])
+        mock_merge_workbook.assert_called_once_with('Book1.xlsb', 'x', 'a', 'b', diff_algorithm='histogram')
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    @mock.patch('merge.merge_workbook')
+    def test_unknown_diff_algorithm(self, mock_merge_workbook, mock_stdout):
+        with self.assertRaises(SystemExit) as e:
+            merge.main(['Book1.xlsb', 'x', 'a', 'b', '--diff-algorithm', 'minimal'])
+        self.assertEqual(e.exception.code, 1)
+        self.assertEqual(mock_stdout.getvalue(), 'Error: unknown diff algorithm "minimal"\n')
+        mock_merge_workbook.assert_not_called()
+
+
+class FakeVBAModule:
+
+    def __init__(self, name, type, digest, content):
+        self.name = name
+        self.type = type
+        self.digest = digest
+        self._content = content
+        self.content_reads = 0
+
+    @property
+    def content(self):
+        self.content_reads += 1
+        return self._content
+
+
+class TestVBAModuleSnapshot(TestCase):
+
+    def test_snapshot(self):
+        module1 = FakeVBAModule('Module1', 'Module', 'abc', 'Option Explicit')
+        module2 = FakeVBAModule('Class1', 'Class', 'def', '')
+        modules = snapshot_vba_modules([module1, module2])
+        self.assertEqual(sorted(modules), ['Class1', 'Module1'])
+        self.assertEqual((modules['Module1'].type, modules['Module1'].digest), ('Module', 'abc'))
+        self.assertEqual(module1.content_reads, 0)
+        self.assertEqual(modules['Module1'].content, 'Option Explicit')
+        self.assertEqual(modules['Module1'].content, 'Option Explicit')
+        self.assertEqual(module1.content_reads, 1)
+
+
+class TestMergeFiles(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_ours_unchanged_takes_theirs(self):
+        x, a, b = self.write('x', b'base'), self.write('a', b'base'), self.write('b', b'theirs')
+        self.assertTrue(merge_files(x, a, b))
+        self.assertEqual(self.read(a), b'theirs')
+
+    def test_theirs_unchanged_keeps_ours(self):
+        x, a, b = self.write('x', b'base'), self.write('a', b'ours'), self.write('b', b'base')
+        self.assertTrue(merge_files(x, a, b))
+        self.assertEqual(self.read(a), b'ours')
+
+    def test_both_changed(self):
+        x, a, b = self.write('x', b'base'), self.write('a', b'ours'), self.write('b', b'theirs')
+        self.assertFalse(merge_files(x, a, b))
+        self.assertEqual(self.read(a), b'ours')
+
+
+class TestMergeSheets(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, values):
+        path = os.path.join(self.tmp_dir.name, name)
+        rows = ''.join(f'<row r="{row}"><c r="A{row}"><v>{value}</v></c></row>' for row, value in enumerate(values, 1))
+        write_workbook(path, rows)
+        return path
+
+    def values(self, path):
+        wb = ooxml.Workbook(path)
+        values = [c.value for c in wb.worksheets[0].cells]
+        wb.close()
+        return values
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_disjoint_edits(self, mock_stdout):
+        x = self.write('x.xlsx', [1, 2, 3])
+        a = self.write('a.xlsx', [10, 2, 3])
+        b = self.write('b.xlsx', [1, 2, 30])
+        self.assertFalse(merge_sheets('Book1.xlsx', x, a, b))
+        self.assertEqual(self.values(a), [10.0, 2.0, 30.0])
+        self.assertEqual(mock_stdout.getvalue(), '--- a/Book1.xlsx/Worksheets/Data +++ b/Book1.xlsx/Worksheets/Data\n')
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_conflict(self, mock_stdout):
+        x = self.write('x.xlsx', [1, 2, 3])
+        a = self.write('a.xlsx', [10, 2, 3])
+        b = self.write('b.xlsx', [20, 2, 30])
+        self.assertTrue(merge_sheets('Book1.xlsx', x, a, b))
+        # the other changes of theirs are merged all the same
+        self.assertEqual(self.values(a), [10.0, 2.0, 30.0])
+        self.assertEqual(mock_stdout.getvalue(), 'CONFLICT (cells): Merge conflict in Book1.xlsx/Worksheets/Data: A1\n')
+
+
+class TestMergeWorkbook(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @mock.patch('merge.load_workbook')
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_parts_are_merged_without_opening_workbooks(self, mock_stdout, mock_load_workbook):
+        x, a, b = [os.path.join(self.tmp_dir.name, name) for name in ('x', 'a', 'b')]
+        write_workbook(x, '<row r="1"><c r="A1"><v>1</v></c></row>')
+        write_workbook(a, '<row r="1"><c r="A1"><v>2</v></c></row>')
+        write_workbook(b, '<row r="1"><c r="A1"><v>1</v></c></row>', strings=('hello', 'world', 'again'))
+        with self.assertRaises(SystemExit) as cm:
+            merge.merge_workbook('Book1.xlsx', x, a, b)
+        self.assertEqual(cm.exception.code, 0)
+        mock_load_workbook.assert_not_called()
+        self.assertEqual(mock_stdout.getvalue(), '--- a/Book1.xlsx/xl/sharedStrings.xml +++ b/Book1.xlsx/xl/sharedStrings.xml\n')
+        wb = ooxml.Workbook(a)
+        self.assertEqual(wb.shared_strings, ['hello', 'world', 'again'])
+        self.assertEqual([c.value for c in wb.worksheets[0].cells], [2.0])
+        wb.close()
+
+
+    def write(self, name, rows, parts=None):
+        path = os.path.join(self.tmp_dir.name, name)
+        write_workbook(path, rows)
+        with zipfile.ZipFile(path) as z:
+            members = dict((name, z.read(name)) for name in z.namelist())
+        members.update(parts or {})
+        with zipfile.ZipFile(path, 'w') as z:
+            for part, content in members.items():
+                z.writestr(part, content)
+        return path
+
+    def merge(self, x, a, b):
+        with self.assertRaises(SystemExit) as cm, mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            merge.merge_workbook('Book1.xlsx', x, a, b)
+        return cm.exception.code, mock_stdout.getvalue()
+
+    def test_cells_are_compared_by_type(self):
+        # hash(1.0) == hash(True), but theirs changed A1 from 1 to TRUE
+        x = self.write('x', '<row r="1"><c r="A1"><v>1</v></c></row>')
+        a = self.write('a', '<row r="1"><c r="A1"><v>1</v></c><c r="B1"><v>2</v></c></row>')
+        b = self.write('b', '<row r="1"><c r="A1" t="b"><v>1</v></c></row>')
+        exit_code, output = self.merge(x, a, b)
+        self.assertEqual(exit_code, 0, output)
+        wb = ooxml.Workbook(a)
+        self.assertEqual([(c.address, c.value) for c in wb.worksheets[0].cells], [('A1', True), ('B1', 2.0)])
+        wb.close()
+
+    def test_cell_style_changes_are_conflicts(self):
+        x = self.write('x', '<row r="1"><c r="A1"><v>1</v></c></row>')
+        a = self.write('a', '<row r="1"><c r="A1"><v>1</v></c><c r="B1"><v>2</v></c></row>')
+        b = self.write('b', '<row r="1"><c r="A1" s="3"><v>1</v></c></row>')
+        exit_code, output = self.merge(x, a, b)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(output, 'CONFLICT (part): Book1.xlsx/xl/worksheets/sheet1.xml changed in theirs, '
+                                 'please merge manually\n')
+
+    def test_other_part_changes_are_conflicts(self):
+        x = self.write('x', '<row r="1"><c r="A1"><v>1</v></c></row>', {'xl/styles.xml': '<styleSheet/>'})
+        a = self.write('a', '<row r="1"><c r="A1"><v>2</v></c></row>', {'xl/styles.xml': '<styleSheet/>'})
+        b = self.write('b', '<row r="1"><c r="A1"><v>1</v></c><c r="B1"><v>3</v></c></row>',
+                       {'xl/styles.xml': '<styleSheet><fonts/></styleSheet>'})
+        exit_code, output = self.merge(x, a, b)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(output.splitlines(), [
+            '--- a/Book1.xlsx/Worksheets/Data +++ b/Book1.xlsx/Worksheets/Data',
+            'CONFLICT (part): Book1.xlsx/xl/styles.xml changed in theirs, please merge manually',
+        ])
+
+    def test_part_merge_fallbacks_report_parts(self):
+        row = '<row r="1"><c r="A1"><v>1</v></c></row>'
+        edited = '<row r="1"><c r="A1"><v>2</v></c></row>'
+        base = {'xl/styles.xml': '<styleSheet/>', 'xl/charts/chart1.xml': '<chart/>',
+                'xl/workbook.xml': ooxml_workbook()}
+        x = self.write('x', row, base)
+        # the styles changed on one side while the other side changed a sheet,
+        # and the chart and the workbook part changed differently on both sides
+        a = self.write('a', edited, dict(base, **{'xl/charts/chart1.xml': '<chart title="ours"/>'}))
+        b = self.write('b', row, dict(base, **{'xl/styles.xml': '<styleSheet><fonts/></styleSheet>',
+                                               'xl/charts/chart1.xml': '<chart title="theirs"/>',
+                                               'xl/workbook.xml': ooxml_workbook('<definedNames/>')}))
+        self.assertIsNone(ooxml.merge_parts(x, a, b))
+        exit_code, output = self.merge(x, a, b)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(output.splitlines(), [
+            'CONFLICT (part): Book1.xlsx/xl/charts/chart1.xml changed in theirs, please merge manually',
+            'CONFLICT (part): Book1.xlsx/xl/styles.xml changed in theirs, please merge manually',
+            'CONFLICT (part): Book1.xlsx/xl/workbook.xml changed in theirs, please merge manually',
+        ])
+
+    @mock.patch('merge.merge_contents', return_value=False)
+    def test_other_formats_cannot_be_checked(self, mock_merge_contents):
+        x, a, b = [os.path.join(self.tmp_dir.name, name) for name in ('x', 'a', 'b')]
+        for path, content in ((x, b'base'), (a, b'ours'), (b, b'theirs')):
+            with open(path, 'wb') as f:
+                f.write(content)
+        with self.assertRaises(SystemExit) as cm, mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            merge.merge_workbook('Book1.xls', x, a, b)
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn('CONFLICT (content): Book1.xls can only be merged in VBA modules and cells', mock_stdout.getvalue())
+
+    @mock.patch('merge.merge_sheets', side_effect=AttributeError('value'))
+    def test_files_are_renamed_back_on_errors(self, mock_merge_sheets):
+        x, a, b = [os.path.join(self.tmp_dir.name, name) for name in ('x', 'a', 'b')]
+        write_workbook(x, '<row r="1"><c r="A1"><v>1</v></c></row>')
+        write_workbook(a, '<row r="1"><c r="A1"><v>2</v></c></row>')
+        write_workbook(b, '<row r="1"><c r="A1"><v>3</v></c></row>')
+        with self.assertRaises(AttributeError):
+            merge.merge_workbook('Book1.xlsx', x, a, b)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['a', 'b', 'x'])
+
+
+class TestVBAProjectDigest(TestCase):
+
+    def test_ignores_document_modules(self):
+        modules = {'Module1': FakeVBAModule('Module1', 'Module', 'abc', ''),
+                   'Sheet1': FakeVBAModule('Sheet1', 'Document', 'def', '')}
+        digest = vba_project_digest(modules)
+        modules['Sheet1'] = FakeVBAModule('Sheet1', 'Document', 'xyz', '')
+        self.assertEqual(vba_project_digest(modules), digest)
+        modules['Module1'] = FakeVBAModule('Module1', 'Module', 'xyz', '')
+        self.assertNotEqual(vba_project_digest(modules), digest)
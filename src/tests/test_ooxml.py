@@ -0,0 +1,282 @@
+import os
+import zipfile
+import tempfile
+import ooxml
+import workbook
+from unittest import TestCase
+
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+          xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>
+<sheet name="Data" sheetId="1" r:id="rId1"/>
+<sheet name="Chart" sheetId="2" r:id="rId2"/>
+<sheet name="Empty" sheetId="3" r:id="rId3"/>
+</sheets>
+</workbook>"""
+
+RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/chartsheet" Target="chartsheets/sheet1.xml"/>
+<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="/xl/worksheets/sheet2.xml"/>
+</Relationships>"""
+
+SHARED_STRINGS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="{n}" uniqueCount="{n}">
+{items}
+</sst>"""
+
+SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>{rows}</sheetData></worksheet>"""
+
+
+def write_workbook(path, rows, strings=('hello', 'world')):
+    items = ''.join(f'<si><t>{s}</t></si>' for s in strings)
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('xl/workbook.xml', WORKBOOK)
+        z.writestr('xl/_rels/workbook.xml.rels', RELS)
+        z.writestr('xl/sharedStrings.xml', SHARED_STRINGS.format(n=len(strings), items=items))
+        z.writestr('xl/worksheets/sheet1.xml', SHEET.format(rows=rows))
+        z.writestr('xl/worksheets/sheet2.xml', SHEET.format(rows=''))
+
+
+ROWS = ('<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1"><v>1.5</v></c><c r="C1" s="1"/></row>'
+        '<row r="3"><c r="A3"><f>B1*2</f><v>3</v></c><c r="B3" t="b"><v>1</v></c>'
+        '<c r="C3" t="inlineStr"><is><r><t>rich</t></r><r><t> text</t></r></is></c></row>')
+
+
+class TestWorkbook(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, rows, **kwargs):
+        path = os.path.join(self.tmp_dir.name, name)
+        write_workbook(path, rows, **kwargs)
+        return path
+
+    def test_worksheets(self):
+        wb = ooxml.Workbook(self.write('Book1.xlsx', ROWS))
+        self.assertEqual([sheet.name for sheet in wb.worksheets], ['Data', 'Empty'])
+        self.assertEqual([sheet.cells.Count for sheet in wb.worksheets], [5, 0])
+        self.assertEqual(wb.vba_modules, [])
+
+    def test_cells(self):
+        wb = ooxml.Workbook(self.write('Book1.xlsx', ROWS))
+        cells = [(c.address, c.row, c.column, c.value, c.formula) for c in wb.worksheets[0].cells]
+        self.assertEqual(cells, [
+            ('A1', 1, 1, 'hello', None),
+            ('B1', 1, 2, 1.5, None),
+            ('A3', 3, 1, 3.0, '=B1*2'),
+            ('B3', 3, 2, True, None),
+            ('C3', 3, 3, 'rich text', None),
+        ])
+
+    def test_shared_strings_are_read_lazily(self):
+        wb = ooxml.Workbook(self.write('Book1.xlsx', '<row r="1"><c r="A1"><v>1</v></c></row>'))
+        wb.worksheets[0].digest
+        self.assertIsNone(wb._shared_strings)
+
+    def test_digest(self):
+        digest = ooxml.Workbook(self.write('Book1.xlsx', ROWS)).worksheets[0].digest
+        # same content with a renumbered shared string table
+        renumbered = ROWS.replace('<v>0</v>', '<v>1</v>')
+        self.assertEqual(ooxml.Workbook(self.write('Book2.xlsx', renumbered, strings=('world', 'hello'))).worksheets[0].digest,
+                         digest)
+        changed = ROWS.replace('<v>1.5</v>', '<v>2.5</v>')
+        self.assertNotEqual(ooxml.Workbook(self.write('Book3.xlsx', changed)).worksheets[0].digest, digest)
+
+    def test_cells_pass_computes_digest(self):
+        digest = ooxml.Workbook(self.write('Book1.xlsx', ROWS)).worksheets[0].digest
+        sheet = ooxml.Workbook(self.write('Book2.xlsx', ROWS)).worksheets[0]
+        list(sheet.cells)
+        self.assertEqual((sheet._digest, sheet._count), (digest, 5))
+
+    def test_missing_cell_references(self):
+        wb = ooxml.Workbook(self.write('Book1.xlsx', '<row><c><v>1</v></c><c><v>2</v></c></row><row><c><v>3</v></c></row>'))
+        self.assertEqual([c.address for c in wb.worksheets[0].cells], ['A1', 'B1', 'A2'])
+
+
+class TestWriteCells(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_cells(self, path):
+        wb = ooxml.Workbook(path)
+        cells = [(c.address, c.value, c.formula) for c in wb.worksheets[0].cells]
+        wb.close()
+        return cells
+
+    def test_read_records(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsx')
+        write_workbook(path, ROWS)
+        records = ooxml.Workbook(path).worksheets[0].read_records({'A1', 'A3'})
+        self.assertEqual(records, {'A1': ('inlineStr', 'hello', None, None), 'A3': ('n', '3', 'B1*2', None)})
+
+    def test_write_cells(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsx')
+        write_workbook(path, ROWS)
+        edits = {'A1': ('inlineStr', 'a & b', None, None), 'B1': None, 'D1': ('b', '0', None, None),
+                 'A2': ('n', '7', 'A3+4', None), 'C5': ('str', 'x', 'A1', None)}
+        self.assertEqual(ooxml.write_cells(path, {'Data': edits}), set())
+        self.assertEqual(self.read_cells(path), [
+            ('A1', 'a & b', None),
+            ('D1', False, None),
+            ('A2', 7.0, '=A3+4'),
+            ('A3', 3.0, '=B1*2'),
+            ('B3', True, None),
+            ('C3', 'rich text', None),
+            ('C5', 'x', '=A1'),
+        ])
+        with zipfile.ZipFile(path) as z:
+            sheet = z.read('xl/worksheets/sheet1.xml').decode('utf-8')
+            # untouched rows and the other parts are kept as they are
+            self.assertIn(ROWS[ROWS.index('<row r="3">'):], sheet)
+            self.assertEqual(z.read('xl/worksheets/sheet2.xml').decode('utf-8'), SHEET.format(rows=''))
+
+    def test_calc_chain_is_dropped(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsx')
+        write_workbook(path, ROWS)
+        with zipfile.ZipFile(path, 'a') as z:
+            z.writestr('xl/calcChain.xml', '<calcChain/>')
+            z.writestr('[Content_Types].xml', '<Types><Override PartName="/xl/calcChain.xml" ContentType="x"/></Types>')
+        ooxml.write_cells(path, {'Data': {'A3': None}})
+        with zipfile.ZipFile(path) as z:
+            self.assertNotIn('xl/calcChain.xml', z.namelist())
+            self.assertEqual(z.read('[Content_Types].xml'), b'<Types></Types>')
+
+    def test_edit_sheet_xml(self):
+        xml = SHEET.format(rows='')
+        edited = ooxml.edit_sheet_xml(xml, {'B2': ('n', '1', None, None)})
+        self.assertIn('<sheetData><row r="2"><c r="B2"><v>1</v></c></row></sheetData>', edited)
+        # the style of a changed cell is kept
+        xml = SHEET.format(rows='<row r="1"><c r="A1" s="3"><v>1</v></c></row>')
+        self.assertIn('<c r="A1" s="3"><v>2</v></c>', ooxml.edit_sheet_xml(xml, {'A1': ('n', '2', None, None)}))
+
+    def test_shared_formulas_are_not_written(self):
+        xml = SHEET.format(rows='<row r="1"><c r="A1"><f t="shared" ref="A1:A2" si="0">B1</f><v>1</v></c>'
+                                '<c r="A2"><f t="shared" si="0"/><v>1</v></c></row>')
+        self.assertIsNone(ooxml.edit_sheet_xml(xml, {'A1': ('n', '2', None, None)}))
+        self.assertIsNone(ooxml.edit_sheet_xml(xml, {'B1': ('n', '2', None, 'shared')}))
+        self.assertIsNotNone(ooxml.edit_sheet_xml(xml, {'A2': ('n', '2', None, None)}))
+
+
+class TestMergeParts(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, **changes):
+        parts = {
+            'xl/workbook.xml': WORKBOOK,
+            'xl/_rels/workbook.xml.rels': RELS,
+            'xl/sharedStrings.xml': SHARED_STRINGS.format(n=2, items='<si><t>hello</t></si><si><t>world</t></si>'),
+            'xl/worksheets/sheet1.xml': SHEET.format(rows=ROWS),
+            'xl/worksheets/sheet2.xml': SHEET.format(rows=''),
+            'docProps/core.xml': '<coreProperties/>',
+        }
+        parts.update((name.replace('__', '/').replace('_xml', '.xml'), content) for name, content in changes.items())
+        path = os.path.join(self.tmp_dir.name, name)
+        with zipfile.ZipFile(path, 'w') as z:
+            for part, content in parts.items():
+                if content is not None:
+                    z.writestr(part, content)
+        return path
+
+    def read(self, path, part):
+        with zipfile.ZipFile(path) as z:
+            return z.read(part).decode('utf-8') if part in z.namelist() else None
+
+    def test_parts_changed_on_different_sides(self):
+        sheet2 = SHEET.format(rows='<row r="1"><c r="A1"><v>1</v></c></row>')
+        x = self.write('x.xlsx')
+        a = self.write('a.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows=''), docProps__core_xml='<ours/>')
+        b = self.write('b.xlsx', xl__worksheets__sheet2_xml=sheet2, docProps__core_xml='<theirs/>',
+                       xl__media__image1_xml='<image/>')
+        self.assertEqual(ooxml.merge_parts(x, a, b), ['xl/media/image1.xml', 'xl/worksheets/sheet2.xml'])
+        self.assertEqual(self.read(a, 'xl/worksheets/sheet1.xml'), SHEET.format(rows=''))
+        self.assertEqual(self.read(a, 'xl/worksheets/sheet2.xml'), sheet2)
+        self.assertEqual(self.read(a, 'xl/media/image1.xml'), '<image/>')
+        self.assertEqual(self.read(a, 'docProps/core.xml'), '<ours/>')
+
+    def test_deleted_part(self):
+        x = self.write('x.xlsx', xl__printerSettings_xml='<settings/>')
+        a = self.write('a.xlsx', xl__printerSettings_xml='<settings/>', xl__worksheets__sheet1_xml=SHEET.format(rows=''))
+        b = self.write('b.xlsx')
+        self.assertEqual(ooxml.merge_parts(x, a, b), ['xl/printerSettings.xml'])
+        self.assertIsNone(self.read(a, 'xl/printerSettings.xml'))
+
+    def test_part_changed_on_both_sides(self):
+        x = self.write('x.xlsx')
+        a = self.write('a.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows=''))
+        b = self.write('b.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows='<row r="1"/>'))
+        with open(a, 'rb') as f:
+            content = f.read()
+        self.assertIsNone(ooxml.merge_parts(x, a, b))
+        with open(a, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_shared_strings(self):
+        x = self.write('x.xlsx')
+        a = self.write('a.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows=''))
+        appended = SHARED_STRINGS.format(n=3, items='<si><t>hello</t></si><si><t>world</t></si><si><t>new</t></si>')
+        b = self.write('b.xlsx', xl__sharedStrings_xml=appended)
+        self.assertEqual(ooxml.merge_parts(x, a, b), ['xl/sharedStrings.xml'])
+        # ours refers to the strings by their index, which theirs renumbered
+        a = self.write('a.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows=''))
+        renumbered = SHARED_STRINGS.format(n=2, items='<si><t>world</t></si><si><t>hello</t></si>')
+        b = self.write('b.xlsx', xl__sharedStrings_xml=renumbered)
+        self.assertIsNone(ooxml.merge_parts(x, a, b))
+
+    def test_not_a_package(self):
+        x = self.write('x.xlsx')
+        b = os.path.join(self.tmp_dir.name, 'b.xlsb')
+        with open(b, 'wb') as f:
+            f.write(b'not a zip file')
+        self.assertIsNone(ooxml.merge_parts(x, x, b))
+
+    def test_unmerged_parts(self):
+        styled = ROWS.replace('<c r="B1">', '<c r="B1" s="2">')
+        values = ROWS.replace('1.5', '2.5')
+        views = '<sheetViews><sheetView workbookViewId="0"/></sheetViews><sheetData>'
+        x = self.write('x.xlsx')
+        a = self.write('a.xlsx', xl__worksheets__sheet2_xml=SHEET.format(rows='<row r="1"/>'))
+        b = self.write('b.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows=values).replace('<sheetData>', views),
+                       xl__worksheets__sheet2_xml=SHEET.format(rows='<row r="1"/>'), docProps__core_xml='<theirs/>')
+        # changes of cell values, of the sheet view and of the metadata are carried over
+        self.assertEqual(ooxml.unmerged_parts(x, a, b), [])
+        b = self.write('b.xlsx', xl__worksheets__sheet1_xml=SHEET.format(rows=styled),
+                       xl__drawings__drawing1_xml='<drawing/>')
+        self.assertEqual(ooxml.unmerged_parts(x, a, b), ['xl/drawings/drawing1.xml', 'xl/worksheets/sheet1.xml'])
+        # unless ours made the same change
+        self.assertEqual(ooxml.unmerged_parts(x, b, b), [])
+        self.assertIsNone(ooxml.unmerged_parts(x, a, os.path.join(os.path.dirname(__file__), 'Book1.xlsb')))
+
+    def test_sheet_layout(self):
+        xml = SHEET.format(rows='<row r="1" spans="1:2" ht="20" customHeight="1"><c r="A1" s="3" t="s"><v>0</v></c>'
+                                '<c r="B1"><f>A1</f><v>1</v></c></row><row r="2"><c r="A2" s="0"><v>2</v></c></row>')
+        self.assertEqual(ooxml.sheet_layout(xml), SHEET.format(
+            rows='<row r="1" ht="20" customHeight="1"><c r="A1" s="3"/></row>'))
+
+
+class TestGetBackend(TestCase):
+
+    def test_backend_by_extension(self):
+        self.assertIs(workbook.get_backend('Book1.xlsx'), ooxml.Workbook)
+        self.assertIs(workbook.get_backend('Book1.XLSM'), ooxml.Workbook)
+
+    def test_address_helpers(self):
+        self.assertEqual(ooxml.split_address('AB12'), (12, 28))
+        self.assertEqual(ooxml.column_letters(28), 'AB')
@@ -0,0 +1,73 @@
+from unittest import TestCase
+from patiencediff import Budget, PatienceSequenceMatcher, unique_lcs_py, intern_lines
+
+
+class TestUniqueLcs(TestCase):
+
+    def test_unique_lines_only(self):
+        self.assertEqual(unique_lcs_py('abcde', 'abXde'), [(0, 0), (1, 1), (3, 3), (4, 4)])
+        self.assertEqual(unique_lcs_py('aab', 'aab'), [(2, 2)])
+
+
+class TestPatienceSequenceMatcher(TestCase):
+
+    def test_matching_blocks(self):
+        s = PatienceSequenceMatcher(None, 'abxcd', 'abcd')
+        self.assertEqual(s.get_matching_blocks(), [(0, 0, 2), (3, 2, 2), (5, 4, 0)])
+
+    def test_duplicate_lines(self):
+        a = ['Sub a()', '    x = 1', 'End Sub', '', 'Sub b()', '    x = 1', 'End Sub']
+        b = ['Sub a()', '    x = 2', 'End Sub', '', 'Sub b()', '    x = 1', 'End Sub']
+        s = PatienceSequenceMatcher(None, a, b)
+        self.assertEqual(s.get_matching_blocks(), [(0, 0, 1), (2, 2, 5), (7, 7, 0)])
+        self.assertEqual(s.get_opcodes(), [('equal', 0, 1, 0, 1), ('replace', 1, 2, 1, 2), ('equal', 2, 7, 2, 7)])
+
+    def test_identical(self):
+        a = ['End Sub'] * 100
+        self.assertEqual(PatienceSequenceMatcher(None, a, a).get_matching_blocks(), [(0, 0, 100), (100, 100, 0)])
+
+    def test_intern_lines(self):
+        a, b = intern_lines(['x', 'y', 'x'], ['y', 'z'])
+        self.assertEqual(list(a), [0, 1, 0])
+        self.assertEqual(list(b), [1, 2])
+
+    def test_deep_nesting(self):
+        # every level only has unique lines at its ends, which used to exceed the recursion limit
+        def nested(depth, middle):
+            if depth == 0:
+                return [middle]
+            inner = nested(depth - 1, middle)
+            return [f'Sub Level{depth}()'] + inner + inner + ['End Sub']
+        a = nested(14, 'x = 1')
+        b = nested(14, 'x = 2')
+        blocks = PatienceSequenceMatcher(None, a, b).get_matching_blocks()
+        self.assertEqual(sum(n for _, _, n in blocks), len(a) - 2 ** 14)
+
+    def test_budget(self):
+        a = ['Option Explicit', 'a', 'b', 'c', 'End Sub']
+        b = ['Option Explicit', 'c', 'b', 'a', 'End Sub']
+        s = PatienceSequenceMatcher(None, a, b, max_operations=0)
+        # the remaining range is one replacement between the common prefix and suffix
+        self.assertEqual(s.get_opcodes(), [('equal', 0, 1, 0, 1), ('replace', 1, 4, 1, 4), ('equal', 4, 5, 4, 5)])
+        self.assertTrue(s.budget.exhausted)
+        s = PatienceSequenceMatcher(None, a, b, max_operations=100)
+        self.assertEqual(len(s.get_matching_blocks()), 4)
+        self.assertFalse(s.budget.exhausted)
+
+    def test_timeout(self):
+        a = [str(i % 10) for i in range(1000)]
+        b = [str(i % 7) for i in range(1000)]
+        s = PatienceSequenceMatcher(None, a, b, timeout=0)
+        self.assertEqual(s.get_matching_blocks(), [(0, 0, 7), (1000, 1000, 0)])
+
+
+class TestBudget(TestCase):
+
+    def test_operations(self):
+        budget = Budget(max_operations=10)
+        self.assertTrue(budget.spend(10))
+        self.assertFalse(budget.spend(1))
+        self.assertTrue(budget.exhausted)
+
+    def test_unlimited(self):
+        self.assertTrue(Budget().spend(10 ** 9))
@@ -0,0 +1,187 @@
+import os
+import sys
+import stat
+import tempfile
+import threading
+import server
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from io import StringIO
+from unittest import TestCase, mock, skipIf
+
+
+class TestForward(TestCase):
+
+    @mock.patch('server.get_address', return_value=os.path.join(tempfile.gettempdir(), 'git-xl-missing', 'server.sock'))
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_falls_back_to_local_process(self, mock_stdout, mock_get_address):
+        exit_code = server.forward('diff', [])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(mock_stdout.getvalue(), 'Unexpected number of arguments\n')
+
+
+@skipIf(os.name == 'nt', 'uses a Unix socket')
+class TestServer(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp_dir.name, 'server.sock')
+        key_path = os.path.join(self.tmp_dir.name, 'key', 'server.key')
+        patcher = mock.patch('server.get_key_path', return_value=key_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def start(self, **kwargs):
+        result = {}
+
+        def target():
+            with mock.patch('server.load_engine'):
+                result['exit_code'] = server.serve(self.address, **kwargs)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        while not os.path.exists(self.address):
+            thread.join(0.01)
+        return thread, result
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_forward_and_stop(self, mock_stdout):
+        thread, result = self.start()
+        with mock.patch('server.get_address', return_value=self.address):
+            exit_code = server.forward('diff', [])
+            self.assertTrue(server.stop())
+        thread.join()
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(mock_stdout.getvalue(), 'Unexpected number of arguments\n')
+        self.assertEqual(result['exit_code'], 0)
+        self.assertFalse(os.path.exists(self.address))
+
+    def test_idle_timeout(self):
+        thread, result = self.start(idle_timeout=0.1)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result['exit_code'], 0)
+
+    @mock.patch('server.get_memory_usage', return_value=2)
+    def test_recycle(self, mock_get_memory_usage):
+        thread, result = self.start(max_memory=1)
+        with mock.patch('server.get_address', return_value=self.address), \
+                mock.patch('sys.stdout', new_callable=StringIO):
+            server.forward('diff', [])
+        thread.join(5)
+        self.assertEqual(result['exit_code'], server.EXIT_RECYCLE)
+
+    def test_output_is_streamed(self):
+        received = threading.Event()
+        state = {}
+
+        class Stdout(StringIO):
+            def write(self, text):
+                received.set()
+                return super().write(text)
+
+        def run(command, args):
+            print('x' * server.CHUNK_SIZE)
+            # the client has the first chunk while the command is still running
+            state['received'] = received.wait(5)
+            print('done')
+            print('Warning: slow', file=sys.stderr)
+            return 3
+
+        thread, result = self.start()
+        with mock.patch('server.get_address', return_value=self.address), \
+                mock.patch('server.run', side_effect=run), \
+                mock.patch('sys.stdout', new_callable=Stdout) as mock_stdout, \
+                mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            exit_code = server.forward('diff', [])
+            self.assertTrue(server.stop())
+        thread.join()
+        self.assertTrue(state['received'])
+        self.assertEqual(exit_code, 3)
+        self.assertEqual(mock_stdout.getvalue(), 'x' * server.CHUNK_SIZE + '\ndone\n')
+        self.assertEqual(mock_stderr.getvalue(), 'Warning: slow\n')
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_rejects_clients_without_key(self, mock_stdout):
+        thread, result = self.start()
+        with self.assertRaises(AuthenticationError):
+            Client(self.address, authkey=b'wrong')
+        with mock.patch('server.get_address', return_value=self.address):
+            self.assertEqual(server.forward('diff', []), 0)
+            self.assertTrue(server.stop())
+        thread.join()
+        self.assertEqual(mock_stdout.getvalue(), 'Unexpected number of arguments\n')
+        self.assertEqual(stat.S_IMODE(os.stat(server.get_key_path()).st_mode), 0o600)
+
+    @mock.patch('server.run', return_value=5)
+    def test_does_not_trust_servers_without_key(self, mock_run):
+        server.read_key(create=True)
+        listener = Listener(self.address, authkey=b'wrong')
+
+        def accept():
+            try:
+                listener.accept()
+            except AuthenticationError:
+                pass
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+        with mock.patch('server.get_address', return_value=self.address), \
+                mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            self.assertEqual(server.forward('diff', []), 5)
+        thread.join()
+        listener.close()
+        mock_run.assert_called_once_with('diff', [])
+        self.assertIn('could not be authenticated', mock_stderr.getvalue())
+
+
+@skipIf(os.name == 'nt', 'checks POSIX permissions')
+class TestPrivateFiles(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_make_private_dir(self):
+        path = os.path.join(self.tmp_dir.name, 'private')
+        server.make_private_dir(path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o700)
+
+    def test_rejects_shared_dir(self):
+        path = os.path.join(self.tmp_dir.name, 'shared')
+        os.mkdir(path)
+        os.chmod(path, 0o755)
+        with self.assertRaises(RuntimeError):
+            server.make_private_dir(path)
+
+    def test_rejects_readable_key(self):
+        with mock.patch('server.get_key_path', return_value=os.path.join(self.tmp_dir.name, 'key', 'server.key')):
+            key = server.read_key(create=True)
+            self.assertEqual(len(key), server.KEY_SIZE)
+            self.assertEqual(server.read_key(), key)
+            os.chmod(server.get_key_path(), 0o644)
+            with self.assertRaises(RuntimeError):
+                server.read_key()
+
+
+class TestClientEnvironment(TestCase):
+
+    def test_only_needed_variables_are_sent(self):
+        env = {'PATH': '/bin', 'GIT_DIR': '.git', 'GIT_XL_TRACE': 'trace.jsonl', 'GITHUB_TOKEN': 'secret',
+               'AWS_SECRET_ACCESS_KEY': 'secret', 'GIT_ASKPASS': 'askpass'}
+        self.assertEqual(server.client_environment(env),
+                         {'PATH': '/bin', 'GIT_DIR': '.git', 'GIT_XL_TRACE': 'trace.jsonl'})
+
+    def test_client_context(self):
+        with mock.patch.dict(os.environ, {'GIT_XL_TRACE': 'server', 'SERVER_ONLY': '1'}):
+            with server.client_context(os.getcwd(), {'GIT_DIR': 'client', 'CLIENT_ONLY': '1'}):
+                self.assertEqual(os.environ.get('GIT_DIR'), 'client')
+                self.assertNotIn('GIT_XL_TRACE', os.environ)
+                self.assertNotIn('CLIENT_ONLY', os.environ)
+                self.assertEqual(os.environ['SERVER_ONLY'], '1')
+            self.assertEqual(os.environ['GIT_XL_TRACE'], 'server')
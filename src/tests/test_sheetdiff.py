@@ -0,0 +1,122 @@
+import os
+import importlib.util
+from unittest import TestCase, skipIf
+from sheetdiff import make_cell, read_cells, diff_cells, diff_rows, format_cell, has_value
+
+
+BOOK1 = os.path.join(os.path.dirname(__file__), 'Book1.xlsb')
+
+
+class EngineCell:
+    """Stand-in for the cells of xltrail-core, which expose no value or formula."""
+    __slots__ = ('address', 'row', 'column', 'fingerprint')
+
+    def __init__(self, address, row, column, fingerprint):
+        self.address = address
+        self.row = row
+        self.column = column
+        self.fingerprint = fingerprint
+
+
+class FakeWorksheet:
+
+    def __init__(self, cells):
+        self.cells = cells
+
+
+def cells(*specs):
+    return dict((spec[0], make_cell(*spec)) for spec in specs)
+
+
+class TestDiffCells(TestCase):
+
+    def test_added_removed_changed(self):
+        a = cells(('A1', 1, 1, 'x'), ('B1', 1, 2, 1.0), ('A2', 2, 1, 3.0, '=1+2'))
+        b = cells(('A1', 1, 1, 'x'), ('B1', 1, 2, 2.0), ('A3', 3, 1, 'new'))
+        changes, total = diff_cells(a, b)
+        self.assertEqual(total, 3)
+        self.assertEqual([c.address for c in changes], ['B1', 'A2', 'A3'])
+        self.assertEqual((changes[0].a.value, changes[0].b.value), (1.0, 2.0))
+        self.assertIsNone(changes[1].b)
+        self.assertIsNone(changes[2].a)
+
+    def test_formula_change(self):
+        a = cells(('A1', 1, 1, 3.0, '=1+2'))
+        b = cells(('A1', 1, 1, 3.0, '=2+1'))
+        changes, total = diff_cells(a, b)
+        self.assertEqual(total, 1)
+        self.assertEqual(format_cell(changes[0].b), '=2+1 [3.0]')
+
+    def test_value_types(self):
+        # 1 == True and hash(1.0) == hash(True), but the cells differ
+        a = cells(('A1', 1, 1, 1.0), ('B1', 1, 2, 0.0), ('C1', 1, 3, 'x'))
+        b = cells(('A1', 1, 1, True), ('B1', 1, 2, False), ('C1', 1, 3, 'x'))
+        changes, total = diff_cells(a, b)
+        self.assertEqual([c.address for c in changes], ['A1', 'B1'])
+
+    def test_fingerprint_cells(self):
+        a = read_cells(FakeWorksheet([EngineCell('A1', 1, 1, 'f1'), EngineCell('B1', 1, 2, 'f2')]))
+        b = read_cells(FakeWorksheet([EngineCell('A1', 1, 1, 'f1'), EngineCell('B1', 1, 2, 'f3')]))
+        self.assertFalse(has_value(a['A1']))
+        changes, total = diff_cells(a, b)
+        self.assertEqual([c.address for c in changes], ['B1'])
+        self.assertEqual(format_cell(changes[0].b), '[f3]')
+
+    @skipIf(importlib.util.find_spec('clr') is None, 'needs xltrail-core')
+    def test_engine_cells(self):
+        from workbook import load_workbook
+        wb = load_workbook(BOOK1)
+        for sheet in wb.worksheets:
+            cells = read_cells(sheet)
+            self.assertEqual(len(cells), sheet.cells.Count)
+            for cell in cells.values():
+                format_cell(cell)
+            self.assertEqual(diff_cells(cells, read_cells(sheet)), ([], 0))
+
+    def test_limit(self):
+        a = cells(*[('A%d' % i, i, 1, i) for i in range(1, 101)])
+        b = cells(*[('A%d' % i, i, 1, -i) for i in range(1, 101)])
+        changes, total = diff_cells(a, b, limit=10)
+        self.assertEqual(total, 100)
+        self.assertEqual([c.row for c in changes], list(range(1, 11)))
+
+
+def sheet(rows):
+    result = {}
+    for row, values in enumerate(rows, 1):
+        for column, value in enumerate(values, 1):
+            address = 'ABCDEFGHIJ'[column - 1] + str(row)
+            result[address] = make_cell(address, row, column, value)
+    return result
+
+
+class TestDiffRows(TestCase):
+
+    def test_inserted_row(self):
+        a = sheet([['id', 'name'], [1, 'x'], [2, 'y'], [3, 'z']])
+        b = sheet([['id', 'name'], [0, 'w'], [1, 'x'], [2, 'y'], [3, 'z']])
+        changes, total = diff_rows(a, b)
+        self.assertEqual(total, 2)
+        self.assertEqual([(c.a, c.b.address) for c in changes], [(None, 'A2'), (None, 'B2')])
+
+    def test_rows_with_equal_hashes(self):
+        # hash((1, 1.0)) == hash((1, True)), but the rows differ
+        a = sheet([['id', 'flag'], [1, 1.0], [2, 0.0]])
+        b = sheet([['id', 'flag'], [1, True], [2, 0.0]])
+        changes, total = diff_rows(a, b)
+        self.assertEqual(total, 1)
+        self.assertEqual((changes[0].a.value, changes[0].b.value), (1.0, True))
+
+    def test_changed_row_is_cell_diffed(self):
+        a = sheet([['id', 'name'], [1, 'x'], [2, 'y']])
+        b = sheet([['id', 'name'], [1, 'X'], [2, 'y']])
+        changes, total = diff_rows(a, b)
+        self.assertEqual(total, 1)
+        self.assertEqual((changes[0].a.value, changes[0].b.value), ('x', 'X'))
+
+    def test_deleted_row_with_limit(self):
+        a = sheet([['id', 'name'], [1, 'x'], [2, 'y']])
+        b = sheet([['id', 'name'], [2, 'y']])
+        changes, total = diff_rows(a, b, limit=1)
+        self.assertEqual(total, 2)
+        self.assertEqual([(c.a.address, c.b) for c in changes], [('A2', None)])
@@ -0,0 +1,68 @@
+from unittest import TestCase, mock
+from sheetdiff import make_cell
+from sheetmerge import merge_cells, merge_worksheets
+
+
+def cells(*specs):
+    return dict((spec[0], make_cell(*spec)) for spec in specs)
+
+
+class FakeWorksheet:
+
+    def __init__(self, name, cells):
+        self.name = name
+        self.cells = list(cells.values())
+        self.digest = hash(tuple(sorted((address, cell.digest) for address, cell in cells.items())))
+
+
+def sheets(**sheet_cells):
+    return dict((name, FakeWorksheet(name, cells)) for name, cells in sheet_cells.items())
+
+
+class TestMergeCells(TestCase):
+
+    def test_disjoint_edits(self):
+        x = cells(('A1', 1, 1, 1.0), ('B1', 1, 2, 2.0), ('C1', 1, 3, 3.0))
+        a = cells(('A1', 1, 1, 10.0), ('B1', 1, 2, 2.0), ('C1', 1, 3, 3.0))
+        b = cells(('A1', 1, 1, 1.0), ('B1', 1, 2, 20.0), ('D1', 1, 4, 'new'))
+        edits, conflicts = merge_cells(x, a, b)
+        self.assertEqual(sorted(edits), ['B1', 'C1', 'D1'])
+        self.assertEqual(edits['B1'].value, 20.0)
+        self.assertIsNone(edits['C1'])
+        self.assertEqual(conflicts, [])
+
+    def test_conflicts(self):
+        x = cells(('A1', 1, 1, 1.0), ('A2', 2, 1, 2.0), ('B1', 1, 2, 3.0, '=1+2'))
+        a = cells(('A1', 1, 1, 10.0), ('A2', 2, 1, 5.0), ('B1', 1, 2, 3.0, '=2+1'))
+        b = cells(('A1', 1, 1, 20.0), ('A2', 2, 1, 5.0), ('C5', 5, 3, 'x'))
+        edits, conflicts = merge_cells(x, a, b)
+        # A2 was changed the same way on both sides
+        self.assertEqual(edits, {'C5': b['C5']})
+        self.assertEqual(conflicts, ['A1', 'B1'])
+
+
+class TestMergeWorksheets(TestCase):
+
+    def test_untouched_sheets_are_not_read(self):
+        x = sheets(Data=cells(('A1', 1, 1, 1.0)))
+        a = sheets(Data=cells(('A1', 1, 1, 2.0)))
+        with mock.patch('sheetmerge.read_cells') as read_cells:
+            self.assertEqual(merge_worksheets(x, a, x), ([], []))
+            self.assertEqual(merge_worksheets(x, a, a), ([], []))
+        read_cells.assert_not_called()
+
+    def test_ours_unchanged(self):
+        x = sheets(Data=cells(('A1', 1, 1, 1.0)))
+        b = sheets(Data=cells(('A1', 1, 1, 2.0)))
+        merges, conflicts = merge_worksheets(x, x, b)
+        self.assertEqual([(m.name, list(m.edits), m.conflicts) for m in merges], [('Data', ['A1'], [])])
+        self.assertEqual(conflicts, [])
+
+    def test_added_and_deleted_sheets(self):
+        x = sheets(Data=cells(('A1', 1, 1, 1.0)), Old=cells(), Gone=cells(('A1', 1, 1, 1.0)))
+        a = sheets(Data=cells(('A1', 1, 1, 1.0)), Old=cells())
+        b = sheets(Gone=cells(('A1', 1, 1, 2.0)), New=cells(('A1', 1, 1, 1.0)))
+        merges, conflicts = merge_worksheets(x, a, b)
+        self.assertEqual(merges, [])
+        self.assertEqual(sorted(conflicts), [('Data', 'deleted'), ('Gone', 'modify/delete'), ('New', 'added'),
+                                             ('Old', 'deleted')])
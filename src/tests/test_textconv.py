@@ -0,0 +1,67 @@
+import os
+import zipfile
+import tempfile
+import textconv
+from io import StringIO
+from unittest import TestCase, mock
+
+from tests.test_ooxml import ROWS, write_workbook
+
+
+BOOK1 = os.path.join(os.path.dirname(__file__), 'Book1.xlsb')
+
+
+class TestTextconv(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def render(self, path):
+        stream = StringIO()
+        textconv.write_textconv(stream, path)
+        return stream.getvalue()
+
+    def test_fingerprint_cells(self):
+        # the cells of xltrail-core expose a fingerprint instead of the value
+        cell = mock.Mock(spec=['address', 'row', 'column', 'fingerprint'], address='B2', fingerprint='abc')
+        self.assertEqual(textconv.format_cell('Sheet1', cell), 'Sheet1!B2: [abc]')
+
+    def test_worksheets(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsx')
+        write_workbook(path, ROWS)
+        lines = self.render(path).split('\n')
+        self.assertRegex(lines[0], r'^Worksheet Data \(5 cells\) \[[0-9a-f]{40}\]$')
+        self.assertEqual(lines[1:7], [
+            'Data!A1: hello',
+            'Data!B1: 1.5',
+            'Data!A3: =B1*2 [3.0]',
+            'Data!B3: True',
+            'Data!C3: rich text',
+            '',
+        ])
+        self.assertRegex(lines[7], r'^Worksheet Empty \(0 cells\) \[[0-9a-f]{40}\]$')
+
+    def test_stable(self):
+        # the rendering does not depend on the numbering of the shared string table
+        path_a = os.path.join(self.tmp_dir.name, 'a.xlsx')
+        path_b = os.path.join(self.tmp_dir.name, 'b.xlsx')
+        write_workbook(path_a, ROWS)
+        write_workbook(path_b, ROWS.replace('<v>0</v>', '<v>1</v>'), strings=('world', 'hello'))
+        self.assertEqual(self.render(path_a), self.render(path_b))
+
+    def test_multiline_values(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsx')
+        write_workbook(path, '<row r="1"><c r="A1" t="s"><v>0</v></c></row>', strings=('one\ntwo\\',))
+        self.assertEqual(self.render(path).split('\n')[1], 'Data!A1: one\\ntwo\\\\')
+
+    def test_vba_modules(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsm')
+        write_workbook(path, '')
+        with zipfile.ZipFile(BOOK1) as z, zipfile.ZipFile(path, 'a') as package:
+            package.writestr('xl/vbaProject.bin', z.read('xl/vbaProject.bin'))
+        output = self.render(path)
+        self.assertRegex(output, r'\nVBA/Module/Module3 \[[0-9a-f]{40}\]\n    Option Explicit\n')
+        self.assertIn('\n    Public Function GetVersion() As String\n', output)
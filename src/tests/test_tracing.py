@@ -0,0 +1,56 @@
+import os
+import json
+import tempfile
+import tracing
+from unittest import TestCase, mock
+
+
+class TestPhase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'trace.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            with tracing.phase('diff', path=self.path) as fields:
+                fields['lines'] = 1
+        self.assertFalse(os.path.exists(self.path))
+        self.assertNotIn('size', fields)
+
+    def test_records(self):
+        with mock.patch.dict(os.environ, {tracing.TRACE_VARIABLE: self.path}):
+            with tracing.phase('diff', modules=2) as fields:
+                fields['lines'] = 10
+            with tracing.phase('open_workbook', path=self.path):
+                pass
+        records = self.read()
+        self.assertEqual([r['phase'] for r in records], ['diff', 'open_workbook'])
+        self.assertEqual((records[0]['modules'], records[0]['lines']), (2, 10))
+        self.assertGreaterEqual(records[0]['seconds'], 0)
+        self.assertGreater(records[1]['size'], 0)
+
+    def test_records_on_error(self):
+        with mock.patch.dict(os.environ, {tracing.TRACE_VARIABLE: self.path}):
+            with self.assertRaises(SystemExit):
+                with tracing.phase('merge'):
+                    raise SystemExit(1)
+        self.assertEqual([r['phase'] for r in self.read()], ['merge'])
+
+
+class TestProfile(TestCase):
+
+    def test_dump(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'diff.prof')
+            with mock.patch.dict(os.environ, {tracing.PROFILE_VARIABLE: path}), mock.patch('sys.stderr'):
+                with tracing.profile('diff'):
+                    sum(range(100))
+            self.assertTrue(os.path.exists(path))
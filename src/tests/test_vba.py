@@ -0,0 +1,69 @@
+import os
+import zipfile
+import tempfile
+import vba
+from unittest import TestCase
+
+
+BOOK1 = os.path.join(os.path.dirname(__file__), 'Book1.xlsb')
+
+
+class TestDecompress(TestCase):
+
+    def test_literals(self):
+        data = bytes.fromhex('0119B000616263646566676800696A6B6C6D6E6F7000717273747576 2E'.replace(' ', ''))
+        self.assertEqual(vba.decompress(data), b'abcdefghijklmnopqrstuv.')
+
+    def test_copy_tokens(self):
+        data = bytes.fromhex('012FB000236161616263646582660070616768696A013808616B6C00306D6E6F70067102700410'
+                             '72737475761077787 97A003C'.replace(' ', ''))
+        self.assertEqual(vba.decompress(data), b'#aaabcdefaaaaghijaaaaaklaaamnopqaaaaaaaaaaaarstuvwxyzaaa')
+
+    def test_uncompressed_chunk(self):
+        data = b'\x01' + (0x3FFF).to_bytes(2, 'little') + b'x' * 4096
+        self.assertEqual(vba.decompress(data), b'x' * 4096)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            vba.decompress(b'\x00\x00')
+
+
+class TestReadVBAModules(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_package(self):
+        modules = vba.read_vba_modules(BOOK1)
+        self.assertEqual([(m.name, m.type) for m in modules], [
+            ('ThisWorkbook', 'Document'), ('Sheet1', 'Document'), ('Module1', 'Module'),
+            ('Module2', 'Module'), ('Module3', 'Module'), ('newModule', 'Module')])
+        module3 = modules[4]
+        self.assertEqual(module3.content.split('\n')[:4],
+                         ['Option Explicit', '', 'Public Function GetVersion() As String', '    GetVersion = "v0.0.1"'])
+        self.assertEqual(modules[0].digest, modules[1].digest)
+        self.assertNotEqual(modules[2].digest, modules[3].digest)
+
+    def test_compound_file(self):
+        # a vbaProject.bin on its own is read like a legacy .xls workbook, through mmap
+        path = os.path.join(self.tmp_dir.name, 'vbaProject.bin')
+        with zipfile.ZipFile(BOOK1) as z, open(path, 'wb') as f:
+            f.write(z.read('xl/vbaProject.bin'))
+        self.assertEqual([(m.name, m.digest) for m in vba.read_vba_modules(path)],
+                         [(m.name, m.digest) for m in vba.read_vba_modules(BOOK1)])
+
+    def test_no_vba_project(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.xlsx')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('xl/workbook.xml', '<workbook/>')
+        self.assertEqual(vba.read_vba_modules(path), [])
+
+    def test_unsupported(self):
+        path = os.path.join(self.tmp_dir.name, 'Book1.csv')
+        with open(path, 'w') as f:
+            f.write('a,b\n')
+        with self.assertRaises(ValueError):
+            vba.read_vba_modules(path)
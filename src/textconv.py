@@ -0,0 +1,65 @@
+"""Render workbooks as text for Git's textconv.
+
+With `diff.xl.textconv` set, git log -p, --stat, --word-diff and the pickaxe
+options work on this rendering, and with `diff.xl.cachetextconv` Git keeps it
+in refs/notes/textconv/xl, so every blob is only rendered once. The output
+is stable: sheets and modules are listed in workbook order, cells in row
+and column order, and every cell is on a line of its own.
+"""
+import sys
+
+import server
+import tracing
+import vba
+from workbook import load_workbook
+
+
+def escape(value):
+    """Keep multi-line cell values on a single line."""
+    return str(value).replace('\\', '\\\\').replace('\r', '\\r').replace('\n', '\\n')
+
+
+def format_cell(sheet_name, cell):
+    if not hasattr(cell, 'value'):
+        # xltrail-core only exposes a fingerprint of the cell content
+        return f'{sheet_name}!{cell.address}: [{cell.fingerprint}]'
+    formula = getattr(cell, 'formula', None)
+    if formula:
+        return f'{sheet_name}!{cell.address}: {escape(formula)} [{escape(cell.value)}]'
+    return f'{sheet_name}!{cell.address}: {escape(cell.value)}'
+
+
+def iter_lines(path):
+    """Yield the lines of the text rendering of a workbook."""
+    wb = load_workbook(path)
+    for sheet in wb.worksheets:
+        with tracing.phase('textconv.sheet', sheet=sheet.name) as fields:
+            cells = sorted(sheet.cells, key=lambda cell: (cell.row, cell.column))
+            fields['cells'] = len(cells)
+        # the digest is read after the cells, the Office Open XML backend computes it on the same pass
+        yield f'Worksheet {sheet.name} ({len(cells)} cells) [{sheet.digest}]'
+        for cell in cells:
+            yield format_cell(sheet.name, cell)
+        yield ''
+
+    for module in vba.read_vba_modules(path):
+        yield f'VBA/{module.type}/{module.name} [{module.digest}]'
+        for line in module.content.split('\n'):
+            yield '    ' + line
+        yield ''
+
+
+def write_textconv(stream, path):
+    for line in iter_lines(path):
+        stream.write(line + '\n')
+
+
+def main(args):
+    if len(args) != 1:
+        print('Usage: git xl textconv <file>')
+        sys.exit(1)
+    write_textconv(sys.stdout, args[0])
+
+
+if __name__ == '__main__':
+    sys.exit(server.forward('textconv', sys.argv[1:]))
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import tempfile
+import contextlib
+
+
+TRACE_VARIABLE = 'GIT_XL_TRACE'
+PROFILE_VARIABLE = 'GIT_XL_PROFILE'
+
+
+def is_enabled():
+    return bool(os.environ.get(TRACE_VARIABLE))
+
+
+def emit(phase, **fields):
+    """Append a record for `phase` to the file named by GIT_XL_TRACE, if set.
+
+    Each record is a JSON object on its own line, with the phase name, the
+    process id and the given fields (timings, counts, sizes).
+    """
+    path = os.environ.get(TRACE_VARIABLE)
+    if not path:
+        return
+    record = dict(phase=phase, pid=os.getpid(), time=time.time(), **fields)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+@contextlib.contextmanager
+def phase(name, **fields):
+    """Time the enclosed block and emit it as `name` with the given fields.
+
+    The yielded dict can be used to add counts that are only known at the end
+    of the block. A `path` field is recorded together with the size of the
+    file. When tracing is off, nothing is timed, measured or written.
+    """
+    if not is_enabled():
+        yield fields
+        return
+    if 'path' in fields:
+        fields['size'] = file_size(fields['path'])
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        emit(name, seconds=time.perf_counter() - start, **fields)
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+@contextlib.contextmanager
+def profile(command):
+    """Profile the enclosed block with cProfile when GIT_XL_PROFILE is set.
+
+    With GIT_XL_PROFILE=1, the stats are written to git-xl-<command>-<pid>.prof
+    in the temp folder; any other value is used as the path of the stats file.
+    """
+    setting = os.environ.get(PROFILE_VARIABLE)
+    if not setting or setting == '0':
+        yield
+        return
+    path = setting
+    if setting == '1':
+        path = os.path.join(tempfile.gettempdir(), f'git-xl-{command}-{os.getpid()}.prof')
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f'Profile written to {path}', file=sys.stderr)
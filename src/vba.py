@@ -0,0 +1,346 @@
+"""Read VBA projects without xltrail-core.
+
+VBA projects are stored in a Compound File Binary container: `xl/vbaProject.bin`
+inside Office Open XML packages, or the legacy `.xls` file itself. The `dir`
+stream lists the modules, and the source code of each module is stored in its
+stream compressed with the MS-OVBA algorithm. Only the `dir`, `PROJECT` and
+module streams are read, and a module's source is only decompressed when its
+content or digest is accessed.
+"""
+import sys
+import mmap
+import codecs
+import struct
+import hashlib
+import zipfile
+from array import array
+
+
+SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+MAXREGSECT = 0xFFFFFFFA
+NOSTREAM = 0xFFFFFFFF
+STORAGE, STREAM, ROOT = 1, 2, 5
+
+# record ids of the dir stream (MS-OVBA 2.3.4.2)
+PROJECTCODEPAGE = 0x0003
+PROJECTVERSION = 0x0009
+PROJECTEND = 0x0010
+MODULENAME = 0x0019
+MODULESTREAMNAME = 0x001A
+MODULETYPEPROCEDURAL = 0x0021
+MODULETYPEOTHER = 0x0022
+MODULEOFFSET = 0x0031
+MODULESTREAMNAMEUNICODE = 0x0032
+MODULENAMEUNICODE = 0x0047
+
+# module types as reported by xltrail-core, keyed by the PROJECT stream properties
+PROJECT_MODULE_TYPES = {'module': 'Module', 'document': 'Document', 'class': 'Class', 'baseclass': 'Form'}
+
+
+class DirectoryEntry:
+    __slots__ = ('name', 'type', 'left', 'right', 'child', 'start', 'size', 'children')
+
+    def __init__(self, name, type, left, right, child, start, size):
+        self.name = name
+        self.type = type
+        self.left = left
+        self.right = right
+        self.child = child
+        self.start = start
+        self.size = size
+        self.children = {}
+
+
+class CompoundFile:
+    """Minimal reader for Compound File Binary containers ([MS-CFB]).
+
+    `data` is any buffer, e.g. an mmap of the file, and only the sectors of
+    the streams that are read are touched. Call `close()` before closing an
+    underlying mmap.
+    """
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        if bytes(self.data[:8]) != SIGNATURE:
+            raise ValueError('not a Compound File')
+        sector_shift, mini_sector_shift = struct.unpack_from('<HH', self.data, 0x1E)
+        (n_fat_sectors, first_directory_sector, _, self.mini_stream_cutoff, first_mini_fat_sector,
+         _, first_difat_sector, n_difat_sectors) = struct.unpack_from('<8I', self.data, 0x2C)
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+
+        # the first 109 FAT sectors are listed in the header, the others in the DIFAT chain
+        fat_sectors = list(struct.unpack_from('<109I', self.data, 0x4C))
+        per_sector = self.sector_size // 4
+        sector = first_difat_sector
+        for _ in range(n_difat_sectors):
+            if sector > MAXREGSECT:
+                break
+            entries = struct.unpack_from(f'<{per_sector}I', self.data, self.offset(sector))
+            fat_sectors.extend(entries[:-1])
+            sector = entries[-1]
+        self.fat = self.read_table(sector for sector in fat_sectors[:n_fat_sectors] if sector <= MAXREGSECT)
+        self.mini_fat = self.read_table(self.chain(first_mini_fat_sector, self.fat))
+        self._mini_stream = None
+
+        self.entries = self.read_directory(first_directory_sector)
+        self.root = self.entries[0]
+
+    def close(self):
+        self.data.release()
+
+    def offset(self, sector):
+        return (sector + 1) * self.sector_size
+
+    def read_table(self, sectors):
+        table = array('I')
+        for sector in sectors:
+            table.frombytes(bytes(self.data[self.offset(sector):self.offset(sector) + self.sector_size]))
+        if sys.byteorder == 'big':
+            table.byteswap()
+        return table
+
+    def chain(self, sector, table):
+        """Yield the sectors of the chain starting at `sector`."""
+        for _ in range(len(table) + 1):
+            if sector > MAXREGSECT or sector >= len(table):
+                return
+            yield sector
+            sector = table[sector]
+        raise ValueError('cyclic sector chain')
+
+    def read_directory(self, first_sector):
+        data = b''.join(bytes(self.data[self.offset(sector):self.offset(sector) + self.sector_size])
+                        for sector in self.chain(first_sector, self.fat))
+        entries = []
+        for pos in range(0, len(data) - 127, 128):
+            name_length, entry_type = struct.unpack_from('<HB', data, pos + 0x40)
+            left, right, child = struct.unpack_from('<3I', data, pos + 0x44)
+            start, size = struct.unpack_from('<IQ', data, pos + 0x74)
+            if self.sector_size == 512:
+                # version 3 files only use the low 32 bits of the size
+                size &= 0xFFFFFFFF
+            name = data[pos:pos + max(name_length - 2, 0)].decode('utf-16-le', errors='replace')
+            entries.append(DirectoryEntry(name, entry_type, left, right, child, start, size))
+
+        # the children of a storage are kept in a tree of siblings
+        for entry in entries:
+            if entry.type not in (STORAGE, ROOT):
+                continue
+            stack = [entry.child]
+            seen = set()
+            while stack:
+                i = stack.pop()
+                if i == NOSTREAM or i >= len(entries) or i in seen:
+                    continue
+                seen.add(i)
+                child = entries[i]
+                entry.children[child.name.lower()] = child
+                stack += [child.left, child.right]
+        return entries
+
+    @property
+    def mini_stream(self):
+        if self._mini_stream is None:
+            self._mini_stream = self.read(self.root)
+        return self._mini_stream
+
+    def read(self, entry):
+        """Return the content of a stream."""
+        if entry.type != ROOT and entry.size < self.mini_stream_cutoff:
+            size = self.mini_sector_size
+            data = self.mini_stream
+            chunks = [data[sector * size:(sector + 1) * size] for sector in self.chain(entry.start, self.mini_fat)]
+        else:
+            size = self.sector_size
+            chunks = [self.data[self.offset(sector):self.offset(sector) + size]
+                      for sector in self.chain(entry.start, self.fat)]
+        return b''.join(chunks)[:entry.size]
+
+
+def decompress(data):
+    """Decompress a CompressedContainer (MS-OVBA 2.4.1)."""
+    if not data or data[0] != 1:
+        raise ValueError('invalid compressed container')
+    out = bytearray()
+    pos = 1
+    while pos < len(data) - 1:
+        header = data[pos] | data[pos + 1] << 8
+        chunk_end = min(pos + (header & 0x0FFF) + 3, len(data))
+        pos += 2
+        if not header & 0x8000:
+            out += data[pos:chunk_end]
+            pos = chunk_end
+            continue
+
+        chunk_start = len(out)
+        while pos < chunk_end:
+            flags = data[pos]
+            pos += 1
+            for bit in range(8):
+                if pos >= chunk_end:
+                    break
+                if not flags & (1 << bit):
+                    out.append(data[pos])
+                    pos += 1
+                    continue
+                # copy token: the split between offset and length bits grows with the position
+                if pos + 1 >= chunk_end:
+                    raise ValueError('truncated copy token')
+                token = data[pos] | data[pos + 1] << 8
+                pos += 2
+                bit_count = max((len(out) - chunk_start - 1).bit_length(), 4)
+                length = (token & (0xFFFF >> bit_count)) + 3
+                offset = (token >> (16 - bit_count)) + 1
+                copy_start = len(out) - offset
+                if copy_start < chunk_start:
+                    raise ValueError('invalid copy token')
+                pattern = out[copy_start:copy_start + length]
+                out += (pattern * (length // len(pattern) + 1))[:length]
+    return bytes(out)
+
+
+def get_codec(codepage):
+    if codepage == 65001:
+        return 'utf-8'
+    try:
+        return codecs.lookup(f'cp{codepage}').name
+    except LookupError:
+        return 'latin-1'
+
+
+class Module:
+    """A VBA module; its source is decompressed on first access of `content` or `digest`."""
+
+    __slots__ = ('name', 'type', '_data', '_codec', '_content', '_digest')
+
+    def __init__(self, name, type, data, codec):
+        self.name = name
+        self.type = type
+        self._data = data
+        self._codec = codec
+        self._content = None
+        self._digest = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            source = decompress(self._data).decode(self._codec, errors='replace')
+            # like the VBA editor, hide attributes and use \n line endings
+            lines = source.replace('\r\n', '\n').split('\n')
+            self._content = '\n'.join(line for line in lines if not line.startswith('Attribute '))
+            self._data = None
+        return self._content
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha1(self.content.encode('utf-8')).hexdigest()
+        return self._digest
+
+
+def parse_dir(data):
+    """Return (codec, modules) from a decompressed dir stream; modules are dicts of their records."""
+    codec = get_codec(1252)
+    modules = []
+    module = None
+    pos = 0
+    while pos + 6 <= len(data):
+        record_id, size = struct.unpack_from('<HI', data, pos)
+        pos += 6
+        if record_id == PROJECTVERSION:
+            # the size field of this record does not include its last 2 bytes
+            size = 6
+        value = data[pos:pos + size]
+        pos += size
+        if record_id == PROJECTCODEPAGE:
+            codec = get_codec(struct.unpack('<H', value)[0])
+        elif record_id == MODULENAME:
+            module = {'name': value.decode(codec, errors='replace')}
+            modules.append(module)
+        elif module is None:
+            continue
+        elif record_id == MODULENAMEUNICODE:
+            module['name'] = value.decode('utf-16-le', errors='replace')
+        elif record_id == MODULESTREAMNAME:
+            module['stream'] = value.decode(codec, errors='replace')
+        elif record_id == MODULESTREAMNAMEUNICODE:
+            module['stream'] = value.decode('utf-16-le', errors='replace')
+        elif record_id == MODULEOFFSET:
+            module['offset'] = struct.unpack('<I', value)[0]
+        elif record_id == MODULETYPEPROCEDURAL:
+            module['type'] = 'Module'
+        elif record_id == MODULETYPEOTHER:
+            module['type'] = 'Class'
+        elif record_id == PROJECTEND:
+            break
+    return codec, modules
+
+
+def parse_project(data, codec):
+    """Return {module name: type} from the PROJECT stream."""
+    types = {}
+    for line in data.decode(codec, errors='replace').splitlines():
+        key, _, value = line.partition('=')
+        module_type = PROJECT_MODULE_TYPES.get(key.strip().lower())
+        if module_type:
+            types[value.split('/')[0].strip()] = module_type
+        elif line.startswith('['):
+            break
+    return types
+
+
+def find_vba_storage(storage):
+    """Return (project storage, VBA storage) of the first VBA project below `storage`."""
+    stack = [storage]
+    while stack:
+        storage = stack.pop()
+        vba = storage.children.get('vba')
+        if vba is not None and vba.type == STORAGE and 'dir' in vba.children:
+            return storage, vba
+        stack += [child for child in storage.children.values() if child.type == STORAGE]
+    return None, None
+
+
+def read_vba_project(data):
+    """Return the modules of the VBA project stored in a Compound File (bytes or mmap)."""
+    cf = CompoundFile(data)
+    try:
+        project, vba = find_vba_storage(cf.root)
+        if vba is None:
+            return []
+        codec, records = parse_dir(decompress(cf.read(vba.children['dir'])))
+        types = {}
+        if 'project' in project.children:
+            types = parse_project(cf.read(project.children['project']), codec)
+
+        modules = []
+        for record in records:
+            stream = vba.children.get(record.get('stream', record['name']).lower())
+            if stream is None:
+                raise ValueError(f'missing stream of VBA module {record["name"]}')
+            source = cf.read(stream)[record.get('offset', 0):]
+            module_type = types.get(record['name'], record.get('type', 'Module'))
+            modules.append(Module(record['name'], module_type, source, codec))
+        return modules
+    finally:
+        cf.close()
+
+
+def read_vba_modules(path):
+    """Return the VBA modules of a workbook, or [] if it has no VBA project.
+
+    Supports Office Open XML packages (.xlsm, .xlsb, ...) and legacy Compound
+    File workbooks (.xls, ...).
+    """
+    with open(path, 'rb') as f:
+        if f.read(8) == SIGNATURE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return read_vba_project(data)
+    if not zipfile.is_zipfile(path):
+        raise ValueError(f'unsupported file format: {path}')
+    with zipfile.ZipFile(path) as z:
+        for name in z.namelist():
+            if name.lower().endswith('/vbaproject.bin'):
+                return read_vba_project(z.read(name))
+    return []
@@ -0,0 +1,43 @@
+import os
+
+import ooxml
+import tracing
+
+
+_Workbook = None
+
+
+def load_engine():
+    """Load the .NET runtime and the xltrail-core assembly (once per process)."""
+    global _Workbook
+    if _Workbook is None:
+        with tracing.phase('load_engine'):
+            import clr
+            clr.AddReference('xltrail-core')
+            from xltrail.core import Workbook
+        _Workbook = Workbook
+    return _Workbook
+
+
+def get_backend(path, writable=False):
+    """Return the workbook class for `path`.
+
+    Office Open XML packages are read with the pure Python reader of the
+    `ooxml` module; other formats, and workbooks that are going to be
+    modified, need xltrail-core.
+    """
+    ext = os.path.splitext(path)[1][1:].lower()
+    if not writable and ext in ooxml.FILE_EXTENSIONS:
+        return ooxml.Workbook
+    return load_engine()
+
+
+def load_workbook(path, writable=False):
+    """Open a workbook, with the backend that fits its file type.
+
+    The workbook engine is only loaded on first use, so callers that never
+    need it do not pay for it.
+    """
+    engine = get_backend(path, writable)
+    with tracing.phase('open_workbook', path=path):
+        return engine(path)